@@ -1,5 +1,7 @@
 from django.contrib import admin
-from .models import Battery, BatteryAlert, BatteryLog, BatteryDevice
+from .models import (
+    AlertRule, Battery, BatteryAlert, BatteryHealthEstimate, BatteryLog, BatteryLogRollup, BatteryDevice
+)
 
 
 @admin.register(Battery)
@@ -34,10 +36,19 @@ class BatteryAdmin(admin.ModelAdmin):
 
 @admin.register(BatteryAlert)
 class BatteryAlertAdmin(admin.ModelAdmin):
-    list_display = ['battery', 'alert_type', 'alert_level', 'is_resolved', 'created_at']
+    list_display = ['battery', 'alert_type', 'alert_level', 'is_resolved', 'occurrence_count', 'created_at', 'last_seen']
     list_filter = ['alert_type', 'alert_level', 'is_resolved', 'created_at']
     search_fields = ['battery__serial_number', 'message']
-    readonly_fields = ['created_at', 'resolved_at']
+    readonly_fields = ['occurrence_count', 'created_at', 'last_seen', 'resolved_at']
+
+
+@admin.register(AlertRule)
+class AlertRuleAdmin(admin.ModelAdmin):
+    list_display = ['name', 'alert_type', 'alert_level', 'metric', 'operator', 'threshold',
+                    'battery_type', 'device', 'is_active']
+    list_filter = ['alert_type', 'alert_level', 'metric', 'is_active']
+    search_fields = ['name', 'battery_type', 'message']
+    readonly_fields = ['created_at', 'updated_at']
 
 
 @admin.register(BatteryLog)
@@ -54,6 +65,32 @@ class BatteryLogAdmin(admin.ModelAdmin):
         return False
 
 
+@admin.register(BatteryLogRollup)
+class BatteryLogRollupAdmin(admin.ModelAdmin):
+    list_display = ['battery', 'resolution', 'bucket', 'count', 'temperature_min', 'temperature_max']
+    list_filter = ['resolution', 'bucket']
+    search_fields = ['battery__serial_number']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(BatteryHealthEstimate)
+class BatteryHealthEstimateAdmin(admin.ModelAdmin):
+    list_display = ['battery', 'health_percentage', 'equivalent_cycles', 'internal_resistance',
+                    'remaining_days', 'estimated_at']
+    search_fields = ['battery__serial_number']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(BatteryDevice)
 class BatteryDeviceAdmin(admin.ModelAdmin):
     list_display = ['device_name', 'device_type', 'serial_number', 'is_active', 'created_at']
@@ -0,0 +1,147 @@
+"""
+Single-pass aggregate queries for the dashboard.
+
+Bucket boundaries are declared once here and turned into conditional
+aggregates, so every count and average for a table comes back from one
+query instead of one COUNT per bucket.
+"""
+from collections import namedtuple
+import numpy as np
+from django.db.models import Avg, Count, Q
+from .models import Battery, BatteryAlert, BatteryDevice
+
+
+Bucket = namedtuple('Bucket', ['label', 'lower', 'upper'])
+
+
+class BucketSpec:
+    """Labelled value ranges over one Battery field."""
+
+    def __init__(self, name, field, buckets, right_closed=False):
+        self.name = name
+        self.field = field
+        self.buckets = buckets
+        # Ranges are [lower, upper) by default and (lower, upper] when right_closed.
+        self.right_closed = right_closed
+
+    def q(self, bucket):
+        lower_op, upper_op = ('gt', 'lte') if self.right_closed else ('gte', 'lt')
+        q = Q()
+        if bucket.lower is not None:
+            q &= Q(**{f'{self.field}__{lower_op}': bucket.lower})
+        if bucket.upper is not None:
+            q &= Q(**{f'{self.field}__{upper_op}': bucket.upper})
+        return q
+
+    def contains(self, bucket, value):
+        if self.right_closed:
+            return ((bucket.lower is None or value > bucket.lower) and
+                    (bucket.upper is None or value <= bucket.upper))
+        return ((bucket.lower is None or value >= bucket.lower) and
+                (bucket.upper is None or value < bucket.upper))
+
+    def mask(self, bucket, values):
+        """Vectorized contains() over a NumPy array."""
+        mask = np.ones(len(values), dtype=bool)
+        if bucket.lower is not None:
+            mask &= values > bucket.lower if self.right_closed else values >= bucket.lower
+        if bucket.upper is not None:
+            mask &= values <= bucket.upper if self.right_closed else values < bucket.upper
+        return mask
+
+    def bucket_for(self, value):
+        """Return the label of the bucket holding value, or None."""
+        for bucket in self.buckets:
+            if self.contains(bucket, value):
+                return bucket.label
+        return None
+
+    def aliases(self):
+        return [(f'{self.name}_{i}', bucket) for i, bucket in enumerate(self.buckets)]
+
+
+HEALTH_BUCKETS = BucketSpec('health', 'health_percentage', [
+    Bucket('Excellent (90-100%)', 90, None),
+    Bucket('Good (70-89%)', 70, 90),
+    Bucket('Fair (50-69%)', 50, 70),
+    Bucket('Poor (<50%)', None, 50),
+])
+
+CHARGE_BUCKETS = BucketSpec('charge', 'current_charge', [
+    Bucket('Full (90-100%)', 90, None),
+    Bucket('High (70-89%)', 70, 90),
+    Bucket('Medium (40-69%)', 40, 70),
+    Bucket('Low (10-39%)', 10, 40),
+    Bucket('Critical (<10%)', None, 10),
+])
+
+CYCLE_BUCKETS = BucketSpec('cycles', 'cycle_count', [
+    Bucket('New (0-100)', None, 100),
+    Bucket('Good (100-500)', 100, 500),
+    Bucket('Aging (500-1000)', 500, 1000),
+    Bucket('Old (1000+)', 1000, None),
+], right_closed=True)
+
+BUCKET_SPECS = [HEALTH_BUCKETS, CHARGE_BUCKETS, CYCLE_BUCKETS]
+
+ACTIVE_STATUSES = ['CHARGING', 'DISCHARGING']
+LOW_HEALTH_THRESHOLD = 50
+
+
+def battery_aggregates():
+    """Every Battery count, average and bucket in one query."""
+    expressions = {
+        'total': Count('id'),
+        'active': Count('id', filter=Q(current_status__in=ACTIVE_STATUSES)),
+        'faulty': Count('id', filter=Q(current_status='FAULT')),
+        'low_health': Count('id', filter=Q(health_percentage__lt=LOW_HEALTH_THRESHOLD)),
+        'avg_health': Avg('health_percentage'),
+        'avg_charge': Avg('current_charge'),
+        'avg_temperature': Avg('current_temperature'),
+    }
+    for status, _ in Battery.STATUS_CHOICES:
+        expressions[f'status_{status}'] = Count('id', filter=Q(current_status=status))
+    for spec in BUCKET_SPECS:
+        for alias, bucket in spec.aliases():
+            expressions[alias] = Count('id', filter=spec.q(bucket))
+
+    row = Battery.objects.aggregate(**expressions)
+
+    result = {
+        'total': row['total'],
+        'active': row['active'],
+        'faulty': row['faulty'],
+        'low_health': row['low_health'],
+        'avg_health': row['avg_health'] or 0,
+        'avg_charge': row['avg_charge'] or 0,
+        'avg_temperature': row['avg_temperature'] or 0,
+        'status': [
+            {'current_status': status, 'count': row[f'status_{status}']}
+            for status, _ in Battery.STATUS_CHOICES if row[f'status_{status}']
+        ],
+    }
+    for spec in BUCKET_SPECS:
+        result[spec.name] = {bucket.label: row[alias] for alias, bucket in spec.aliases()}
+    return result
+
+
+def battery_type_counts():
+    """Battery count per type (open-ended, so it stays a GROUP BY)."""
+    return list(Battery.objects.order_by().values('battery_type').annotate(count=Count('id')))
+
+
+def alert_aggregates():
+    """Alert totals in one query."""
+    return BatteryAlert.objects.aggregate(
+        total=Count('id'),
+        unresolved=Count('id', filter=Q(is_resolved=False)),
+        critical=Count('id', filter=Q(alert_level='CRITICAL', is_resolved=False)),
+    )
+
+
+def device_aggregates():
+    """Device totals in one query."""
+    return BatteryDevice.objects.aggregate(
+        total=Count('id'),
+        active=Count('id', filter=Q(is_active=True)),
+    )
@@ -0,0 +1,169 @@
+"""
+Asynchronous alert evaluation.
+
+Readings are snapshotted and pushed onto a queue when their transaction
+commits; a pool of worker threads drains it in batches, evaluates the
+alert rules (see rules.py) and the anomaly detector (see anomaly.py), and
+records the results with record_alerts(), which folds repeats into the
+open alert for each battery and alert type. The queue is bounded: when it
+is full, submit() waits up to BATTERY_ALERT_QUEUE_PUT_TIMEOUT seconds and
+then evaluates inline, so producers slow down instead of alerts being
+dropped.
+
+The queue backend is pluggable through BATTERY_ALERT_QUEUE_BACKEND (a
+dotted path to a class with put/get_batch/qsize); the default is an
+in-process queue.
+"""
+import logging
+import queue
+import threading
+import time
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils.module_loading import import_string
+from .alerts import record_alerts
+from .anomaly import ANOMALY_DETECTION, anomaly_detector
+from .broadcast import broadcast_buffer
+from .rules import evaluate_readings, reading_from_battery
+from .snapshot import mark_dashboard_dirty
+
+
+logger = logging.getLogger(__name__)
+
+ALERT_WORKERS = getattr(settings, 'BATTERY_ALERT_WORKERS', 2)
+ALERT_BATCH_SIZE = getattr(settings, 'BATTERY_ALERT_BATCH_SIZE', 500)
+ALERT_QUEUE_SIZE = getattr(settings, 'BATTERY_ALERT_QUEUE_SIZE', 100000)
+ALERT_QUEUE_PUT_TIMEOUT = getattr(settings, 'BATTERY_ALERT_QUEUE_PUT_TIMEOUT', 1.0)
+ALERT_QUEUE_BACKEND = getattr(settings, 'BATTERY_ALERT_QUEUE_BACKEND', 'batteries.alert_pipeline.LocalQueueBackend')
+
+class LocalQueueBackend:
+    """Bounded in-process queue."""
+
+    def __init__(self, maxsize=ALERT_QUEUE_SIZE):
+        self._queue = queue.Queue(maxsize=maxsize)
+
+    def put(self, item, timeout=None):
+        """Enqueue item; raise queue.Full if no room frees up within timeout."""
+        self._queue.put(item, timeout=timeout)
+
+    def get_batch(self, max_items, timeout=None):
+        """Block up to timeout for the first item, then take whatever else is ready."""
+        try:
+            items = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(items) < max_items:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def qsize(self):
+        return self._queue.qsize()
+
+
+class AlertPipeline:
+    """Queue plus worker pool that turns readings into BatteryAlert rows."""
+
+    def __init__(self, backend=None, workers=ALERT_WORKERS, batch_size=ALERT_BATCH_SIZE):
+        self.backend = backend or import_string(ALERT_QUEUE_BACKEND)()
+        self.workers = workers
+        self.batch_size = batch_size
+        self._threads = []
+        self._lock = threading.Lock()
+        self._metrics = {
+            'submitted': 0,
+            'evaluated': 0,
+            'alerts_created': 0,
+            'alerts_repeated': 0,
+            'batches': 0,
+            'inline': 0,
+            'errors': 0,
+            'last_lag': 0.0,
+            'max_lag': 0.0,
+        }
+
+    def submit(self, batteries):
+        """Queue the current readings of batteries for evaluation once the transaction commits."""
+        self.submit_readings([reading_from_battery(battery) for battery in batteries])
+
+    def submit_readings(self, readings):
+        if readings:
+            # robust: an evaluation error must not fail a request whose readings are already saved.
+            transaction.on_commit(lambda: self._enqueue(readings), robust=True)
+
+    def _enqueue(self, readings):
+        with self._lock:
+            self._metrics['submitted'] += len(readings)
+        if self.workers <= 0:
+            self.process(readings)
+            return
+
+        self._ensure_workers()
+        overflow = []
+        for reading in readings:
+            try:
+                self.backend.put(reading, timeout=ALERT_QUEUE_PUT_TIMEOUT)
+            except queue.Full:
+                overflow.append(reading)
+        if overflow:
+            # Backpressure: the producer pays for evaluation rather than losing alerts.
+            with self._lock:
+                self._metrics['inline'] += len(overflow)
+            self.process(overflow)
+
+    def _ensure_workers(self):
+        with self._lock:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(
+                    target=self._run, name=f'battery-alerts-{len(self._threads)}', daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            batch = self.backend.get_batch(self.batch_size, timeout=1.0)
+            if not batch:
+                continue
+            try:
+                self.process(batch)
+            except Exception:
+                logger.exception('Alert evaluation failed for %d readings', len(batch))
+                with self._lock:
+                    self._metrics['errors'] += len(batch)
+            finally:
+                close_old_connections()
+
+    def process(self, readings):
+        """Evaluate a batch of readings and record the alerts they raise."""
+        raised = evaluate_readings(readings)
+        if ANOMALY_DETECTION:
+            raised += anomaly_detector.observe(readings)
+        created, changed = record_alerts(raised)
+        if raised:
+            mark_dashboard_dirty()
+        if created or changed:
+            broadcast_buffer.add(alert_ids=[alert.pk for alert in created + changed if alert.pk is not None])
+
+        lag = time.time() - min(reading.enqueued_at for reading in readings)
+        with self._lock:
+            self._metrics['evaluated'] += len(readings)
+            self._metrics['alerts_created'] += len(created)
+            self._metrics['alerts_repeated'] += len(raised) - len(created)
+            self._metrics['batches'] += 1
+            self._metrics['last_lag'] = lag
+            self._metrics['max_lag'] = max(self._metrics['max_lag'], lag)
+        return created
+
+    def metrics(self):
+        with self._lock:
+            metrics = dict(self._metrics)
+        metrics['queue_depth'] = self.backend.qsize()
+        metrics['workers'] = sum(1 for thread in self._threads if thread.is_alive())
+        return metrics
+
+
+alert_pipeline = AlertPipeline()
@@ -0,0 +1,144 @@
+"""
+Alert de-duplication and bulk resolution.
+
+A battery has at most one open alert per alert type. Readings that keep
+crossing the same threshold bump that alert's occurrence_count and
+last_seen instead of inserting new rows. After an alert is resolved,
+repeat crossings within BATTERY_ALERT_SUPPRESSION_WINDOW seconds are
+folded into the resolved alert too, so a battery hovering around a
+threshold does not re-raise it on every reading. Callers that must end up
+with an open alert, such as the communication watchdog, can opt out of
+that suppression.
+
+resolve_alerts() closes any number of alerts with a single UPDATE and
+one aggregated broadcast.
+"""
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from .broadcast import broadcast_buffer, broadcast_to_dashboard
+from .fleet_state import fleet_state
+from .locking import serialized_writes
+from .models import BatteryAlert
+from .snapshot import mark_dashboard_dirty
+
+
+ALERT_SUPPRESSION_WINDOW = getattr(settings, 'BATTERY_ALERT_SUPPRESSION_WINDOW', 300)
+# Bulk resolutions touching more alerts than this send one summary frame
+# instead of the resolved alerts themselves.
+BULK_BROADCAST_MAX_ALERTS = getattr(settings, 'BATTERY_BULK_BROADCAST_MAX_ALERTS', 5000)
+MAX_RETRIES = 3
+
+
+def record_alerts(candidates, now=None, suppress=True):
+    """
+    Store raised alerts, merging repeats into existing rows.
+
+    candidates are dicts with battery_id, alert_type, alert_level and
+    message, in reading order; the latest level and message win. Returns
+    (created, changed): alerts that were inserted, and existing alerts whose
+    level changed. Repeats that only bump counters are in neither list, so
+    they need no broadcast. With suppress=False only open alerts absorb
+    repeats, and a recently resolved alert is left alone.
+    """
+    now = now or timezone.now()
+    merged = {}
+    for candidate in candidates:
+        key = (candidate['battery_id'], candidate['alert_type'])
+        count = merged[key][1] + 1 if key in merged else 1
+        merged[key] = (candidate, count)
+    if not merged:
+        return [], []
+
+    for attempt in range(MAX_RETRIES):
+        try:
+            with serialized_writes(), transaction.atomic():
+                created, changed = _apply_alerts(merged, now, suppress)
+                transaction.on_commit(lambda: _count_alerts(created, changed))
+            return created, changed
+        except IntegrityError:
+            # Another worker opened one of these alerts first; retry as an update.
+            if attempt == MAX_RETRIES - 1:
+                raise
+
+
+def _count_alerts(created, changed):
+    # Bulk writes skip post_save, so keep the fleet counters in step here.
+    fleet_state.update_alerts(created, created=True)
+    fleet_state.update_alerts(changed)
+
+
+def _apply_alerts(merged, now, suppress=True):
+    battery_ids = {battery_id for battery_id, _ in merged}
+    alert_types = {alert_type for _, alert_type in merged}
+    reusable = Q(is_resolved=False)
+    if suppress:
+        reusable |= Q(resolved_at__gte=now - timedelta(seconds=ALERT_SUPPRESSION_WINDOW))
+
+    existing = {}
+    rows = (
+        BatteryAlert.objects.select_for_update()
+        .filter(battery_id__in=battery_ids, alert_type__in=alert_types)
+        .filter(reusable)
+        .order_by('is_resolved', '-resolved_at')
+    )
+    for alert in rows:
+        # Open alerts sort first, then the most recently resolved one.
+        existing.setdefault((alert.battery_id, alert.alert_type), alert)
+
+    created, updated, changed = [], [], []
+    for key, (candidate, count) in merged.items():
+        alert = existing.get(key)
+        if alert is None:
+            created.append(BatteryAlert(
+                battery_id=candidate['battery_id'],
+                alert_type=candidate['alert_type'],
+                alert_level=candidate['alert_level'],
+                message=candidate['message'],
+                occurrence_count=count,
+                last_seen=now,
+            ))
+            continue
+        if alert.alert_level != candidate['alert_level']:
+            changed.append(alert)
+        alert.alert_level = candidate['alert_level']
+        alert.message = candidate['message']
+        alert.occurrence_count += count
+        alert.last_seen = now
+        updated.append(alert)
+
+    BatteryAlert.objects.bulk_create(created)
+    BatteryAlert.objects.bulk_update(
+        updated, ['alert_level', 'message', 'occurrence_count', 'last_seen'], batch_size=500
+    )
+    return created, changed
+
+
+def resolve_alerts(queryset, now=None):
+    """
+    Resolve the unresolved alerts in queryset with one UPDATE.
+
+    Up to BULK_BROADCAST_MAX_ALERTS resolved alerts are pushed to
+    WebSocket clients as one coalesced batch; beyond that a single
+    alerts_resolved frame with the count tells clients to reload.
+    Returns the number of alerts resolved.
+    """
+    queryset = queryset.filter(is_resolved=False)
+    alert_ids = list(queryset.values_list('id', flat=True)[:BULK_BROADCAST_MAX_ALERTS + 1])
+    if not alert_ids:
+        return 0
+    count = queryset.update(is_resolved=True, resolved_at=now or timezone.now())
+    if not count:
+        return 0
+
+    # update() skips post_save, so do what the signal handler would.
+    mark_dashboard_dirty()
+    if len(alert_ids) <= BULK_BROADCAST_MAX_ALERTS:
+        transaction.on_commit(lambda: fleet_state.resolve_alerts(alert_ids))
+        transaction.on_commit(lambda: broadcast_buffer.add(alert_ids=alert_ids))
+    else:
+        transaction.on_commit(fleet_state.mark_stale)
+        transaction.on_commit(lambda: broadcast_to_dashboard({'type': 'alerts_resolved', 'count': count}))
+    return count
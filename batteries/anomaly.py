@@ -0,0 +1,218 @@
+"""
+Online statistical anomaly detection on streaming readings.
+
+Every battery gets one fixed-size row of floats: its previous reading
+(time, voltage, current, charge) and, for each feature below, an
+exponentially weighted mean, variance and sample count. A reading is
+scored against the running statistics and then folded into them, in O(1)
+per reading. A batch is updated with array operations, one pass per
+repeat of the same battery within the batch.
+
+- temperature: the reading's temperature.
+- sag: voltage change per amp of current change between readings taken
+  close together, a proxy for internal resistance.
+- charge_rate: charge percentage gained per Ah put in or taken out since
+  the previous reading. It drifts when capacity drops or the fuel gauge
+  misbehaves.
+
+A value more than BATTERY_ANOMALY_THRESHOLD standard deviations from its
+running mean raises a FAULT alert, once a feature has seen
+BATTERY_ANOMALY_WARMUP samples. A battery's state row is 13 float64
+values (104 bytes). The array doubles as it grows, so 100k batteries
+take 131,072 rows, about 14 MB, plus the id-to-row dict. Like the
+communication watchdog, it only sees the readings handled by its own
+process and starts warming up again after a restart.
+"""
+import threading
+from collections import namedtuple
+import numpy as np
+from django.conf import settings
+from .health import RESISTANCE_MAX_GAP, RESISTANCE_MIN_STEP
+
+
+ANOMALY_DETECTION = getattr(settings, 'BATTERY_ANOMALY_DETECTION', True)
+# Weight of the newest sample in the running statistics (~1/alpha readings of memory).
+ANOMALY_ALPHA = getattr(settings, 'BATTERY_ANOMALY_ALPHA', 0.05)
+ANOMALY_THRESHOLD = getattr(settings, 'BATTERY_ANOMALY_THRESHOLD', 4.0)
+ANOMALY_WARMUP = getattr(settings, 'BATTERY_ANOMALY_WARMUP', 30)
+# Readings further apart than this are not compared with each other.
+ANOMALY_MAX_GAP = getattr(settings, 'BATTERY_ANOMALY_MAX_GAP', 300)
+# Readings closer together than this (e.g. one ingest request) are too close to difference.
+MIN_INTERVAL = 1.0
+# Below this current, charge barely moves and the charge rate is mostly rounding noise.
+MIN_CHARGE_CURRENT = 0.1
+
+# min_std and relative_std floor the standard deviation, so a signal that has
+# been almost constant does not turn every small wobble into a huge deviation.
+Feature = namedtuple('Feature', ['name', 'label', 'unit', 'min_std', 'relative_std'])
+
+FEATURES = [
+    Feature('temperature', 'Temperature', '°C', 0.5, 0.0),
+    Feature('sag', 'Voltage sag per amp', ' ohm', 0.005, 0.1),
+    Feature('charge_rate', 'Charge rate', '%/Ah', 0.5, 0.05),
+]
+
+# Columns of the state array.
+LAST_TIME, LAST_VOLTAGE, LAST_CURRENT, LAST_CHARGE = range(4)
+MEAN, VARIANCE, COUNT = range(3)
+STATS_OFFSET = 4
+WIDTH = STATS_OFFSET + 3 * len(FEATURES)
+
+
+class AnomalyDetector:
+    """Per-battery running statistics in one float array, scored as readings arrive."""
+
+    def __init__(self, alpha=ANOMALY_ALPHA, threshold=ANOMALY_THRESHOLD, warmup=ANOMALY_WARMUP,
+                 capacity=1024):
+        self.alpha = alpha
+        self.threshold = threshold
+        self.warmup = warmup
+        self._lock = threading.Lock()
+        self._rows = {}
+        self._free = []
+        self._state = np.full((capacity, WIDTH), np.nan)
+        self._metrics = {'observed': 0, 'anomalies': 0}
+
+    def _row_for(self, battery_id):
+        row = self._rows.get(battery_id)
+        if row is None:
+            if self._free:
+                row = self._free.pop()
+            else:
+                row = len(self._rows)
+                if row == len(self._state):
+                    grown = np.full((2 * len(self._state), WIDTH), np.nan)
+                    grown[:row] = self._state
+                    self._state = grown
+            self._state[row] = np.nan
+            for index in range(len(FEATURES)):
+                self._state[row, STATS_OFFSET + 3 * index + COUNT] = 0
+            self._rows[battery_id] = row
+        return row
+
+    def forget(self, battery_ids):
+        with self._lock:
+            for battery_id in battery_ids:
+                row = self._rows.pop(battery_id, None)
+                if row is not None:
+                    self._free.append(row)
+
+    def observe(self, readings):
+        """
+        Score readings against each battery's running statistics, then
+        update them. Returns FAULT alert candidates for record_alerts().
+        """
+        if not readings:
+            return []
+        battery_ids = np.array([reading.battery_id for reading in readings], dtype=np.int64)
+        values = np.array([
+            (r.enqueued_at, r.current_voltage, r.current, r.current_charge, r.current_temperature)
+            for r in readings
+        ], dtype=float).reshape(-1, 5)
+
+        flagged = {}
+        with self._lock:
+            rows = np.array([self._row_for(battery_id) for battery_id in battery_ids.tolist()], dtype=np.int64)
+            # Readings of the same battery must be applied in order: pass k takes each battery's k-th reading.
+            ranks = _occurrence_ranks(battery_ids)
+            for rank in range(int(ranks.max()) + 1):
+                batch = np.nonzero(ranks == rank)[0]
+                for index, feature, value, mean, z in self._update(rows[batch], values[batch]):
+                    flagged.setdefault(int(batch[index]), []).append((feature, value, mean, z))
+            self._metrics['observed'] += len(readings)
+            self._metrics['anomalies'] += len(flagged)
+        # In reading order, so the latest reading's alert wins in record_alerts.
+        return [_alert(readings[index], flagged[index], self.threshold) for index in sorted(flagged)]
+
+    def _update(self, rows, values):
+        """Score and fold in one reading per row; returns (index, feature, value, mean, z) per anomaly."""
+        state = self._state
+        anomalies = []
+        t, voltage, current, charge, temperature = values.T
+        dt = t - state[rows, LAST_TIME]
+        close = (dt >= MIN_INTERVAL) & (dt <= ANOMALY_MAX_GAP)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            di = current - state[rows, LAST_CURRENT]
+            sag = (voltage - state[rows, LAST_VOLTAGE]) / di
+            sag_valid = close & (dt <= RESISTANCE_MAX_GAP) & (np.abs(di) >= RESISTANCE_MIN_STEP)
+
+            previous_current = state[rows, LAST_CURRENT]
+            moved_ah = previous_current * dt / 3600
+            charge_rate = (charge - state[rows, LAST_CHARGE]) / moved_ah
+            charge_valid = close & (np.abs(previous_current) >= MIN_CHARGE_CURRENT)
+
+        samples = {
+            'temperature': (temperature, np.isfinite(temperature)),
+            'sag': (sag, sag_valid & np.isfinite(sag)),
+            'charge_rate': (charge_rate, charge_valid & np.isfinite(charge_rate)),
+        }
+        for position, feature in enumerate(FEATURES):
+            value, valid = samples[feature.name]
+            columns = STATS_OFFSET + 3 * position
+            mean = state[rows, columns + MEAN]
+            variance = state[rows, columns + VARIANCE]
+            count = state[rows, columns + COUNT]
+
+            with np.errstate(invalid='ignore'):
+                std = np.maximum(np.sqrt(variance), np.maximum(feature.min_std, feature.relative_std * np.abs(mean)))
+                z = (value - mean) / std
+                flagged = valid & (count >= self.warmup) & (np.abs(z) >= self.threshold)
+            anomalies.extend(
+                (index, feature, value[index], mean[index], z[index]) for index in np.nonzero(flagged)[0]
+            )
+
+            # West's incremental EWMA mean and variance; the first sample seeds the mean.
+            first = count == 0
+            diff = np.where(first, 0.0, value - mean)
+            increment = self.alpha * diff
+            updated = rows[valid]
+            state[updated, columns + MEAN] = np.where(first, value, mean + increment)[valid]
+            state[updated, columns + VARIANCE] = np.where(
+                first, 0.0, (1 - self.alpha) * (variance + diff * increment)
+            )[valid]
+            state[updated, columns + COUNT] = count[valid] + 1
+
+        # A reading older than the one already seen (workers can race) does not move the baseline.
+        newer = ~(dt <= 0)
+        for column, value in ((LAST_TIME, t), (LAST_VOLTAGE, voltage), (LAST_CURRENT, current),
+                              (LAST_CHARGE, charge)):
+            state[rows[newer], column] = value[newer]
+        return anomalies
+
+    def metrics(self):
+        with self._lock:
+            return {
+                **self._metrics,
+                'tracked': len(self._rows),
+                'state_bytes': int(self._state.nbytes),
+            }
+
+
+def _occurrence_ranks(battery_ids):
+    """For each position, how many earlier positions hold the same battery id."""
+    order = np.argsort(battery_ids, kind='stable')
+    ordered = battery_ids[order]
+    starts = np.r_[True, ordered[1:] != ordered[:-1]]
+    positions = np.arange(len(ordered))
+    ranks = np.empty(len(ordered), dtype=np.int64)
+    ranks[order] = positions - np.maximum.accumulate(np.where(starts, positions, 0))
+    return ranks
+
+
+def _alert(reading, deviations, threshold):
+    """One FAULT alert for every feature of a reading that deviated."""
+    worst = max(abs(z) for _, _, _, z in deviations)
+    return {
+        'battery_id': reading.battery_id,
+        'alert_type': 'FAULT',
+        'alert_level': 'CRITICAL' if worst >= 2 * threshold else 'ERROR',
+        'message': '; '.join(
+            f'{feature.label} of {value:.3g}{feature.unit} is {abs(z):.1f} standard deviations '
+            f'{"above" if z > 0 else "below"} its running mean of {mean:.3g}{feature.unit}'
+            for feature, value, mean, z in deviations
+        ),
+    }
+
+
+anomaly_detector = AnomalyDetector()
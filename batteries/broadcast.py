@@ -0,0 +1,177 @@
+"""
+Coalesced WebSocket broadcasting.
+
+Saves only record the ids of changed batteries and alerts once their
+transaction commits. BATTERY_BROADCAST_WINDOW seconds after the first
+change, the latest state of everything that changed is serialized with one
+query per model and sent as one batched dashboard.update frame per group
+(see topics.py). Request latency no longer includes the channel layer
+round trip, and 1,000 updates to the same battery cost one frame.
+
+Channel layers belong to the event loop their consumers run on; the
+in-memory layer does not wake a consumer for a message sent from another
+loop. Once a WebSocket consumer has connected in this process, flushes run
+as tasks on its event loop, and sends from other threads are handed to it
+with run_coroutine_threadsafe. Processes without consumers (WSGI workers,
+management commands) flush from a background thread instead, which only
+reaches other processes through a shared layer such as channels_redis.
+"""
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from collections import defaultdict
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import close_old_connections
+from .models import Battery, BatteryAlert
+from .serializers import BatterySerializer, BatteryAlertSerializer
+from .topics import FIREHOSE_GROUP, alert_groups, battery_groups, device_map
+
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_WINDOW = getattr(settings, 'BATTERY_BROADCAST_WINDOW', 0.25)
+
+
+_loop = None
+
+
+def attach_event_loop(loop):
+    """Send broadcasts from loop, the event loop this process's consumers run on."""
+    global _loop
+    _loop = loop
+
+
+def consumer_loop():
+    """The attached event loop, or None if there is none or it has stopped."""
+    loop = _loop
+    if loop is None or loop.is_closed() or not loop.is_running():
+        return None
+    return loop
+
+
+def _message(payload, group, meta):
+    return {'type': 'dashboard.update', 'data': payload, 'group': group, **meta}
+
+
+def broadcast_to_dashboard(payload: dict, group=FIREHOSE_GROUP, **meta):
+    layer = get_channel_layer()
+    loop = consumer_loop()
+    if loop is not None:
+        asyncio.run_coroutine_threadsafe(layer.group_send(group, _message(payload, group, meta)), loop)
+    else:
+        async_to_sync(layer.group_send)(group, _message(payload, group, meta))
+
+
+class BroadcastBuffer:
+    """Collects changed battery and alert ids and flushes them as one frame per window."""
+
+    def __init__(self, window=BROADCAST_WINDOW, send=broadcast_to_dashboard):
+        self.window = window
+        self.send = send
+        self._lock = threading.Lock()
+        self._pending = threading.Event()
+        self._batteries = set()
+        self._alerts = set()
+        self._thread = None
+        self._task = None
+        # Per-group frame counters let consumers notice frames the channel layer dropped.
+        self.origin = uuid.uuid4().hex
+        self._seq = defaultdict(int)
+
+    def add(self, battery_ids=(), alert_ids=()):
+        with self._lock:
+            self._batteries.update(battery_ids)
+            self._alerts.update(alert_ids)
+        loop = consumer_loop()
+        if loop is not None:
+            loop.call_soon_threadsafe(self._schedule)
+        elif self.window <= 0:
+            self.flush()
+        else:
+            self._ensure_thread()
+            self._pending.set()
+
+    def _schedule(self):
+        # Runs on the consumer loop, so _task needs no lock.
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        while True:
+            await asyncio.sleep(max(self.window, 0))
+            try:
+                # The queries run on a worker thread; broadcast_to_dashboard hands the sends back to this loop.
+                await database_sync_to_async(self.flush)()
+            except Exception:
+                logger.exception('Dashboard broadcast failed')
+            with self._lock:
+                # Changes that arrived during the flush found this task still running.
+                if not self._batteries and not self._alerts:
+                    return
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name='battery-broadcast', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            self._pending.wait()
+            # Let the window fill up before sending.
+            time.sleep(self.window)
+            self._pending.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Dashboard broadcast failed')
+            finally:
+                close_old_connections()
+
+    def flush(self):
+        """
+        Send everything collected so far as batch_update frames.
+
+        Each update is routed to the firehose group and to every topic group
+        it matches, with one frame per group, so subscribers to a single
+        battery or device only receive what they watch.
+        """
+        with self._lock:
+            battery_ids, self._batteries = self._batteries, set()
+            alert_ids, self._alerts = self._alerts, set()
+        if not battery_ids and not alert_ids:
+            return
+
+        batteries = list(Battery.objects.filter(id__in=battery_ids)) if battery_ids else []
+        alerts = list(BatteryAlert.objects.filter(id__in=alert_ids).select_related('battery')) if alert_ids else []
+        devices = device_map({battery.id for battery in batteries} | {alert.battery_id for alert in alerts})
+
+        frames = {}
+        for battery, data in zip(batteries, BatterySerializer(batteries, many=True).data):
+            for group in battery_groups(battery.id, battery.battery_type, devices.get(battery.id, [])):
+                frames.setdefault(group, ([], []))[0].append(data)
+        for alert, data in zip(alerts, BatteryAlertSerializer(alerts, many=True).data):
+            groups = alert_groups(
+                alert.battery_id, alert.battery.battery_type, devices.get(alert.battery_id, []), alert.alert_level
+            )
+            for group in groups:
+                frames.setdefault(group, ([], []))[1].append(data)
+
+        for group, (battery_data, alert_data) in frames.items():
+            with self._lock:
+                self._seq[group] += 1
+                seq = self._seq[group]
+            self.send({
+                'type': 'batch_update',
+                'batteries': battery_data,
+                'alerts': alert_data,
+            }, group, origin=self.origin, seq=seq)
+
+
+broadcast_buffer = BroadcastBuffer()
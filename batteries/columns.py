@@ -0,0 +1,221 @@
+"""
+Columnar, array-backed view of the fleet.
+
+FleetColumns keeps one NumPy array per Battery field the dashboard and
+analytics look at (charge, voltage, temperature, health, cycles, plus
+status and battery type as small integer codes), with rows sorted by
+battery id. A battery is located with a binary search over the id array,
+updated in place, and new batteries (whose ids are normally larger than
+every existing one) are appended. Deleted rows are tombstoned and
+compacted away in bulk.
+
+At 8 bytes per float column this is around 50 bytes per battery, against
+well over a kilobyte for a Django model instance, and fleet-wide scans,
+averages and histograms run as vectorized operations over 1M batteries
+in milliseconds.
+"""
+import numpy as np
+from .models import Battery
+
+
+NUMERIC_COLUMNS = {
+    'current_charge': np.float64,
+    'current_voltage': np.float64,
+    'current_temperature': np.float64,
+    'health_percentage': np.float64,
+    'cycle_count': np.int32,
+}
+
+# Short names accepted by the analytics endpoint.
+FIELD_ALIASES = {
+    'charge': 'current_charge',
+    'voltage': 'current_voltage',
+    'temperature': 'current_temperature',
+    'health': 'health_percentage',
+    'cycles': 'cycle_count',
+}
+
+STATUSES = [status for status, _ in Battery.STATUS_CHOICES]
+
+
+class FleetColumns:
+    """Per-field arrays for every battery, sorted by id."""
+
+    def __init__(self, capacity=1024):
+        self.size = 0
+        self.removed = 0
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.status = np.zeros(capacity, dtype=np.int8)
+        self.battery_type = np.zeros(capacity, dtype=np.int32)
+        self.numeric = {field: np.zeros(capacity, dtype=dtype) for field, dtype in NUMERIC_COLUMNS.items()}
+        self.statuses = list(STATUSES)
+        self.types = []
+        self._status_codes = {status: code for code, status in enumerate(self.statuses)}
+        self._type_codes = {}
+
+    def __len__(self):
+        return self.size - self.removed
+
+    def _arrays(self):
+        return [self.ids, self.alive, self.status, self.battery_type, *self.numeric.values()]
+
+    def _grow(self, needed):
+        capacity = len(self.ids)
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2)
+        self.ids, self.alive, self.status, self.battery_type, *numeric = [
+            np.resize(array, capacity) for array in self._arrays()
+        ]
+        self.alive[self.size:] = False
+        self.numeric = dict(zip(NUMERIC_COLUMNS, numeric))
+
+    def status_code(self, status):
+        code = self._status_codes.get(status)
+        if code is None:
+            code = self._status_codes[status] = len(self.statuses)
+            self.statuses.append(status)
+        return code
+
+    def type_code(self, battery_type):
+        code = self._type_codes.get(battery_type)
+        if code is None:
+            code = self._type_codes[battery_type] = len(self.types)
+            self.types.append(battery_type)
+        return code
+
+    def _find(self, battery_id):
+        row = int(np.searchsorted(self.ids[:self.size], battery_id))
+        if row < self.size and self.ids[row] == battery_id:
+            return row, True
+        return row, False
+
+    def get(self, battery_id):
+        """The stored values for a battery as a dict, or None."""
+        row, found = self._find(battery_id)
+        if not found or not self.alive[row]:
+            return None
+        values = {field: column[row].item() for field, column in self.numeric.items()}
+        values['current_status'] = self.statuses[self.status[row]]
+        values['battery_type'] = self.types[self.battery_type[row]]
+        return values
+
+    def set(self, battery_id, values):
+        """Insert or update one battery from a mapping of field -> value."""
+        row, found = self._find(battery_id)
+        if found:
+            if not self.alive[row]:
+                self.alive[row] = True
+                self.removed -= 1
+        else:
+            self._grow(self.size + 1)
+            if row < self.size:
+                # Out-of-order id: shift the tail up by one (rare with auto-increment ids).
+                for array in self._arrays():
+                    array[row + 1:self.size + 1] = array[row:self.size]
+            self.size += 1
+            self.ids[row] = battery_id
+            self.alive[row] = True
+        self.status[row] = self.status_code(values['current_status'])
+        self.battery_type[row] = self.type_code(values['battery_type'])
+        for field, column in self.numeric.items():
+            column[row] = values[field]
+
+    def remove(self, battery_id):
+        row, found = self._find(battery_id)
+        if found and self.alive[row]:
+            self.alive[row] = False
+            self.removed += 1
+            if self.removed > 1024 and self.removed > self.size // 4:
+                self.compact()
+
+    def compact(self):
+        keep = self.alive[:self.size]
+        count = int(keep.sum())
+        for array in self._arrays():
+            array[:count] = array[:self.size][keep]
+        self.alive[count:] = False
+        self.size = count
+        self.removed = 0
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build from (id, status, battery_type, *NUMERIC_COLUMNS) rows ordered by id."""
+        columns = cls()
+        for chunk in _chunks(rows, 10000):
+            start = columns.size
+            columns._grow(start + len(chunk))
+            stop = start + len(chunk)
+            ids, statuses, types, *numeric = zip(*chunk)
+            columns.ids[start:stop] = ids
+            columns.alive[start:stop] = True
+            columns.status[start:stop] = [columns.status_code(status) for status in statuses]
+            columns.battery_type[start:stop] = [columns.type_code(battery_type) for battery_type in types]
+            for column, values in zip(columns.numeric.values(), numeric):
+                column[start:stop] = values
+            columns.size = stop
+        return columns
+
+    def live(self):
+        """Mask of the rows holding a battery."""
+        return self.alive[:self.size]
+
+    def column(self, field):
+        """Values of a numeric field for every battery, in id order."""
+        return self.numeric[FIELD_ALIASES.get(field, field)][:self.size][self.live()]
+
+    def live_ids(self):
+        return self.ids[:self.size][self.live()]
+
+    def status_counts(self):
+        counts = np.bincount(self.status[:self.size][self.live()], minlength=len(self.statuses))
+        return dict(zip(self.statuses, counts.tolist()))
+
+    def type_counts(self):
+        counts = np.bincount(self.battery_type[:self.size][self.live()], minlength=len(self.types))
+        return dict(zip(self.types, counts.tolist()))
+
+    def status_mask(self, status):
+        code = self._status_codes.get(status)
+        if code is None:
+            return np.zeros(len(self), dtype=bool)
+        return self.status[:self.size][self.live()] == code
+
+    def ids_where(self, mask):
+        return self.live_ids()[mask]
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def describe(values):
+    """Count, mean, min, max and percentiles of one column."""
+    if not len(values):
+        return {'count': 0, 'mean': None, 'min': None, 'max': None, 'p50': None, 'p90': None, 'p99': None}
+    p50, p90, p99 = np.percentile(values, [50, 90, 99]).tolist()
+    return {
+        'count': int(len(values)),
+        'mean': round(float(values.mean()), 3),
+        'min': values.min().item(),
+        'max': values.max().item(),
+        'p50': round(p50, 3),
+        'p90': round(p90, 3),
+        'p99': round(p99, 3),
+    }
+
+
+def histogram(values, bins=10, value_range=None):
+    """Equal-width histogram of one column as {'edges': [...], 'counts': [...]}."""
+    if not len(values) and value_range is None:
+        return {'edges': [], 'counts': []}
+    counts, edges = np.histogram(values, bins=bins, range=value_range)
+    return {'edges': [round(edge, 3) for edge in edges.tolist()], 'counts': counts.tolist()}
@@ -1,21 +1,337 @@
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
+from collections import OrderedDict
+from django.conf import settings
+from django.db.models import Q
+from urllib.parse import parse_qs
+import asyncio
 import json
+import logging
+from .broadcast import attach_event_loop
+from .ingest import ingest_readings
+from .models import Battery
+from .serializers import BatterySerializer
+from .topics import FIREHOSE_GROUP, TOPIC_KINDS, subscription_groups
+
+try:
+    import msgpack
+except ImportError:  # optional; clients fall back to JSON text frames
+    msgpack = None
+
+
+logger = logging.getLogger(__name__)
+
+# Battery fields tracked per connection for delta encoding
+DELTA_FIELDS = [field for field in BatterySerializer.Meta.fields if field != 'id']
+SNAPSHOT_CHUNK_SIZE = 500
+# Recently sent alerts, so an alert matching several subscribed topics is sent once
+ALERT_MEMORY = 1000
+
+WS_INGEST_BATCH_SIZE = getattr(settings, 'BATTERY_WS_INGEST_BATCH_SIZE', 500)
+WS_INGEST_FLUSH_INTERVAL = getattr(settings, 'BATTERY_WS_INGEST_FLUSH_INTERVAL', 0.1)
+WS_INGEST_MAX_BUFFER = getattr(settings, 'BATTERY_WS_INGEST_MAX_BUFFER', 10000)
+INGEST_TOKEN = getattr(settings, 'BATTERY_INGEST_TOKEN', None)
+
+
+def topic_values(value):
+    """
+    Normalize one topic list from a subscribe message to a list of strings.
+
+    Accepts a list of ids or names, or a comma-separated string as in the
+    query string; returns None for anything else.
+    """
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = value.split(',')
+    if not isinstance(value, (list, tuple)):
+        return None
+    if any(isinstance(item, bool) or not isinstance(item, (str, int)) for item in value):
+        return None
+    return [str(item) for item in value if str(item)]
 
 
 class DashboardConsumer(AsyncWebsocketConsumer):
+    """
+    Live dashboard updates.
+
+    Clients start on the firehose group. Sending
+    {"action": "subscribe", "batteries": [1], "devices": [2],
+     "battery_types": ["Li-ion"], "alert_levels": ["CRITICAL"]}
+    (or passing the same keys as comma-separated query parameters)
+    switches the connection to those topics only; "unsubscribe" removes
+    topics, and {"action": "subscribe", "all": true} returns to the firehose.
+    A topic value that is not a list of ids or names (or a comma-separated
+    string) gets an "error" frame and leaves the subscriptions unchanged.
+
+    After connecting (and after every subscription change) the client gets
+    full "snapshot" frames for the batteries it watches, then "delta" frames
+    carrying only the fields that changed per battery id. Every frame has a
+    per-connection "seq"; a client that sees a gap sends {"action": "resync"}.
+    Connect with ?encoding=msgpack to receive msgpack binary frames and
+    ?snapshot=0 to skip snapshots; such clients get a "resync" frame instead
+    when the server notices dropped updates.
+    """
+
     async def connect(self):
-        self.group_name = 'dashboard'
-        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        attach_event_loop(asyncio.get_running_loop())
+        self.subscriptions = set()
+        self.topics = {kind: set() for kind in TOPIC_KINDS}
+        self.known = {}
+        self.sent_alerts = OrderedDict()
+        self.group_seq = {}
+        self.seq = 0
+
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        self.binary = query.get('encoding') == ['msgpack'] and msgpack is not None
+        self.send_snapshot = query.get('snapshot') != ['0']
         await self.accept()
 
+        for kind in TOPIC_KINDS:
+            if kind in query:
+                self.topics[kind].update(topic_values(','.join(query[kind])))
+        await self._apply_topics()
+
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard(self.group_name, self.channel_name)
+        for group in self.subscriptions:
+            await self.channel_layer.group_discard(group, self.channel_name)
 
     async def receive(self, text_data=None, bytes_data=None):
-        # Optionally handle messages from clients
-        if text_data:
+        if bytes_data and msgpack is not None:
+            try:
+                message = msgpack.unpackb(bytes_data)
+            except Exception:
+                return
+        elif text_data:
+            try:
+                message = json.loads(text_data)
+            except ValueError:
+                await self.send(text_data=json.dumps({'echo': text_data}))
+                return
+        else:
+            return
+
+        action = message.get('action') if isinstance(message, dict) else None
+        if action in ('subscribe', 'unsubscribe'):
+            topics = {kind: topic_values(message.get(kind)) for kind in TOPIC_KINDS}
+            invalid = [kind for kind, values in topics.items() if values is None]
+            if invalid:
+                await self._send_frame({'type': 'error', 'error': f'{", ".join(invalid)} must be a list of ids.'})
+                return
+            if action == 'subscribe':
+                if message.get('all'):
+                    self.topics = {kind: set() for kind in TOPIC_KINDS}
+                for kind in TOPIC_KINDS:
+                    self.topics[kind].update(topics[kind])
+            else:
+                for kind in TOPIC_KINDS:
+                    self.topics[kind].difference_update(topics[kind])
+            await self._apply_topics()
+        elif action == 'resync':
+            await self._send_snapshot()
+        elif text_data:
             await self.send(text_data=json.dumps({'echo': text_data}))
 
-    async def dashboard.update(self, event):
-        # Custom event to push JSON data to the client
-        await self.send(text_data=json.dumps(event.get('data', {})))
+    async def _apply_topics(self):
+        groups = subscription_groups(self.topics) or {FIREHOSE_GROUP}
+        for group in self.subscriptions - groups:
+            await self.channel_layer.group_discard(group, self.channel_name)
+        for group in groups - self.subscriptions:
+            await self.channel_layer.group_add(group, self.channel_name)
+        self.subscriptions = groups
+        await self._send_frame({'type': 'subscriptions', 'groups': sorted(groups)})
+        if self.send_snapshot:
+            await self._send_snapshot()
+
+    async def _send_frame(self, frame):
+        self.seq += 1
+        frame['seq'] = self.seq
+        if self.binary:
+            await self.send(bytes_data=msgpack.packb(frame))
+        else:
+            await self.send(text_data=json.dumps(frame))
+
+    async def _send_snapshot(self):
+        batteries = await self._load_watched_batteries()
+        self.known = {}
+        for data in batteries:
+            self._remember(data)
+        for start in range(0, max(len(batteries), 1), SNAPSHOT_CHUNK_SIZE):
+            await self._send_frame({
+                'type': 'snapshot',
+                'batteries': batteries[start:start + SNAPSHOT_CHUNK_SIZE],
+                'done': start + SNAPSHOT_CHUNK_SIZE >= len(batteries),
+            })
+
+    @database_sync_to_async
+    def _load_watched_batteries(self):
+        batteries = Battery.objects.order_by('id')
+        if self.subscriptions != {FIREHOSE_GROUP}:
+            battery_ids = [int(v) for v in self.topics['batteries'] if v.isdigit()]
+            device_ids = [int(v) for v in self.topics['devices'] if v.isdigit()]
+            batteries = batteries.filter(
+                Q(id__in=battery_ids) | Q(battery_type__in=self.topics['battery_types']) |
+                Q(devices__id__in=device_ids)
+            ).distinct()
+        return list(BatterySerializer(batteries, many=True).data)
+
+    def _remember(self, data):
+        old = self.known.get(data['id'])
+        values = tuple(data.get(field) for field in DELTA_FIELDS)
+        self.known[data['id']] = values
+        return old, values
+
+    def _diff(self, data):
+        """Fields of data that differ from what this client last saw, or None."""
+        old, values = self._remember(data)
+        if old is None:
+            return dict(data)
+        changed = {field: new for field, new, previous in zip(DELTA_FIELDS, values, old) if new != previous}
+        if not changed:
+            return None
+        changed['id'] = data['id']
+        return changed
+
+    def _is_new_alert(self, data):
+        # Escalations and repeats change the level, count or last_seen of an existing alert.
+        fingerprint = (
+            data.get('is_resolved'), data.get('resolved_at'), data.get('alert_level'),
+            data.get('occurrence_count'), data.get('last_seen'),
+        )
+        if self.sent_alerts.get(data['id']) == fingerprint:
+            return False
+        self.sent_alerts[data['id']] = fingerprint
+        self.sent_alerts.move_to_end(data['id'])
+        while len(self.sent_alerts) > ALERT_MEMORY:
+            self.sent_alerts.popitem(last=False)
+        return True
+
+    async def dashboard_update(self, event):
+        data = event.get('data', {})
+
+        # A jump in the group's sequence means the channel layer dropped frames.
+        seq = event.get('seq')
+        if seq is not None:
+            key = (event.get('group'), event.get('origin'))
+            last = self.group_seq.get(key)
+            self.group_seq[key] = seq
+            if last is not None and seq != last + 1:
+                if self.send_snapshot:
+                    await self._send_snapshot()
+                else:
+                    # The client opted out of snapshots; let it decide whether to ask for one.
+                    await self._send_frame({'type': 'resync', 'reason': 'updates_dropped'})
+
+        if data.get('type') != 'batch_update':
+            await self._send_frame(dict(data))
+            return
+
+        batteries = [delta for delta in map(self._diff, data.get('batteries', [])) if delta]
+        alerts = [alert for alert in data.get('alerts', []) if self._is_new_alert(alert)]
+        if batteries or alerts:
+            await self._send_frame({'type': 'delta', 'batteries': batteries, 'alerts': alerts})
+
+
+class IngestConsumer(AsyncWebsocketConsumer):
+    """
+    Persistent telemetry ingestion for devices and gateways.
+
+    Each message is a reading (as accepted by POST /api/batteries/ingest/)
+    or {"readings": [...]}, optionally with a client "seq". Readings are
+    buffered and applied with ingest_readings() once BATTERY_WS_INGEST_BATCH_SIZE
+    have arrived or BATTERY_WS_INGEST_FLUSH_INTERVAL seconds have passed,
+    after which the client receives {"type": "ack", "seq": <highest seq
+    applied>, "accepted": n, "rejected": [...]}. If the write fails, the
+    client gets {"type": "error", "seqs": [...]} listing the messages to
+    resend. Messages that would grow the buffer past
+    BATTERY_WS_INGEST_MAX_BUFFER readings are refused the same way.
+    """
+
+    async def connect(self):
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        if INGEST_TOKEN and query.get('token') != [INGEST_TOKEN]:
+            await self.close(code=4003)
+            return
+        self.binary = query.get('encoding') == ['msgpack'] and msgpack is not None
+        self.buffer = []
+        self.flush_lock = asyncio.Lock()
+        self.flush_task = None
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        if getattr(self, 'flush_task', None):
+            self.flush_task.cancel()
+        if getattr(self, 'buffer', None):
+            await self._flush(send_ack=False)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            if bytes_data is not None and msgpack is not None:
+                message = msgpack.unpackb(bytes_data)
+            else:
+                message = json.loads(text_data or '')
+        except Exception:
+            await self._send({'type': 'error', 'error': 'Malformed message.'})
+            return
+        if not isinstance(message, dict):
+            await self._send({'type': 'error', 'error': 'Expected an object.'})
+            return
+
+        seq = message.get('seq')
+        readings = message['readings'] if isinstance(message.get('readings'), list) else [message]
+        if len(self.buffer) + len(readings) > WS_INGEST_MAX_BUFFER:
+            await self._send({
+                'type': 'error',
+                'error': f'At most {WS_INGEST_MAX_BUFFER} readings can be buffered; resend smaller batches.',
+                'seqs': [seq] if seq is not None else [],
+            })
+            return
+        self.buffer.extend((seq, reading) for reading in readings)
+
+        if len(self.buffer) >= WS_INGEST_BATCH_SIZE:
+            # Awaiting the write here stops us reading the socket, which pushes back on the sender.
+            await self._flush()
+        elif self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(WS_INGEST_FLUSH_INTERVAL)
+        self.flush_task = None
+        await self._flush()
+
+    async def _flush(self, send_ack=True):
+        async with self.flush_lock:
+            batch, self.buffer = self.buffer, []
+            if not batch:
+                return
+            try:
+                results = await database_sync_to_async(ingest_readings)([reading for _, reading in batch])
+            except Exception:
+                # The batch is gone from the buffer, so tell the client what to resend.
+                logger.exception('WebSocket ingest of %d readings failed', len(batch))
+                if send_ack:
+                    await self._send({
+                        'type': 'error',
+                        'error': 'The readings could not be stored; resend them.',
+                        'seqs': list(dict.fromkeys(seq for seq, _ in batch if seq is not None)),
+                    })
+                return
+
+        rejected = [
+            {'seq': seq, 'errors': result['errors']}
+            for (seq, _), result in zip(batch, results) if result['status'] != 'ok'
+        ]
+        seqs = [seq for seq, _ in batch if isinstance(seq, int)]
+        if send_ack:
+            await self._send({
+                'type': 'ack',
+                'seq': max(seqs) if seqs else None,
+                'accepted': len(batch) - len(rejected),
+                'rejected': rejected,
+            })
+
+    async def _send(self, frame):
+        if self.binary:
+            await self.send(bytes_data=msgpack.packb(frame))
+        else:
+            await self.send(text_data=json.dumps(frame))
@@ -1,10 +1,32 @@
 from django.shortcuts import render
-from django.http import JsonResponse
-from django.db.models import Avg, Count, Q
-from .models import Battery, BatteryAlert, BatteryLog, BatteryDevice
+from django.http import JsonResponse, StreamingHttpResponse
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from .models import Battery, BatteryLog
+from .snapshot import BATTERY_DETAIL_FIELDS, get_dashboard_section
+from .export import (
+    aiter_battery_rows, aiter_export_json, aiter_export_ndjson, iter_battery_rows, iter_export_json, iter_export_ndjson
+)
+from .streaming import (
+    NDJSON_CONTENT_TYPE, achain, aiter_json_array, aiter_ndjson, is_async_request, iter_json_array, iter_ndjson
+)
+from .filters import filter_logs, parse_timestamp
+from .alert_pipeline import alert_pipeline
+from .anomaly import anomaly_detector
+from .fleet_state import fleet_state
+from .columns import FIELD_ALIASES
+from .watchdog import watchdog
+from .trends import TREND_DEFAULT_POINTS, TREND_FIELDS, TREND_USE_ROLLUPS, build_trend
+from itertools import chain
 import json
 
 
+DETAILS_PAGE_SIZE = getattr(settings, 'BATTERY_DETAILS_PAGE_SIZE', 500)
+DETAILS_MAX_PAGE_SIZE = getattr(settings, 'BATTERY_DETAILS_MAX_PAGE_SIZE', 5000)
+ANALYTICS_MAX_BINS = 1000
+
+
 def dashboard(request):
     """Battery management dashboard."""
     return render(request, 'batteries/dashboard.html')
@@ -12,174 +34,140 @@ def dashboard(request):
 
 def dashboard_stats(request):
     """API endpoint for dashboard statistics."""
-    
-    # Battery stats
-    total_batteries = Battery.objects.count()
-    active_batteries = Battery.objects.filter(current_status__in=['CHARGING', 'DISCHARGING']).count()
-    faulty_batteries = Battery.objects.filter(current_status='FAULT').count()
-    
-    # Health stats
-    avg_health = Battery.objects.aggregate(Avg('health_percentage'))['health_percentage__avg'] or 0
-    low_health_count = Battery.objects.filter(health_percentage__lt=50).count()
-    
-    # Charge stats
-    avg_charge = Battery.objects.aggregate(Avg('current_charge'))['current_charge__avg'] or 0
-    
-    # Temperature stats
-    avg_temp = Battery.objects.aggregate(Avg('current_temperature'))['current_temperature__avg'] or 0
-    
-    # Alert stats
-    total_alerts = BatteryAlert.objects.count()
-    unresolved_alerts = BatteryAlert.objects.filter(is_resolved=False).count()
-    critical_alerts = BatteryAlert.objects.filter(alert_level='CRITICAL', is_resolved=False).count()
-    
-    # Device stats
-    total_devices = BatteryDevice.objects.count()
-    active_devices = BatteryDevice.objects.filter(is_active=True).count()
-    
-    return JsonResponse({
-        'batteries': {
-            'total': total_batteries,
-            'active': active_batteries,
-            'faulty': faulty_batteries,
-        },
-        'health': {
-            'average': round(avg_health, 2),
-            'low_count': low_health_count,
-        },
-        'charge': {
-            'average': round(avg_charge, 2),
-        },
-        'temperature': {
-            'average': round(avg_temp, 2),
-        },
-        'alerts': {
-            'total': total_alerts,
-            'unresolved': unresolved_alerts,
-            'critical': critical_alerts,
-        },
-        'devices': {
-            'total': total_devices,
-            'active': active_devices,
-        }
-    })
+    return JsonResponse(fleet_state.stats())
 
 
 def battery_chart_data(request):
     """Get battery data for charts."""
-    
-    batteries = Battery.objects.all()
-    
-    # Status distribution
-    status_data = Battery.objects.values('current_status').annotate(count=Count('id'))
-    
-    # Health distribution
-    health_ranges = {
-        'Excellent (90-100%)': Battery.objects.filter(health_percentage__gte=90).count(),
-        'Good (70-89%)': Battery.objects.filter(health_percentage__gte=70, health_percentage__lt=90).count(),
-        'Fair (50-69%)': Battery.objects.filter(health_percentage__gte=50, health_percentage__lt=70).count(),
-        'Poor (<50%)': Battery.objects.filter(health_percentage__lt=50).count(),
-    }
-    
-    # Charge levels
-    charge_ranges = {
-        'Full (90-100%)': Battery.objects.filter(current_charge__gte=90).count(),
-        'High (70-89%)': Battery.objects.filter(current_charge__gte=70, current_charge__lt=90).count(),
-        'Medium (40-69%)': Battery.objects.filter(current_charge__gte=40, current_charge__lt=70).count(),
-        'Low (10-39%)': Battery.objects.filter(current_charge__gte=10, current_charge__lt=40).count(),
-        'Critical (<10%)': Battery.objects.filter(current_charge__lt=10).count(),
-    }
-    
-    # Battery types
-    type_data = Battery.objects.values('battery_type').annotate(count=Count('id'))
-    
-    # Cycle count distribution
-    cycles_ranges = {
-        'New (0-100)': Battery.objects.filter(cycle_count__lte=100).count(),
-        'Good (100-500)': Battery.objects.filter(cycle_count__gt=100, cycle_count__lte=500).count(),
-        'Aging (500-1000)': Battery.objects.filter(cycle_count__gt=500, cycle_count__lte=1000).count(),
-        'Old (1000+)': Battery.objects.filter(cycle_count__gt=1000).count(),
-    }
-    
-    return JsonResponse({
-        'status': list(status_data),
-        'health_ranges': health_ranges,
-        'charge_ranges': charge_ranges,
-        'types': list(type_data),
-        'cycle_ranges': cycles_ranges,
-    })
+    return JsonResponse(fleet_state.chart_data())
 
 
 def battery_details(request):
-    """Get detailed battery information."""
-    
-    batteries = Battery.objects.all().values(
-        'id', 'serial_number', 'battery_type', 'current_charge', 
-        'current_voltage', 'current_temperature', 'current_status', 
-        'health_percentage', 'cycle_count'
-    )
-    
-    return JsonResponse({
-        'batteries': list(batteries)
-    })
+    """
+    Get detailed battery information.
+    
+    ?stream=json|ndjson streams the whole fleet in chunks (from an async
+    iterator under ASGI, so it is not buffered); ?limit=N (with
+    ?after=<last id>) returns one keyset page ordered by id. Without either,
+    the cached dashboard snapshot is returned.
+    """
+    
+    stream = request.GET.get('stream')
+    if stream in ('json', 'ndjson'):
+        if is_async_request(request):
+            rows = aiter_battery_rows()
+            if stream == 'ndjson':
+                return StreamingHttpResponse(aiter_ndjson(rows), content_type=NDJSON_CONTENT_TYPE)
+            return StreamingHttpResponse(
+                achain(['{"batteries":'], aiter_json_array(rows), ['}']),
+                content_type='application/json'
+            )
+        rows = iter_battery_rows()
+        if stream == 'ndjson':
+            return StreamingHttpResponse(iter_ndjson(rows), content_type=NDJSON_CONTENT_TYPE)
+        return StreamingHttpResponse(
+            chain(['{"batteries":'], iter_json_array(rows), ['}']),
+            content_type='application/json'
+        )
+    
+    if 'limit' in request.GET or 'after' in request.GET:
+        try:
+            limit = min(int(request.GET.get('limit', DETAILS_PAGE_SIZE)), DETAILS_MAX_PAGE_SIZE)
+            after = int(request.GET.get('after', 0))
+        except ValueError:
+            return JsonResponse({'error': 'limit and after must be integers.'}, status=400)
+        if limit < 1:
+            return JsonResponse({'error': 'limit must be positive.'}, status=400)
+        
+        batteries = list(
+            Battery.objects.filter(id__gt=after).order_by('id').values(*BATTERY_DETAIL_FIELDS)[:limit]
+        )
+        return JsonResponse({
+            'batteries': batteries,
+            'next_after': batteries[-1]['id'] if len(batteries) == limit else None,
+        })
+    
+    return JsonResponse(get_dashboard_section('batteries'))
 
 
 def alert_summary(request):
     """Get alert summary data."""
-    
-    # Alert types breakdown
-    alert_types = BatteryAlert.objects.values('alert_type').annotate(count=Count('id'))
-    
-    # Alert levels breakdown
-    alert_levels = BatteryAlert.objects.values('alert_level').annotate(
-        count=Count('id'),
-        unresolved=Count('id', filter=Q(is_resolved=False))
-    )
-    
-    # Recent unresolved alerts
-    recent_alerts = BatteryAlert.objects.filter(is_resolved=False).select_related('battery').values(
-        'id', 'battery__serial_number', 'alert_type', 'alert_level', 'message', 'created_at'
-    ).order_by('-created_at')[:10]
-    
-    return JsonResponse({
-        'alert_types': list(alert_types),
-        'alert_levels': list(alert_levels),
-        'recent_unresolved': list(recent_alerts),
-    })
+    return JsonResponse(get_dashboard_section('alerts'))
 
 
 def battery_trend(request):
-    """Get battery trend data from logs."""
-    
-    battery_id = request.GET.get('battery_id')
-    
-    if battery_id:
-        logs = BatteryLog.objects.filter(battery_id=battery_id).order_by('logged_at')[:100]
-    else:
-        logs = BatteryLog.objects.all().order_by('logged_at')[:100]
-    
-    data = {
-        'timestamps': [log.logged_at.isoformat() for log in logs],
-        'charge': [log.charge_percentage for log in logs],
-        'voltage': [log.voltage for log in logs],
-        'temperature': [log.temperature for log in logs],
-    }
-    
+    """
+    Get bucketed battery trend data from logs.
+    
+    Accepts battery_id, since/until (default: the last 24 hours), status,
+    points (target resolution) and downsample=lttb.
+    """
+    
+    try:
+        logs = filter_logs(BatteryLog.objects.all(), request.GET, battery_param='battery_id')
+        since = parse_timestamp(request.GET['since']) if request.GET.get('since') else None
+        until = parse_timestamp(request.GET['until'], end_of_day=True) if request.GET.get('until') else None
+        points = int(request.GET.get('points', TREND_DEFAULT_POINTS))
+    except ValidationError as exc:
+        return JsonResponse({'error': 'Invalid filter.', 'details': exc.detail}, status=400)
+    except ValueError:
+        return JsonResponse({'error': 'points must be an integer.'}, status=400)
+    if since and since > (until or timezone.now()):
+        return JsonResponse({'error': 'since must not be after until.'}, status=400)
+    
+    series = request.GET.get('series', 'charge')
+    if series not in TREND_FIELDS:
+        return JsonResponse({'error': f'series must be one of {", ".join(TREND_FIELDS)}.'}, status=400)
+    
+    data = build_trend(
+        logs, since=since, until=until, points=points,
+        downsample=request.GET.get('downsample'), series=series,
+        battery_id=request.GET.get('battery_id') or None,
+        use_rollups=TREND_USE_ROLLUPS and not request.GET.get('status')
+    )
     return JsonResponse(data)
 
 
+def fleet_analytics(request):
+    """
+    Fleet-wide statistics computed over the in-memory columnar snapshot.
+    
+    ?fields=charge,health (default: all) picks the columns summarised;
+    ?histogram=<field>&bins=N adds an equal-width histogram.
+    """
+    fields = [field for field in request.GET.get('fields', ','.join(FIELD_ALIASES)).split(',') if field]
+    histogram_field = request.GET.get('histogram')
+    unknown = [field for field in fields + [histogram_field] if field and field not in FIELD_ALIASES]
+    if unknown:
+        return JsonResponse({'error': f'Unknown field(s): {", ".join(unknown)}. '
+                                      f'Choose from {", ".join(FIELD_ALIASES)}.'}, status=400)
+    try:
+        bins = int(request.GET.get('bins', 10))
+    except ValueError:
+        return JsonResponse({'error': 'bins must be an integer.'}, status=400)
+    if not 1 <= bins <= ANALYTICS_MAX_BINS:
+        return JsonResponse({'error': f'bins must be between 1 and {ANALYTICS_MAX_BINS}.'}, status=400)
+    
+    return JsonResponse(fleet_state.analytics(fields, histogram_field=histogram_field, bins=bins))
+
+
+def pipeline_metrics(request):
+    """Queue depth, lag and throughput of the background alert pipeline, watchdog and fleet counters."""
+    return JsonResponse({
+        'alerts': alert_pipeline.metrics(),
+        'watchdog': watchdog.metrics(),
+        'anomaly': anomaly_detector.metrics(),
+        'fleet_state': fleet_state.metrics(),
+    })
+
+
 def dashboard_export(request):
-    """Export dashboard data as JSON for external use."""
+    """Export dashboard data as JSON (or NDJSON with ?format=ndjson) for external use."""
     
-    stats = dashboard_stats(request).json()
-    chart_data = battery_chart_data(request).json()
-    battery_data = battery_details(request).json()
-    alert_data = alert_summary(request).json()
+    asynchronous = is_async_request(request)
+    if request.GET.get('format') == 'ndjson':
+        rows = aiter_export_ndjson() if asynchronous else iter_export_ndjson()
+        return StreamingHttpResponse(rows, content_type=NDJSON_CONTENT_TYPE)
     
-    return JsonResponse({
-        'timestamp': __import__('django.utils.timezone', fromlist=['now']).now().isoformat(),
-        'stats': stats,
-        'charts': chart_data,
-        'batteries': battery_data,
-        'alerts': alert_data,
-    })
+    rows = aiter_export_json() if asynchronous else iter_export_json()
+    return StreamingHttpResponse(rows, content_type='application/json')
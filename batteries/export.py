@@ -0,0 +1,67 @@
+"""
+Dashboard export pipeline.
+
+The summary sections come straight from the dashboard snapshot as Python
+data, without its cached battery list; the per-battery section is
+streamed from the database in chunks so an export of a large fleet never
+holds the whole document in memory. The aiter_* variants do the same for
+views served under ASGI, where a sync iterator would be buffered.
+"""
+from asgiref.sync import sync_to_async
+from django.utils import timezone
+from .models import Battery
+from .snapshot import BATTERY_DETAIL_FIELDS, get_dashboard_snapshot
+from .streaming import STREAM_CHUNK_SIZE, aiter_json_array, aiter_ndjson, dumps, iter_json_array, iter_ndjson
+
+SUMMARY_SECTIONS = ('stats', 'charts', 'alerts')
+
+
+def export_summary():
+    """Everything in the export except the per-battery rows."""
+    return {
+        'timestamp': timezone.now().isoformat(),
+        **get_dashboard_snapshot(SUMMARY_SECTIONS),
+    }
+
+
+def battery_rows():
+    return Battery.objects.order_by('id').values(*BATTERY_DETAIL_FIELDS)
+
+
+def iter_battery_rows(chunk_size=STREAM_CHUNK_SIZE):
+    return battery_rows().iterator(chunk_size=chunk_size)
+
+
+def aiter_battery_rows(chunk_size=STREAM_CHUNK_SIZE):
+    return battery_rows().aiterator(chunk_size=chunk_size)
+
+
+def iter_export_json(chunk_size=STREAM_CHUNK_SIZE):
+    """Yield the export as a single JSON document."""
+    summary = export_summary()
+    # Open the summary object and splice the streamed battery array into it.
+    yield dumps(summary)[:-1] + ',"batteries":{"batteries":'
+    yield from iter_json_array(iter_battery_rows(chunk_size), chunk_size)
+    yield '}}'
+
+
+def iter_export_ndjson(chunk_size=STREAM_CHUNK_SIZE):
+    """Yield the summary as the first line, then one line per battery."""
+    yield dumps(export_summary()) + '\n'
+    yield from iter_ndjson(iter_battery_rows(chunk_size), chunk_size)
+
+
+async def aiter_export_json(chunk_size=STREAM_CHUNK_SIZE):
+    """Async version of iter_export_json."""
+    summary = await sync_to_async(export_summary)()
+    yield dumps(summary)[:-1] + ',"batteries":{"batteries":'
+    async for chunk in aiter_json_array(aiter_battery_rows(chunk_size), chunk_size):
+        yield chunk
+    yield '}}'
+
+
+async def aiter_export_ndjson(chunk_size=STREAM_CHUNK_SIZE):
+    """Async version of iter_export_ndjson."""
+    yield dumps(await sync_to_async(export_summary)()) + '\n'
+    async for chunk in aiter_ndjson(aiter_battery_rows(chunk_size), chunk_size):
+        yield chunk
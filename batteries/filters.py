@@ -0,0 +1,109 @@
+from datetime import datetime, time
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+
+def parse_timestamp(value, end_of_day=False):
+    """Parse an ISO-8601 datetime or date into an aware datetime."""
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(value)
+        parsed = datetime.combine(day, time.max if end_of_day else time.min)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def filter_logs(queryset, params, battery_param='battery'):
+    """
+    Apply battery/since/until/status filters to a BatteryLog queryset.
+
+    The battery + time range lookups map onto the (battery, -logged_at)
+    index, and time range alone onto (-logged_at, -id).
+    Raises ValidationError for malformed values.
+    """
+    errors = {}
+
+    battery = params.get(battery_param)
+    if battery:
+        try:
+            queryset = queryset.filter(battery_id=int(battery))
+        except ValueError:
+            errors[battery_param] = ['A valid integer is required.']
+
+    for param, lookup in (('since', 'logged_at__gte'), ('until', 'logged_at__lte')):
+        value = params.get(param)
+        if not value:
+            continue
+        try:
+            queryset = queryset.filter(**{lookup: parse_timestamp(value, end_of_day=param == 'until')})
+        except ValueError:
+            errors[param] = ['Expected an ISO-8601 date or datetime.']
+
+    status = params.get('status')
+    if status:
+        queryset = queryset.filter(status=status)
+
+    if errors:
+        raise ValidationError(errors)
+    return queryset
+
+
+def _as_list(value):
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [part for part in str(value).split(',') if part]
+
+
+def filter_alerts(queryset, params):
+    """
+    Apply selection criteria for bulk alert operations to a BatteryAlert queryset.
+
+    Accepts ids, battery, device, alert_type and alert_level (a value or a
+    list of values) and since/until on created_at. Returns the filtered
+    queryset and whether any criterion was given.
+    Raises ValidationError for malformed values.
+    """
+    errors = {}
+    applied = False
+
+    for param, lookup in (('ids', 'id__in'), ('battery', 'battery_id__in'), ('device', 'battery__devices__id__in')):
+        value = params.get(param)
+        if value in (None, '', []):
+            continue
+        try:
+            queryset = queryset.filter(**{lookup: [int(item) for item in _as_list(value)]})
+            applied = True
+        except (TypeError, ValueError):
+            errors[param] = ['Expected an integer or a list of integers.']
+
+    for param in ('alert_type', 'alert_level'):
+        value = params.get(param)
+        if value:
+            queryset = queryset.filter(**{f'{param}__in': _as_list(value)})
+            applied = True
+
+    for param, lookup in (('since', 'created_at__gte'), ('until', 'created_at__lte')):
+        value = params.get(param)
+        if not value:
+            continue
+        try:
+            queryset = queryset.filter(**{lookup: parse_timestamp(str(value), end_of_day=param == 'until')})
+            applied = True
+        except ValueError:
+            errors[param] = ['Expected an ISO-8601 date or datetime.']
+
+    if errors:
+        raise ValidationError(errors)
+    return queryset, applied
+
+
+class BatteryLogFilter(BaseFilterBackend):
+    """Filter logs by ?battery=, ?since=, ?until= and ?status=."""
+
+    def filter_queryset(self, request, queryset, view):
+        return filter_logs(queryset, request.query_params)
@@ -0,0 +1,346 @@
+"""
+Incremental in-memory fleet counters.
+
+The dashboard stats and chart data are answered from running counts and
+sums kept in process memory: per status, battery type and health, charge
+and cycle bucket, plus the sums behind the averages and the open alert
+counts. Per-battery values live in a columnar FleetColumns (see
+columns.py), which also backs the vectorized fleet analytics. The
+Battery, BatteryAlert and BatteryDevice save paths (signals, bulk
+ingest, record_alerts and resolve_alerts) report each change once it
+commits, and the counters move by the difference between the old and new
+state, so a poll never touches the database.
+
+The whole state is loaded from the database on first use, in the
+request that needs it. After that a background thread reloads it every
+BATTERY_FLEET_RECONCILE_INTERVAL seconds, or sooner when mark_stale() is
+called, which corrects drift from writes that bypass those paths or that
+were made by other processes. Readers keep using the current counters
+until the reload swaps in new ones, so polls never wait on the database.
+Changes that arrive while a reload is running are replayed on top of it.
+"""
+import logging
+import threading
+import time
+from collections import Counter, namedtuple
+from django.conf import settings
+from django.db import close_old_connections
+from .aggregates import ACTIVE_STATUSES, BUCKET_SPECS, LOW_HEALTH_THRESHOLD
+from .columns import NUMERIC_COLUMNS, FleetColumns, describe, histogram
+from .models import Battery, BatteryAlert, BatteryDevice
+from .snapshot import build_chart_data, build_stats
+
+
+logger = logging.getLogger(__name__)
+
+FLEET_RECONCILE_INTERVAL = getattr(settings, 'BATTERY_FLEET_RECONCILE_INTERVAL', 60)
+
+# The Battery fields the dashboard counters and fleet analytics depend on.
+BatteryEntry = namedtuple('BatteryEntry', ['current_status', 'battery_type', *NUMERIC_COLUMNS])
+ENTRY_FIELDS = list(BatteryEntry._fields)
+
+
+def battery_entry(battery):
+    return BatteryEntry(
+        current_status=battery.current_status,
+        battery_type=battery.battery_type,
+        current_charge=float(battery.current_charge),
+        current_voltage=float(battery.current_voltage),
+        current_temperature=float(battery.current_temperature),
+        health_percentage=float(battery.health_percentage),
+        cycle_count=int(battery.cycle_count),
+    )
+
+
+class _Counters:
+    """Counts and sums for one consistent view of the fleet."""
+
+    def __init__(self, batteries=None):
+        self.batteries = batteries if batteries is not None else FleetColumns()
+        self.status = Counter()
+        self.types = Counter()
+        self.buckets = {spec.name: Counter() for spec in BUCKET_SPECS}
+        self.low_health = 0
+        self.sums = Counter()
+        self.alert_total = 0
+        self.unresolved = {}
+        self.unresolved_levels = Counter()
+        self.devices = {}
+
+    def _count(self, entry, sign):
+        self.status[entry.current_status] += sign
+        self.types[entry.battery_type] += sign
+        for spec in BUCKET_SPECS:
+            label = spec.bucket_for(getattr(entry, spec.field))
+            if label is not None:
+                self.buckets[spec.name][label] += sign
+        if entry.health_percentage < LOW_HEALTH_THRESHOLD:
+            self.low_health += sign
+        self.sums['health'] += sign * entry.health_percentage
+        self.sums['charge'] += sign * entry.current_charge
+        self.sums['temperature'] += sign * entry.current_temperature
+
+    @classmethod
+    def from_columns(cls, batteries):
+        """Counters for a freshly loaded FleetColumns, computed with array operations."""
+        counters = cls(batteries)
+        counters.status.update(batteries.status_counts())
+        counters.types.update(batteries.type_counts())
+        for spec in BUCKET_SPECS:
+            values = batteries.column(spec.field)
+            for bucket in spec.buckets:
+                counters.buckets[spec.name][bucket.label] = int(spec.mask(bucket, values).sum())
+        health = batteries.column('health_percentage')
+        counters.low_health = int((health < LOW_HEALTH_THRESHOLD).sum())
+        counters.sums['health'] = float(health.sum())
+        counters.sums['charge'] = float(batteries.column('current_charge').sum())
+        counters.sums['temperature'] = float(batteries.column('current_temperature').sum())
+        return counters
+
+    def set_battery(self, battery_id, entry):
+        old = self.batteries.get(battery_id)
+        old = BatteryEntry(**old) if old is not None else None
+        if old == entry:
+            return
+        if old is not None:
+            self._count(old, -1)
+        if entry is None:
+            self.batteries.remove(battery_id)
+            return
+        self.batteries.set(battery_id, entry._asdict())
+        self._count(entry, 1)
+
+    def set_alert(self, alert_id, is_resolved, alert_level):
+        old = self.unresolved.pop(alert_id, None)
+        if old is not None:
+            self.unresolved_levels[old] -= 1
+        if not is_resolved:
+            self.unresolved[alert_id] = alert_level
+            self.unresolved_levels[alert_level] += 1
+
+
+class FleetState:
+    """Dashboard counters kept up to date by the save paths."""
+
+    def __init__(self, interval=FLEET_RECONCILE_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._reconcile_lock = threading.Lock()
+        self._counters = None
+        self._loaded_at = 0.0
+        self._replay = None
+        self._wake = threading.Event()
+        self._thread = None
+
+    def _apply(self, event):
+        with self._lock:
+            if self._counters is not None:
+                self._dispatch(self._counters, event)
+            if self._replay is not None:
+                self._replay.append(event)
+
+    def _dispatch(self, counters, event, max_alert_id=None):
+        kind, payload = event
+        if kind == 'batteries':
+            for battery_id, entry in payload:
+                counters.set_battery(battery_id, entry)
+        elif kind == 'alerts':
+            for alert_id, is_resolved, alert_level, created in payload:
+                # When replaying, alerts the reload already saw are not counted twice.
+                if created and (max_alert_id is None or alert_id > max_alert_id):
+                    counters.alert_total += 1
+                counters.set_alert(alert_id, is_resolved, alert_level)
+        elif kind == 'devices':
+            for device_id, is_active in payload:
+                if is_active is None:
+                    counters.devices.pop(device_id, None)
+                else:
+                    counters.devices[device_id] = is_active
+
+    def update_batteries(self, batteries):
+        """Batteries were created or changed."""
+        self._apply(('batteries', [(battery.pk, battery_entry(battery)) for battery in batteries]))
+
+    def update_battery_entries(self, entries):
+        """Like update_batteries, for (battery_id, BatteryEntry) pairs captured earlier."""
+        self._apply(('batteries', list(entries)))
+
+    def remove_batteries(self, battery_ids):
+        self._apply(('batteries', [(battery_id, None) for battery_id in battery_ids]))
+
+    def update_alerts(self, alerts, created=False):
+        self._apply(('alerts', [
+            (alert.pk, alert.is_resolved, alert.alert_level, created) for alert in alerts if alert.pk is not None
+        ]))
+
+    def resolve_alerts(self, alert_ids):
+        self._apply(('alerts', [(alert_id, True, None, False) for alert_id in alert_ids]))
+
+    def remove_alerts(self, alert_ids):
+        # Not replayed: a reload running concurrently may or may not have seen the delete.
+        with self._lock:
+            if self._counters is not None:
+                for alert_id in alert_ids:
+                    self._counters.alert_total -= 1
+                    self._counters.set_alert(alert_id, True, None)
+
+    def update_devices(self, devices):
+        self._apply(('devices', [(device.pk, device.is_active) for device in devices]))
+
+    def remove_devices(self, device_ids):
+        self._apply(('devices', [(device_id, None) for device_id in device_ids]))
+
+    def mark_stale(self):
+        """Have the background thread reload from the database now."""
+        self._loaded_at = 0.0
+        self._wake.set()
+
+    def reconcile(self):
+        """Rebuild every counter from the database and swap it in."""
+        with self._reconcile_lock:
+            self._reload()
+
+    def _reload(self):
+        with self._lock:
+            self._replay = []
+
+        try:
+            rows = Battery.objects.order_by('id').values_list('id', *ENTRY_FIELDS).iterator(chunk_size=2000)
+            counters = _Counters.from_columns(FleetColumns.from_rows(rows))
+            max_alert_id = BatteryAlert.objects.order_by('-id').values_list('id', flat=True).first() or 0
+            counters.alert_total = BatteryAlert.objects.filter(id__lte=max_alert_id).count()
+            open_alerts = BatteryAlert.objects.filter(is_resolved=False, id__lte=max_alert_id)
+            for alert_id, alert_level in open_alerts.values_list('id', 'alert_level'):
+                counters.set_alert(alert_id, False, alert_level)
+            counters.devices = dict(BatteryDevice.objects.values_list('id', 'is_active'))
+        except Exception:
+            with self._lock:
+                self._replay = None
+            raise
+
+        with self._lock:
+            for event in self._replay:
+                self._dispatch(counters, event, max_alert_id=max_alert_id)
+            self._replay = None
+            self._counters = counters
+            self._loaded_at = time.monotonic()
+
+    def _ensure_current(self):
+        if self._counters is None:
+            # Nothing to serve yet, so the first load happens inline.
+            with self._reconcile_lock:
+                if self._counters is None:
+                    self._reload()
+        self._ensure_thread()
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name='battery-fleet-state', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            woken = self._wake.wait(max(self._loaded_at + self.interval - time.monotonic(), 0))
+            self._wake.clear()
+            if not woken and time.monotonic() - self._loaded_at < self.interval:
+                continue
+            try:
+                self.reconcile()
+            except Exception:
+                logger.exception('Fleet state reconcile failed')
+                # Back off instead of retrying in a tight loop against a failing database.
+                self._wake.wait(self.interval)
+            finally:
+                close_old_connections()
+
+    def _read(self):
+        """(battery_stats, type_counts, alert_stats, device_stats) from the counters."""
+        self._ensure_current()
+        with self._lock:
+            counters = self._counters
+            total = len(counters.batteries)
+            battery_stats = {
+                'total': total,
+                'active': sum(counters.status[status] for status in ACTIVE_STATUSES),
+                'faulty': counters.status['FAULT'],
+                'low_health': counters.low_health,
+                'avg_health': counters.sums['health'] / total if total else 0,
+                'avg_charge': counters.sums['charge'] / total if total else 0,
+                'avg_temperature': counters.sums['temperature'] / total if total else 0,
+                'status': [
+                    {'current_status': status, 'count': counters.status[status]}
+                    for status, _ in Battery.STATUS_CHOICES if counters.status[status]
+                ],
+            }
+            for spec in BUCKET_SPECS:
+                battery_stats[spec.name] = {
+                    bucket.label: counters.buckets[spec.name][bucket.label] for bucket in spec.buckets
+                }
+            type_counts = [
+                {'battery_type': battery_type, 'count': count}
+                for battery_type, count in sorted(counters.types.items()) if count
+            ]
+            alert_stats = {
+                'total': counters.alert_total,
+                'unresolved': len(counters.unresolved),
+                'critical': counters.unresolved_levels['CRITICAL'],
+            }
+            device_stats = {
+                'total': len(counters.devices),
+                'active': sum(1 for is_active in counters.devices.values() if is_active),
+            }
+        return battery_stats, type_counts, alert_stats, device_stats
+
+    def stats(self):
+        """Same payload as the snapshot's stats section, without a query."""
+        battery_stats, _, alert_stats, device_stats = self._read()
+        return build_stats(battery_stats, alert_stats, device_stats)
+
+    def chart_data(self):
+        """Same payload as the snapshot's charts section, without a query."""
+        battery_stats, type_counts, _, _ = self._read()
+        return build_chart_data(battery_stats, type_counts)
+
+    def analytics(self, fields, histogram_field=None, bins=10):
+        """Vectorized summary statistics and an optional histogram over the fleet."""
+        self._ensure_current()
+        with self._lock:
+            batteries = self._counters.batteries
+            result = {
+                'count': len(batteries),
+                'fields': {field: describe(batteries.column(field)) for field in fields},
+            }
+            if histogram_field:
+                result['histogram'] = {
+                    'field': histogram_field,
+                    **histogram(batteries.column(histogram_field), bins=bins),
+                }
+        return result
+
+    def battery_ids_where(self, field, op, threshold):
+        """Ids of batteries whose numeric field compares true against threshold, in id order."""
+        self._ensure_current()
+        with self._lock:
+            batteries = self._counters.batteries
+            return batteries.ids_where(op(batteries.column(field), threshold)).tolist()
+
+    def battery_ids_with_status(self, status):
+        self._ensure_current()
+        with self._lock:
+            batteries = self._counters.batteries
+            return batteries.ids_where(batteries.status_mask(status)).tolist()
+
+    def metrics(self):
+        with self._lock:
+            counters = self._counters
+            return {
+                'loaded': counters is not None,
+                'age': round(time.monotonic() - self._loaded_at, 1) if counters is not None else None,
+                'batteries': len(counters.batteries) if counters is not None else 0,
+                'unresolved_alerts': len(counters.unresolved) if counters is not None else 0,
+            }
+
+
+fleet_state = FleetState()
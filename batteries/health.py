@@ -0,0 +1,299 @@
+"""
+Battery health and remaining-useful-life estimation from BatteryLog history.
+
+The logs of a group of batteries are read with one query into flat NumPy
+arrays sorted by battery and time. Every quantity below is a vectorized
+expression over consecutive sample pairs, summed per battery with
+np.bincount, so a group of hundreds of batteries costs one query and a few
+array passes rather than a Python loop per log.
+
+- Cycles: current is integrated over time (coulomb counting), skipping
+  gaps longer than BATTERY_HEALTH_MAX_GAP seconds. Discharged Ah over the
+  rated capacity gives equivalent full cycles, accumulated across runs so
+  the count survives log retention.
+- Capacity fade: wherever the charge percentage moved with the current,
+  Ah moved per percent of charge estimates usable capacity. A weighted
+  linear fit of those estimates against cumulative cycles gives today's
+  capacity and how much is lost per cycle. A capacity outside
+  BATTERY_HEALTH_PLAUSIBLE_RANGE percent of rated says more about the
+  data (a fuel gauge jump between samples seconds apart) than about wear,
+  so it counts as no estimate.
+- Internal resistance: dV/dI across closely spaced samples with a current
+  step, fitted per battery.
+- Remaining useful life: cycles until capacity reaches
+  BATTERY_HEALTH_END_OF_LIFE percent of rated, and the days that takes at
+  the battery's cycle rate over the window.
+"""
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone as dt_timezone
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .broadcast import broadcast_buffer
+from .fleet_state import fleet_state
+from .models import Battery, BatteryHealthEstimate, BatteryLog
+from .snapshot import mark_dashboard_dirty
+
+
+# Days of logs each estimate looks at; None uses every retained log.
+HEALTH_WINDOW_DAYS = getattr(settings, 'BATTERY_HEALTH_WINDOW_DAYS', 7)
+HEALTH_BATCH_SIZE = getattr(settings, 'BATTERY_HEALTH_BATCH_SIZE', 200)
+HEALTH_MAX_GAP = getattr(settings, 'BATTERY_HEALTH_MAX_GAP', 900)
+# Percentage points of charge movement needed before capacity is estimated at all.
+HEALTH_MIN_CHARGE_SWING = getattr(settings, 'BATTERY_HEALTH_MIN_CHARGE_SWING', 20)
+# Cycles the window must span before a fade trend is fitted.
+HEALTH_MIN_TREND_CYCLES = getattr(settings, 'BATTERY_HEALTH_MIN_TREND_CYCLES', 2)
+HEALTH_END_OF_LIFE = getattr(settings, 'BATTERY_HEALTH_END_OF_LIFE', 80)
+# Capacity estimates outside this range (% of rated capacity) are discarded as measurement errors.
+HEALTH_PLAUSIBLE_RANGE = getattr(settings, 'BATTERY_HEALTH_PLAUSIBLE_RANGE', (20, 120))
+
+# Resistance is read from current steps between samples taken before the voltage relaxes.
+RESISTANCE_MAX_GAP = 60
+RESISTANCE_MIN_STEP = 0.5
+# Fade below this (% of rated capacity per cycle) is treated as noise, not a trend to project.
+MIN_FADE_PER_CYCLE = 0.001
+
+LOG_FIELDS = ['battery_id', 'logged_at', 'charge_percentage', 'voltage', 'current']
+LOAD_CHUNK_SIZE = 10000
+
+HealthEstimate = namedtuple('HealthEstimate', [
+    'battery_id', 'window_start', 'window_end', 'samples',
+    'equivalent_cycles', 'counted_until', 'throughput_ah',
+    'capacity_ah', 'health_percentage', 'fade_per_cycle', 'internal_resistance',
+    'remaining_cycles', 'remaining_days',
+])
+ESTIMATE_FIELDS = list(HealthEstimate._fields[1:])
+
+
+def load_history(battery_ids, since=None, until=None):
+    """
+    Logs of battery_ids as a dict of arrays sorted by battery and time:
+    'group' (index into the sorted battery_ids), 'time' (epoch seconds),
+    'charge', 'voltage' and 'current'.
+    """
+    logs = BatteryLog.objects.filter(battery_id__in=list(battery_ids))
+    if since is not None:
+        logs = logs.filter(logged_at__gte=since)
+    if until is not None:
+        logs = logs.filter(logged_at__lte=until)
+    rows = logs.order_by('battery_id', 'logged_at', 'id').values_list(*LOG_FIELDS)
+
+    ids = np.array(sorted(battery_ids), dtype=np.int64)
+    parts = {name: [] for name in ('group', 'time', 'charge', 'voltage', 'current')}
+    chunk = []
+    for row in rows.iterator(chunk_size=LOAD_CHUNK_SIZE):
+        chunk.append(row)
+        if len(chunk) == LOAD_CHUNK_SIZE:
+            _append_chunk(parts, ids, chunk)
+            chunk = []
+    if chunk:
+        _append_chunk(parts, ids, chunk)
+
+    history = {
+        name: np.concatenate(arrays) if arrays else np.zeros(0)
+        for name, arrays in parts.items()
+    }
+    history['group'] = history['group'].astype(np.int64)
+    return history
+
+
+def _append_chunk(parts, ids, chunk):
+    owners, logged_at, charge, voltage, current = zip(*chunk)
+    parts['group'].append(np.searchsorted(ids, np.array(owners, dtype=np.int64)))
+    parts['time'].append(np.array([moment.timestamp() for moment in logged_at]))
+    parts['charge'].append(np.array(charge, dtype=float))
+    parts['voltage'].append(np.array(voltage, dtype=float))
+    parts['current'].append(np.array(current, dtype=float))
+
+
+def compute_estimates(batteries, history, previous=None):
+    """
+    HealthEstimate per battery from a history loaded by load_history().
+
+    batteries must be sorted by id. previous maps battery_id to the
+    (equivalent_cycles, counted_until) of its last estimate; batteries
+    without one start counting from their reported cycle_count.
+    """
+    previous = previous or {}
+    k = len(batteries)
+    group, t = history['group'], history['time']
+    charge, voltage, current = history['charge'], history['voltage'], history['current']
+
+    def per_battery(weights, where):
+        # Sum of weights over the sample pairs selected by where, for each battery.
+        return np.bincount(pair_group, weights=np.where(where, weights, 0.0), minlength=k)
+
+    rated = np.array([battery.capacity / 1000 for battery in batteries], dtype=float)
+    rated = np.where(rated > 0, rated, np.nan)
+    base_cycles = np.array([
+        previous[battery.id][0] if battery.id in previous else battery.cycle_count for battery in batteries
+    ], dtype=float)
+    counted_until = np.array([
+        previous[battery.id][1].timestamp() if previous.get(battery.id, (0, None))[1] else -np.inf
+        for battery in batteries
+    ], dtype=float)
+
+    first = np.searchsorted(group, np.arange(k), side='left')
+    samples = np.searchsorted(group, np.arange(k), side='right') - first
+    has_logs = samples > 0
+    start_time = np.full(k, np.nan)
+    end_time = np.full(k, np.nan)
+    start_time[has_logs] = t[first[has_logs]]
+    end_time[has_logs] = t[first[has_logs] + samples[has_logs] - 1]
+
+    # Sample pair j runs from sample j to sample j + 1.
+    pair_group = group[1:]
+    dt = np.diff(t)
+    same = group[1:] == group[:-1]
+    valid = same & (dt > 0) & (dt <= HEALTH_MAX_GAP)
+
+    # Coulomb counting (left Riemann sum; positive current is charging).
+    ah = np.where(valid, current[:-1] * dt / 3600, 0.0)
+    discharged_ah = np.maximum(-ah, 0.0)
+    charged = per_battery(np.maximum(ah, 0.0), valid)
+    discharged = per_battery(discharged_ah, valid)
+    new_discharged = per_battery(discharged_ah, valid & (t[1:] > counted_until[pair_group]))
+    window_cycles = discharged / rated
+    total_cycles = base_cycles + np.nan_to_num(new_discharged / rated)
+
+    # Capacity: Ah moved per 100% of charge moved, wherever both moved the same way.
+    moved = np.diff(charge)
+    usable = valid & (moved * ah > 0)
+    weight = np.abs(moved)
+    # Cumulative cycles at each pair, restarting at every battery.
+    before = np.concatenate([[0.0], np.cumsum(discharged)])
+    x = (np.cumsum(discharged_ah) - before[pair_group]) / rated[pair_group]
+    y = np.divide(np.abs(ah) * 100, weight, out=np.zeros_like(ah), where=usable)
+    sw = per_battery(weight, usable)
+    sx = per_battery(weight * x, usable)
+    sy = per_battery(weight * y, usable)
+    sxx = per_battery(weight * x * x, usable)
+    sxy = per_battery(weight * x * y, usable)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        enough = sw >= HEALTH_MIN_CHARGE_SWING
+        mean_x, mean_y = sx / sw, sy / sw
+        var_x = sxx / sw - mean_x ** 2
+        slope = (sxy / sw - mean_x * mean_y) / var_x
+        trend = enough & (window_cycles >= HEALTH_MIN_TREND_CYCLES) & (var_x > 0)
+        capacity = np.where(trend, mean_y + slope * (window_cycles - mean_x), mean_y)
+        low, high = HEALTH_PLAUSIBLE_RANGE
+        plausible = enough & (capacity >= rated * low / 100) & (capacity <= rated * high / 100)
+        capacity = np.where(plausible, capacity, np.nan)
+        health = np.clip(capacity / rated * 100, 0, 100)
+        fade = np.where(trend & plausible, -slope / rated * 100, np.nan)
+
+        # Remaining useful life; no projection while no fade is measurable.
+        remaining = np.where(fade >= MIN_FADE_PER_CYCLE, np.maximum(health - HEALTH_END_OF_LIFE, 0) / fade, np.nan)
+        remaining = np.where(health <= HEALTH_END_OF_LIFE, 0.0, remaining)
+        cycle_rate = window_cycles / ((end_time - start_time) / 86400)
+        remaining_days = np.where(cycle_rate > 0, remaining / cycle_rate, np.nan)
+
+        # Internal resistance: least-squares dV/dI through the origin.
+        dv, di = np.diff(voltage), np.diff(current)
+        stepped = same & (dt > 0) & (dt <= RESISTANCE_MAX_GAP) & (np.abs(di) >= RESISTANCE_MIN_STEP)
+        resistance = per_battery(dv * di, stepped) / per_battery(di * di, stepped)
+        resistance = np.where(resistance > 0, resistance, np.nan)
+
+    counted_until = np.fmax(counted_until, end_time)
+
+    estimates = []
+    for index, battery in enumerate(batteries):
+        estimates.append(HealthEstimate(
+            battery_id=battery.id,
+            window_start=_from_epoch(start_time[index]),
+            window_end=_from_epoch(end_time[index]),
+            samples=int(samples[index]),
+            equivalent_cycles=round(float(total_cycles[index]), 3),
+            counted_until=_from_epoch(counted_until[index]),
+            throughput_ah=round(float(charged[index] + discharged[index]), 3),
+            capacity_ah=_value(capacity[index], 4),
+            health_percentage=_value(health[index], 2),
+            fade_per_cycle=_value(fade[index], 5),
+            internal_resistance=_value(resistance[index], 5),
+            remaining_cycles=_value(remaining[index], 1),
+            remaining_days=_value(remaining_days[index], 1),
+        ))
+    return estimates
+
+
+def _value(number, digits):
+    return round(float(number), digits) if np.isfinite(number) else None
+
+
+def _from_epoch(seconds):
+    return datetime.fromtimestamp(float(seconds), tz=dt_timezone.utc) if np.isfinite(seconds) else None
+
+
+def estimate_batteries(batteries, now=None, window_days=HEALTH_WINDOW_DAYS):
+    """Estimate a group of Battery instances from their logs, without saving."""
+    now = now or timezone.now()
+    batteries = sorted(batteries, key=lambda battery: battery.id)
+    battery_ids = [battery.id for battery in batteries]
+    since = now - timedelta(days=window_days) if window_days else None
+    previous = {
+        battery_id: (cycles, counted_until)
+        for battery_id, cycles, counted_until in BatteryHealthEstimate.objects.filter(
+            battery_id__in=battery_ids
+        ).values_list('battery_id', 'equivalent_cycles', 'counted_until')
+    }
+    return compute_estimates(batteries, load_history(battery_ids, since=since, until=now), previous)
+
+
+def save_estimates(estimates, now=None):
+    """Upsert the BatteryHealthEstimate row of each estimate."""
+    now = now or timezone.now()
+    BatteryHealthEstimate.objects.bulk_create(
+        [
+            BatteryHealthEstimate(estimated_at=now, **estimate._asdict())
+            for estimate in estimates
+        ],
+        update_conflicts=True,
+        unique_fields=['battery'],
+        update_fields=['estimated_at', *ESTIMATE_FIELDS],
+    )
+
+
+def apply_estimates(batteries, estimates):
+    """
+    Write estimated health_percentage and cycle_count back onto the batteries.
+
+    Batteries without a capacity estimate keep their reported health.
+    """
+    by_id = {battery.id: battery for battery in batteries}
+    changed = []
+    for estimate in estimates:
+        battery = by_id[estimate.battery_id]
+        health = estimate.health_percentage if estimate.health_percentage is not None else battery.health_percentage
+        cycles = int(estimate.equivalent_cycles)
+        if (health, cycles) != (battery.health_percentage, battery.cycle_count):
+            battery.health_percentage, battery.cycle_count = health, cycles
+            changed.append(battery)
+    if changed:
+        # bulk_update skips post_save (and leaves last_updated alone), so report the change directly.
+        Battery.objects.bulk_update(changed, ['health_percentage', 'cycle_count'])
+        transaction.on_commit(lambda: _broadcast_health(changed))
+    return changed
+
+
+def _broadcast_health(batteries):
+    mark_dashboard_dirty()
+    fleet_state.update_batteries(batteries)
+    broadcast_buffer.add(battery_ids=[battery.id for battery in batteries])
+
+
+def unsaved_estimate(estimate, now=None):
+    """An unsaved BatteryHealthEstimate holding estimate, for serializing without a write."""
+    return BatteryHealthEstimate(estimated_at=now or timezone.now(), **estimate._asdict())
+
+
+def refresh_health(batteries, apply=False, now=None, window_days=HEALTH_WINDOW_DAYS):
+    """Estimate, save and optionally apply one group of batteries; returns the estimates."""
+    now = now or timezone.now()
+    estimates = estimate_batteries(batteries, now=now, window_days=window_days)
+    with transaction.atomic():
+        save_estimates(estimates, now=now)
+        if apply:
+            apply_estimates(batteries, estimates)
+    return estimates
@@ -0,0 +1,160 @@
+"""Bulk telemetry ingestion for many batteries in one request."""
+import math
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .alert_pipeline import alert_pipeline
+from .models import Battery, BatteryLog
+from .rollups import record_logs
+from .rules import reading_from_battery
+from .broadcast import broadcast_buffer
+from .fleet_state import battery_entry, fleet_state
+from .locking import serialized_writes
+from .snapshot import mark_dashboard_dirty
+from .watchdog import watchdog
+
+
+READING_FIELDS = ['current_charge', 'current_voltage', 'current_temperature', 'current_status']
+NUMERIC_FIELDS = ['current_charge', 'current_voltage', 'current_temperature', 'current']
+VALID_STATUSES = {choice for choice, _ in Battery.STATUS_CHOICES}
+
+INGEST_BATCH_SIZE = getattr(settings, 'BATTERY_INGEST_BATCH_SIZE', 1000)
+INGEST_MAX_READINGS = getattr(settings, 'BATTERY_INGEST_MAX_READINGS', 10000)
+
+
+def clean_reading(reading):
+    """Validate a single reading, returning (cleaned, errors)."""
+    if not isinstance(reading, dict):
+        return None, {'non_field_errors': ['Reading must be an object.']}
+
+    errors = {}
+    cleaned = {}
+
+    if reading.get('battery') is not None:
+        try:
+            cleaned['battery'] = int(reading['battery'])
+        except (TypeError, ValueError):
+            errors['battery'] = ['A valid integer is required.']
+    elif reading.get('serial_number'):
+        cleaned['serial_number'] = str(reading['serial_number'])
+    else:
+        errors['battery'] = ['Either battery or serial_number is required.']
+
+    for field in NUMERIC_FIELDS:
+        if field not in reading:
+            continue
+        try:
+            value = float(reading[field])
+        except (TypeError, ValueError):
+            errors[field] = ['A valid number is required.']
+            continue
+        # float() accepts "nan" and "inf", which the database cannot store.
+        if not math.isfinite(value):
+            errors[field] = ['A finite number is required.']
+        else:
+            cleaned[field] = value
+
+    if 'current_charge' in cleaned and not 0 <= cleaned['current_charge'] <= 100:
+        errors['current_charge'] = ['Ensure this value is between 0 and 100.']
+
+    if 'current_status' in reading:
+        if reading['current_status'] in VALID_STATUSES:
+            cleaned['current_status'] = reading['current_status']
+        else:
+            errors['current_status'] = [f'"{reading["current_status"]}" is not a valid choice.']
+
+    return (None, errors) if errors else (cleaned, None)
+
+
+def _load_batteries(cleaned_readings):
+    """Fetch and lock every battery referenced by the batch in a single query."""
+    ids = {r['battery'] for r in cleaned_readings if 'battery' in r}
+    serials = {r['serial_number'] for r in cleaned_readings if 'serial_number' in r}
+    batteries = Battery.objects.select_for_update().filter(Q(id__in=ids) | Q(serial_number__in=serials))
+    by_id = {}
+    by_serial = {}
+    for battery in batteries:
+        by_id[battery.id] = battery
+        by_serial[battery.serial_number] = battery
+    return by_id, by_serial
+
+
+def ingest_readings(readings):
+    """
+    Apply a batch of readings with one bulk write per table.
+
+    Readings are applied in order, so several readings for the same battery
+    each produce a log entry and the last one wins on the battery row.
+    Alert checks are queued on the alert pipeline once the batch commits.
+    Returns one result dict per reading, in input order.
+    """
+    results = [None] * len(readings)
+    pending = []
+
+    for index, reading in enumerate(readings):
+        cleaned, errors = clean_reading(reading)
+        if errors:
+            results[index] = {'index': index, 'status': 'error', 'errors': errors}
+        else:
+            pending.append((index, cleaned))
+
+    if not pending:
+        return results
+
+    with serialized_writes(), transaction.atomic():
+        by_id, by_serial = _load_batteries([cleaned for _, cleaned in pending])
+        now = timezone.now()
+        touched = {}
+        logs = []
+        readings_to_check = []
+
+        for index, cleaned in pending:
+            if 'battery' in cleaned:
+                battery = by_id.get(cleaned['battery'])
+            else:
+                battery = by_serial.get(cleaned['serial_number'])
+            if battery is None:
+                results[index] = {'index': index, 'status': 'error',
+                                  'errors': {'battery': ['Battery not found.']}}
+                continue
+
+            for field in READING_FIELDS:
+                if field in cleaned:
+                    setattr(battery, field, cleaned[field])
+            battery.last_updated = now
+            touched[battery.id] = battery
+
+            logs.append(BatteryLog(
+                battery=battery,
+                charge_percentage=battery.current_charge,
+                voltage=battery.current_voltage,
+                temperature=battery.current_temperature,
+                current=cleaned.get('current', 0),
+                status=battery.current_status
+            ))
+
+            readings_to_check.append(reading_from_battery(battery, cleaned.get('current', 0)))
+            results[index] = {'index': index, 'status': 'ok', 'battery': battery.id}
+
+        Battery.objects.bulk_update(
+            touched.values(), READING_FIELDS + ['last_updated'], batch_size=INGEST_BATCH_SIZE
+        )
+        BatteryLog.objects.bulk_create(logs, batch_size=INGEST_BATCH_SIZE)
+        record_logs(logs)
+        alert_pipeline.submit_readings(readings_to_check)
+
+        if touched:
+            entries = [(battery_id, battery_entry(battery)) for battery_id, battery in touched.items()]
+            transaction.on_commit(lambda: _broadcast_ingest(entries))
+
+    return results
+
+
+def _broadcast_ingest(entries):
+    # Bulk writes skip post_save, so do what the signal handlers would.
+    battery_ids = [battery_id for battery_id, _ in entries]
+    mark_dashboard_dirty()
+    fleet_state.update_battery_entries(entries)
+    broadcast_buffer.add(battery_ids=battery_ids)
+    watchdog.seen(battery_ids)
@@ -0,0 +1,24 @@
+"""
+Single-writer serialization for SQLite.
+
+SQLite allows one writer at a time, and a transaction that reads before
+it writes fails with "database is locked" instead of waiting when another
+connection started writing in between. The read-then-write transactions
+of the ingest, rollup and alert paths run inside serialized_writes(), so
+on SQLite the threads of one process take turns; other databases keep
+running them concurrently.
+"""
+import threading
+from contextlib import nullcontext
+from django.db import connections
+
+
+# Reentrant: committing an ingest batch can record alerts on the same thread.
+_sqlite_writer = threading.RLock()
+
+
+def serialized_writes(using='default'):
+    """Context manager held around a read-then-write transaction."""
+    if connections[using].vendor == 'sqlite':
+        return _sqlite_writer
+    return nullcontext()
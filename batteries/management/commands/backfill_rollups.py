@@ -0,0 +1,60 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from batteries.filters import parse_timestamp
+from batteries.models import Battery, BatteryLog
+from batteries.retention import first_complete_raw_day
+from batteries.rollups import ROLLUP_RESOLUTIONS, bucket_start, rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild BatteryLog rollups from raw logs, one day and one group of batteries at a time.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='ISO-8601 date or datetime (default: oldest log)')
+        parser.add_argument('--until', help='ISO-8601 date or datetime (default: newest log)')
+        parser.add_argument('--battery', type=int, action='append', dest='batteries',
+                            help='Battery id to rebuild; may be repeated (default: all)')
+        parser.add_argument('--resolution', choices=ROLLUP_RESOLUTIONS, action='append', dest='resolutions',
+                            help='Resolution to rebuild; may be repeated (default: all)')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Batteries per rebuild query (default: 500)')
+
+    def handle(self, *args, **options):
+        bounds = BatteryLog.objects.aggregate(oldest=Min('logged_at'), newest=Max('logged_at'))
+        if bounds['oldest'] is None:
+            self.stdout.write('No logs to roll up.')
+            return
+
+        try:
+            since = parse_timestamp(options['since']) if options['since'] else bounds['oldest']
+            until = parse_timestamp(options['until'], end_of_day=True) if options['until'] else bounds['newest']
+        except ValueError as exc:
+            raise CommandError(f'Invalid date: {exc}')
+
+        resolutions = options['resolutions'] or ROLLUP_RESOLUTIONS
+        battery_ids = options['batteries'] or list(Battery.objects.order_by('id').values_list('id', flat=True))
+        batch_size = options['batch_size']
+
+        # Work in whole UTC days so every minute, hour and day bucket is rebuilt completely.
+        # Days before complete_from may have lost raw logs to pruning, so their
+        # existing rollups are kept and only missing buckets are filled in.
+        complete_from = first_complete_raw_day()
+        day = bucket_start(since, 'day')
+        total = 0
+        while day <= until:
+            next_day = day + timedelta(days=1)
+            replace = complete_from is None or day >= complete_from
+            for start in range(0, len(battery_ids), batch_size):
+                logs = BatteryLog.objects.filter(
+                    battery_id__in=battery_ids[start:start + batch_size],
+                    logged_at__gte=day,
+                    logged_at__lt=next_day,
+                )
+                for resolution in resolutions:
+                    total += rebuild_rollups(logs, resolution, replace=replace)
+            note = '' if replace else ', partial raw logs: missing buckets only'
+            self.stdout.write(f'{day.date()}: done ({total} rollup rows so far{note})')
+            day = next_day
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {total} rollup rows.'))
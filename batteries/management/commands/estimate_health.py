@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from batteries.health import HEALTH_BATCH_SIZE, HEALTH_WINDOW_DAYS, refresh_health
+from batteries.models import Battery
+
+
+class Command(BaseCommand):
+    help = (
+        'Estimate health, coulomb-counted cycles, capacity fade, internal resistance and remaining '
+        'useful life for every battery from its logs, one group of batteries at a time.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--battery', type=int, action='append', dest='batteries',
+                            help='Battery id to estimate; may be repeated (default: all)')
+        parser.add_argument('--window-days', type=float, default=HEALTH_WINDOW_DAYS,
+                            help=f'Days of logs to read; 0 reads every retained log (default: {HEALTH_WINDOW_DAYS})')
+        parser.add_argument('--batch-size', type=int, default=HEALTH_BATCH_SIZE,
+                            help=f'Batteries per log query (default: {HEALTH_BATCH_SIZE})')
+        parser.add_argument('--apply', action='store_true',
+                            help="Also write the estimated health_percentage and cycle_count onto each battery")
+
+    def handle(self, *args, **options):
+        batteries = Battery.objects.order_by('id')
+        if options['batteries']:
+            batteries = batteries.filter(id__in=options['batteries'])
+        battery_ids = list(batteries.values_list('id', flat=True))
+        batch_size = options['batch_size']
+
+        done = estimated = 0
+        for start in range(0, len(battery_ids), batch_size):
+            group = list(Battery.objects.filter(id__in=battery_ids[start:start + batch_size]).order_by('id'))
+            estimates = refresh_health(group, apply=options['apply'], window_days=options['window_days'] or None)
+            done += len(estimates)
+            estimated += sum(1 for estimate in estimates if estimate.health_percentage is not None)
+            self.stdout.write(f'{done}/{len(battery_ids)} batteries ({estimated} with a capacity estimate)')
+
+        self.stdout.write(self.style.SUCCESS(f'Estimated {done} batteries.'))
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+from batteries.retention import (
+    RETENTION, RETENTION_BATCH_SIZE, delete_in_batches, estimate_row_bytes, tier_querysets, vacuum
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete BatteryLog rows and rollups older than BATTERY_LOG_RETENTION, in bounded batches. '
+        'Safe to run from cron; rollups must be current (see backfill_rollups) before raw logs age out.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=RETENTION_BATCH_SIZE,
+                            help=f'Rows deleted per transaction (default: {RETENTION_BATCH_SIZE})')
+        parser.add_argument('--pause', type=float, default=0.0,
+                            help='Seconds to sleep between batches (default: 0)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report how many rows would be deleted')
+        parser.add_argument('--vacuum', action='store_true',
+                            help='VACUUM afterwards so the space is actually reclaimed')
+
+    def handle(self, *args, **options):
+        policy = ', '.join(f'{tier}={days if days is not None else "forever"}' for tier, days in RETENTION.items())
+        self.stdout.write(f'Retention (days): {policy}')
+
+        total_rows = 0
+        total_bytes = 0
+        for tier, queryset in tier_querysets():
+            row_bytes = estimate_row_bytes(queryset.model)
+            if options['dry_run']:
+                rows = queryset.count()
+            else:
+                rows = delete_in_batches(
+                    queryset,
+                    batch_size=options['batch_size'],
+                    pause=options['pause'],
+                    progress=lambda done, tier=tier: self.stdout.write(f'  {tier}: {done} rows deleted'),
+                )
+            total_rows += rows
+            total_bytes += rows * row_bytes
+            self.stdout.write(f'{tier}: {rows} rows, ~{_format_bytes(rows * row_bytes)}')
+
+        verb = 'Would reclaim' if options['dry_run'] else 'Reclaimed'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {total_rows} rows, ~{_format_bytes(total_bytes)}'))
+
+        if options['vacuum'] and not options['dry_run'] and total_rows:
+            vacuum()
+            self.stdout.write('Vacuum complete.')
+
+
+def _format_bytes(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return f'{size:.0f} {unit}' if unit == 'B' else f'{size:.1f} {unit}'
+        size /= 1024
+    return f'{size:.1f} TB'
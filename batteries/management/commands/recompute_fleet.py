@@ -0,0 +1,113 @@
+import os
+import time
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from batteries.filters import parse_timestamp
+from batteries.health import HEALTH_WINDOW_DAYS
+from batteries.models import Battery
+from batteries.recompute import TASKS, Checkpoint, init_worker, plan_shards, run_shard
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute health estimates, alert rules against the latest readings, or rollups for the whole fleet, '
+        'sharded by battery id across worker processes. Interrupted runs resume from a checkpoint file.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('task', choices=sorted(TASKS))
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Worker processes; 0 runs in this process (default: one per CPU)')
+        parser.add_argument('--shard-size', type=int, default=1000,
+                            help='Batteries per shard handed to a worker (default: 1000)')
+        parser.add_argument('--chunk-size', type=int, default=200,
+                            help='Batteries whose logs a worker loads at once (default: 200)')
+        parser.add_argument('--since', help='ISO-8601 date or datetime; rules and rollups ignore older logs')
+        parser.add_argument('--window-days', type=float, default=HEALTH_WINDOW_DAYS,
+                            help=f'Days of logs per health estimate (default: {HEALTH_WINDOW_DAYS})')
+        parser.add_argument('--checkpoint',
+                            help='Checkpoint file (default: recompute_<task>.checkpoint.json)')
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignore an existing checkpoint and start from the first shard')
+
+    def handle(self, *args, **options):
+        task = options['task']
+        if options['since']:
+            try:
+                parse_timestamp(options['since'])
+            except ValueError as exc:
+                raise CommandError(f'Invalid date: {exc}')
+        if options['shard_size'] < 1 or options['chunk_size'] < 1:
+            raise CommandError('Shard and chunk sizes must be positive.')
+
+        # Everything that changes what a shard computes; a checkpoint only resumes a run with the same values.
+        job = {
+            'shard_size': options['shard_size'],
+            'chunk_size': options['chunk_size'],
+            'since': options['since'],
+            'window_days': options['window_days'] or None,
+        }
+        checkpoint = Checkpoint(options['checkpoint'] or f'recompute_{task}.checkpoint.json', task, job)
+
+        workers = options['workers']
+        if workers > 1 and connections['default'].vendor == 'sqlite':
+            # SQLite takes one writer at a time; parallel workers would only time out on its lock.
+            self.stdout.write(self.style.WARNING('SQLite database: running with a single worker.'))
+            workers = 1
+
+        battery_ids = list(Battery.objects.order_by('id').values_list('id', flat=True))
+        if not options['restart'] and checkpoint.load():
+            # Batteries added since the run started get shards of their own.
+            planned = checkpoint.shards[-1][1] if checkpoint.shards else 0
+            checkpoint.shards += plan_shards(battery_ids[bisect_right(battery_ids, planned):], job['shard_size'])
+            self.stdout.write(
+                f'Resuming from {checkpoint.path}: {len(checkpoint.done)}/{len(checkpoint.shards)} shards done'
+            )
+        else:
+            checkpoint.shards = plan_shards(battery_ids, job['shard_size'])
+        checkpoint.save()
+
+        pending = checkpoint.pending()
+        total = sum(bisect_right(battery_ids, last) - bisect_left(battery_ids, first) for first, last in pending)
+        self.stdout.write(f'{task}: {len(pending)} shards, {total} batteries, {max(workers, 0)} workers')
+
+        started = time.monotonic()
+        done = results = 0
+        for index, (shard, batteries, written) in enumerate(self._run(task, pending, job, workers), 1):
+            checkpoint.mark_done(shard, written)
+            done += batteries
+            results += written
+            elapsed = time.monotonic() - started
+            rate = done / elapsed if elapsed else 0
+            eta = f'{(total - done) / rate:.0f}s' if rate else '?'
+            self.stdout.write(
+                f'[{index}/{len(pending)}] ids {shard[0]}-{shard[1]}: {done}/{total} batteries, '
+                f'{results} results, {rate:.0f} batteries/s, ETA {eta}'
+            )
+
+        checkpoint.remove()
+        self.stdout.write(self.style.SUCCESS(
+            f'{task}: recomputed {done} batteries ({results} results) in {time.monotonic() - started:.1f}s'
+        ))
+
+    def _run(self, task, shards, job, workers):
+        """Yield run_shard results as shards finish."""
+        if workers <= 0:
+            for shard in shards:
+                yield run_shard(task, shard, job)
+            return
+
+        # Forked workers must not inherit (and share) this process's database connections.
+        connections.close_all()
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker)
+        try:
+            futures = [pool.submit(run_shard, task, shard, job) for shard in shards]
+            for future in as_completed(futures):
+                yield future.result()
+        except BaseException:
+            # Finished shards are checkpointed; drop the queued ones instead of waiting for them.
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+        pool.shutdown()
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-17 15:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("batteries", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="batteryalert",
+            index=models.Index(
+                fields=["-created_at", "-id"], name="batteries_b_created_09e026_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="batterylog",
+            index=models.Index(
+                fields=["-logged_at", "-id"], name="batteries_b_logged__73f48b_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 4.2.7 on 2026-10-17 15:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("batteries", "0002_timeline_cursor_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BatteryLogRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "resolution",
+                    models.CharField(
+                        choices=[
+                            ("minute", "1 minute"),
+                            ("hour", "1 hour"),
+                            ("day", "1 day"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                ("bucket", models.DateTimeField(help_text="Start of the bucket (UTC)")),
+                ("count", models.IntegerField(default=0)),
+                ("charge_min", models.FloatField()),
+                ("charge_max", models.FloatField()),
+                ("charge_sum", models.FloatField(default=0)),
+                ("voltage_min", models.FloatField()),
+                ("voltage_max", models.FloatField()),
+                ("voltage_sum", models.FloatField(default=0)),
+                ("temperature_min", models.FloatField()),
+                ("temperature_max", models.FloatField()),
+                ("temperature_sum", models.FloatField(default=0)),
+                ("current_min", models.FloatField()),
+                ("current_max", models.FloatField()),
+                ("current_sum", models.FloatField(default=0)),
+                (
+                    "battery",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="rollups",
+                        to="batteries.battery",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Battery Log Rollup",
+                "verbose_name_plural": "Battery Log Rollups",
+                "ordering": ["-bucket"],
+                "indexes": [
+                    models.Index(
+                        fields=["resolution", "bucket"],
+                        name="batteries_b_resolut_fb15a5_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="batterylogrollup",
+            constraint=models.UniqueConstraint(
+                fields=("battery", "resolution", "bucket"), name="unique_rollup_bucket"
+            ),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 4.2.7 on 2026-10-17 15:58
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def merge_open_duplicates(apps, schema_editor):
+    """Backfill last_seen and fold duplicate open alerts into the newest one."""
+    BatteryAlert = apps.get_model("batteries", "BatteryAlert")
+    BatteryAlert.objects.update(last_seen=models.F("created_at"))
+
+    now = django.utils.timezone.now()
+    keep = {}
+    duplicates = []
+    open_alerts = BatteryAlert.objects.filter(is_resolved=False).order_by(
+        "-created_at", "-id"
+    )
+    for alert in open_alerts.iterator():
+        key = (alert.battery_id, alert.alert_type)
+        if key in keep:
+            keep[key].occurrence_count += 1
+            duplicates.append(alert.pk)
+        else:
+            keep[key] = alert
+
+    BatteryAlert.objects.bulk_update(
+        keep.values(), ["occurrence_count"], batch_size=500
+    )
+    for start in range(0, len(duplicates), 500):
+        BatteryAlert.objects.filter(pk__in=duplicates[start : start + 500]).update(
+            is_resolved=True, resolved_at=now
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("batteries", "0003_battery_log_rollups"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="batteryalert",
+            name="last_seen",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name="batteryalert",
+            name="occurrence_count",
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.RunPython(merge_open_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="batteryalert",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("is_resolved", False)),
+                fields=("battery", "alert_type"),
+                name="unique_open_alert",
+            ),
+        ),
+    ]
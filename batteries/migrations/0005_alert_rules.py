@@ -0,0 +1,209 @@
+# Generated by Django 4.2.7 on 2026-10-17 16:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# The thresholds that used to be hardcoded, plus the alert types they never raised.
+DEFAULT_RULES = [
+    (
+        "Low charge",
+        "LOW_CHARGE",
+        "WARNING",
+        "charge",
+        "lt",
+        10,
+        "Battery charge is critically low: {charge}%",
+    ),
+    (
+        "Overcharge",
+        "OVERCHARGE",
+        "WARNING",
+        "voltage_ratio",
+        "gt",
+        1.15,
+        "Battery voltage is above the charge limit: {voltage}V",
+    ),
+    (
+        "Over temperature",
+        "OVER_TEMPERATURE",
+        "CRITICAL",
+        "temperature",
+        "gt",
+        50,
+        "Battery temperature is too high: {temperature}°C",
+    ),
+    (
+        "Under voltage",
+        "UNDER_VOLTAGE",
+        "ERROR",
+        "voltage_ratio",
+        "lt",
+        0.8,
+        "Battery voltage is too low: {voltage}V",
+    ),
+    (
+        "Charge over current",
+        "OVER_CURRENT",
+        "ERROR",
+        "charge_current_ratio",
+        "gt",
+        1,
+        "Charge current exceeds the battery rating: {current}A",
+    ),
+    (
+        "Discharge over current",
+        "OVER_CURRENT",
+        "ERROR",
+        "discharge_current_ratio",
+        "gt",
+        1,
+        "Discharge current exceeds the battery rating: {current}A",
+    ),
+    (
+        "Health degradation",
+        "HEALTH_DEGRADATION",
+        "WARNING",
+        "health",
+        "lt",
+        20,
+        "Battery health has degraded: {health}%",
+    ),
+]
+
+
+def create_default_rules(apps, schema_editor):
+    AlertRule = apps.get_model("batteries", "AlertRule")
+    AlertRule.objects.bulk_create(
+        AlertRule(
+            name=name,
+            alert_type=alert_type,
+            alert_level=alert_level,
+            metric=metric,
+            operator=operator,
+            threshold=threshold,
+            message=message,
+        )
+        for name, alert_type, alert_level, metric, operator, threshold, message in DEFAULT_RULES
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("batteries", "0004_alert_deduplication"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AlertRule",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=100)),
+                (
+                    "alert_type",
+                    models.CharField(
+                        choices=[
+                            ("LOW_CHARGE", "Low Charge"),
+                            ("OVERCHARGE", "Overcharge"),
+                            ("OVER_TEMPERATURE", "Over Temperature"),
+                            ("UNDER_VOLTAGE", "Under Voltage"),
+                            ("OVER_CURRENT", "Over Current"),
+                            ("HEALTH_DEGRADATION", "Health Degradation"),
+                            ("FAULT", "Fault Detected"),
+                            ("COMMUNICATION_ERROR", "Communication Error"),
+                        ],
+                        max_length=30,
+                    ),
+                ),
+                (
+                    "alert_level",
+                    models.CharField(
+                        choices=[
+                            ("INFO", "Information"),
+                            ("WARNING", "Warning"),
+                            ("ERROR", "Error"),
+                            ("CRITICAL", "Critical"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                (
+                    "metric",
+                    models.CharField(
+                        choices=[
+                            ("charge", "Charge (%)"),
+                            ("voltage", "Voltage (V)"),
+                            ("voltage_ratio", "Voltage / nominal voltage"),
+                            ("temperature", "Temperature (°C)"),
+                            ("current", "Current (A)"),
+                            (
+                                "charge_current_ratio",
+                                "Charge current / max charge current",
+                            ),
+                            (
+                                "discharge_current_ratio",
+                                "Discharge current / max discharge current",
+                            ),
+                            ("health", "Health (%)"),
+                        ],
+                        max_length=30,
+                    ),
+                ),
+                (
+                    "operator",
+                    models.CharField(
+                        choices=[
+                            ("lt", "<"),
+                            ("lte", "<="),
+                            ("gt", ">"),
+                            ("gte", ">="),
+                        ],
+                        max_length=3,
+                    ),
+                ),
+                ("threshold", models.FloatField()),
+                (
+                    "message",
+                    models.CharField(
+                        help_text="Format string; may use {value}, {threshold}, {charge}, {voltage}, {temperature}, {current} and {health}",
+                        max_length=200,
+                    ),
+                ),
+                (
+                    "battery_type",
+                    models.CharField(
+                        blank=True,
+                        help_text="Blank applies to every battery type",
+                        max_length=50,
+                    ),
+                ),
+                ("is_active", models.BooleanField(default=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "device",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="alert_rules",
+                        to="batteries.batterydevice",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Alert Rule",
+                "verbose_name_plural": "Alert Rules",
+                "ordering": ["alert_type", "name"],
+            },
+        ),
+        migrations.RunPython(create_default_rules, migrations.RunPython.noop),
+    ]
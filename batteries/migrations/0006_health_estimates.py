@@ -0,0 +1,118 @@
+# Generated by Django 4.2.7 on 2026-10-17 16:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("batteries", "0005_alert_rules"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BatteryHealthEstimate",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("estimated_at", models.DateTimeField()),
+                (
+                    "window_start",
+                    models.DateTimeField(
+                        blank=True, help_text="Oldest log used", null=True
+                    ),
+                ),
+                (
+                    "window_end",
+                    models.DateTimeField(
+                        blank=True, help_text="Newest log used", null=True
+                    ),
+                ),
+                ("samples", models.IntegerField(default=0)),
+                (
+                    "equivalent_cycles",
+                    models.FloatField(
+                        default=0, help_text="Discharged Ah / rated capacity, lifetime"
+                    ),
+                ),
+                (
+                    "counted_until",
+                    models.DateTimeField(
+                        blank=True,
+                        help_text="Newest log counted into the cycles",
+                        null=True,
+                    ),
+                ),
+                (
+                    "throughput_ah",
+                    models.FloatField(
+                        default=0, help_text="Charged plus discharged Ah in the window"
+                    ),
+                ),
+                (
+                    "capacity_ah",
+                    models.FloatField(
+                        blank=True,
+                        help_text="Estimated usable capacity in Ah",
+                        null=True,
+                    ),
+                ),
+                (
+                    "health_percentage",
+                    models.FloatField(
+                        blank=True,
+                        help_text="Estimated capacity / rated capacity",
+                        null=True,
+                    ),
+                ),
+                (
+                    "fade_per_cycle",
+                    models.FloatField(
+                        blank=True,
+                        help_text="Capacity lost per cycle, % of rated",
+                        null=True,
+                    ),
+                ),
+                (
+                    "internal_resistance",
+                    models.FloatField(
+                        blank=True, help_text="dV/dI proxy in ohms", null=True
+                    ),
+                ),
+                (
+                    "remaining_cycles",
+                    models.FloatField(
+                        blank=True, help_text="Cycles until end of life", null=True
+                    ),
+                ),
+                (
+                    "remaining_days",
+                    models.FloatField(
+                        blank=True,
+                        help_text="Days until end of life at the recent usage rate",
+                        null=True,
+                    ),
+                ),
+                (
+                    "battery",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="health_estimate",
+                        to="batteries.battery",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Battery Health Estimate",
+                "verbose_name_plural": "Battery Health Estimates",
+            },
+        ),
+    ]
@@ -78,13 +78,26 @@ class BatteryAlert(models.Model):
     alert_level = models.CharField(max_length=20, choices=ALERT_LEVEL_CHOICES)
     message = models.TextField()
     is_resolved = models.BooleanField(default=False)
+    occurrence_count = models.PositiveIntegerField(default=1)
     created_at = models.DateTimeField(auto_now_add=True)
+    last_seen = models.DateTimeField(default=timezone.now)
     resolved_at = models.DateTimeField(null=True, blank=True)
     
     class Meta:
         ordering = ['-created_at']
         verbose_name = 'Battery Alert'
         verbose_name_plural = 'Battery Alerts'
+        indexes = [
+            models.Index(fields=['-created_at', '-id']),
+        ]
+        constraints = [
+            # Repeat crossings update the open alert instead of adding rows.
+            models.UniqueConstraint(
+                fields=['battery', 'alert_type'],
+                condition=models.Q(is_resolved=False),
+                name='unique_open_alert',
+            ),
+        ]
     
     def __str__(self):
         return f"{self.get_alert_type_display()} - {self.battery.serial_number}"
@@ -107,12 +120,55 @@ class BatteryLog(models.Model):
         verbose_name_plural = 'Battery Logs'
         indexes = [
             models.Index(fields=['battery', '-logged_at']),
+            models.Index(fields=['-logged_at', '-id']),
         ]
     
     def __str__(self):
         return f"{self.battery.serial_number} - {self.logged_at}"
 
 
+class BatteryLogRollup(models.Model):
+    """Per-battery aggregate of BatteryLog readings over a fixed time bucket."""
+    
+    RESOLUTION_CHOICES = [
+        ('minute', '1 minute'),
+        ('hour', '1 hour'),
+        ('day', '1 day'),
+    ]
+    
+    battery = models.ForeignKey(Battery, on_delete=models.CASCADE, related_name='rollups')
+    resolution = models.CharField(max_length=10, choices=RESOLUTION_CHOICES)
+    bucket = models.DateTimeField(help_text="Start of the bucket (UTC)")
+    count = models.IntegerField(default=0)
+    
+    charge_min = models.FloatField()
+    charge_max = models.FloatField()
+    charge_sum = models.FloatField(default=0)
+    voltage_min = models.FloatField()
+    voltage_max = models.FloatField()
+    voltage_sum = models.FloatField(default=0)
+    temperature_min = models.FloatField()
+    temperature_max = models.FloatField()
+    temperature_sum = models.FloatField(default=0)
+    current_min = models.FloatField()
+    current_max = models.FloatField()
+    current_sum = models.FloatField(default=0)
+    
+    class Meta:
+        ordering = ['-bucket']
+        verbose_name = 'Battery Log Rollup'
+        verbose_name_plural = 'Battery Log Rollups'
+        constraints = [
+            models.UniqueConstraint(fields=['battery', 'resolution', 'bucket'], name='unique_rollup_bucket'),
+        ]
+        indexes = [
+            models.Index(fields=['resolution', 'bucket']),
+        ]
+    
+    def __str__(self):
+        return f"{self.battery_id} - {self.resolution} - {self.bucket}"
+
+
 class BatteryDevice(models.Model):
     """Model representing a device containing battery(ies)."""
     
@@ -144,3 +200,85 @@ class BatteryDevice(models.Model):
     
     def __str__(self):
         return f"{self.device_name} ({self.serial_number})"
+
+
+class AlertRule(models.Model):
+    """Threshold that raises an alert when a reading crosses it."""
+    
+    METRIC_CHOICES = [
+        ('charge', 'Charge (%)'),
+        ('voltage', 'Voltage (V)'),
+        ('voltage_ratio', 'Voltage / nominal voltage'),
+        ('temperature', 'Temperature (°C)'),
+        ('current', 'Current (A)'),
+        ('charge_current_ratio', 'Charge current / max charge current'),
+        ('discharge_current_ratio', 'Discharge current / max discharge current'),
+        ('health', 'Health (%)'),
+    ]
+    
+    OPERATOR_CHOICES = [
+        ('lt', '<'),
+        ('lte', '<='),
+        ('gt', '>'),
+        ('gte', '>='),
+    ]
+    
+    name = models.CharField(max_length=100)
+    alert_type = models.CharField(max_length=30, choices=BatteryAlert.ALERT_TYPE_CHOICES)
+    alert_level = models.CharField(max_length=20, choices=BatteryAlert.ALERT_LEVEL_CHOICES)
+    metric = models.CharField(max_length=30, choices=METRIC_CHOICES)
+    operator = models.CharField(max_length=3, choices=OPERATOR_CHOICES)
+    threshold = models.FloatField()
+    message = models.CharField(
+        max_length=200,
+        help_text="Format string; may use {value}, {threshold}, {charge}, {voltage}, "
+                  "{temperature}, {current} and {health}"
+    )
+    
+    # Scope; rules for a device override rules for a battery type, which override global rules
+    battery_type = models.CharField(max_length=50, blank=True, help_text="Blank applies to every battery type")
+    device = models.ForeignKey(
+        BatteryDevice, on_delete=models.CASCADE, null=True, blank=True, related_name='alert_rules'
+    )
+    
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['alert_type', 'name']
+        verbose_name = 'Alert Rule'
+        verbose_name_plural = 'Alert Rules'
+    
+    def __str__(self):
+        return f"{self.name} ({self.metric} {self.get_operator_display()} {self.threshold})"
+
+
+class BatteryHealthEstimate(models.Model):
+    """Server-side health and remaining-useful-life estimate derived from a battery's logs."""
+    
+    battery = models.OneToOneField(Battery, on_delete=models.CASCADE, related_name='health_estimate')
+    estimated_at = models.DateTimeField()
+    window_start = models.DateTimeField(null=True, blank=True, help_text="Oldest log used")
+    window_end = models.DateTimeField(null=True, blank=True, help_text="Newest log used")
+    samples = models.IntegerField(default=0)
+    
+    # Coulomb counting; cycles keep accumulating as old logs are pruned
+    equivalent_cycles = models.FloatField(default=0, help_text="Discharged Ah / rated capacity, lifetime")
+    counted_until = models.DateTimeField(null=True, blank=True, help_text="Newest log counted into the cycles")
+    throughput_ah = models.FloatField(default=0, help_text="Charged plus discharged Ah in the window")
+    
+    capacity_ah = models.FloatField(null=True, blank=True, help_text="Estimated usable capacity in Ah")
+    health_percentage = models.FloatField(null=True, blank=True, help_text="Estimated capacity / rated capacity")
+    fade_per_cycle = models.FloatField(null=True, blank=True, help_text="Capacity lost per cycle, % of rated")
+    internal_resistance = models.FloatField(null=True, blank=True, help_text="dV/dI proxy in ohms")
+    
+    remaining_cycles = models.FloatField(null=True, blank=True, help_text="Cycles until end of life")
+    remaining_days = models.FloatField(null=True, blank=True, help_text="Days until end of life at the recent usage rate")
+    
+    class Meta:
+        verbose_name = 'Battery Health Estimate'
+        verbose_name_plural = 'Battery Health Estimates'
+    
+    def __str__(self):
+        return f"{self.battery_id} - {self.health_percentage}% @ {self.estimated_at}"
@@ -0,0 +1,24 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class TimelineCursorPagination(CursorPagination):
+    """
+    Keyset pagination for append-heavy tables.
+
+    Pages are addressed by an opaque cursor on (timestamp, id) instead of an
+    OFFSET, and no COUNT(*) is issued, so deep pages cost the same as the
+    first one.
+    """
+
+    page_size = settings.REST_FRAMEWORK.get('PAGE_SIZE', 20)
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(settings, 'BATTERY_CURSOR_MAX_PAGE_SIZE', 5000)
+
+
+class LogCursorPagination(TimelineCursorPagination):
+    ordering = ('-logged_at', '-id')
+
+
+class AlertCursorPagination(TimelineCursorPagination):
+    ordering = ('-created_at', '-id')
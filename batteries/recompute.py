@@ -0,0 +1,227 @@
+"""
+Fleet-wide recomputation sharded across worker processes.
+
+The fleet is split into shards of consecutive battery ids. Each shard is
+handed to a ProcessPoolExecutor worker, which opens its own database
+connection and walks the shard a chunk of batteries at a time, so no
+process holds more than one chunk's logs in memory. Every task writes its
+results back in bulk (bulk_update / bulk_create) through the same code the
+rest of the app uses.
+
+The parent records every finished shard in a JSON checkpoint file, so an
+interrupted run resumes where it stopped, and the file is removed once
+the whole fleet is done.
+
+Tasks import their dependencies when they run, not when this module is
+imported: with the spawn start method (Windows, macOS) workers import this
+module before Django is set up.
+"""
+import json
+import os
+import time
+from django.db import connections
+
+
+# Task name -> callable(batteries, options) returning the number of results written.
+TASKS = {
+    'health': 'batteries.recompute.recompute_health',
+    'rules': 'batteries.recompute.recompute_rules',
+    'rollups': 'batteries.recompute.recompute_rollups',
+}
+
+
+def plan_shards(battery_ids, shard_size):
+    """[first_id, last_id] ranges covering sorted battery_ids, shard_size batteries each."""
+    return [
+        [battery_ids[start], battery_ids[min(start + shard_size, len(battery_ids)) - 1]]
+        for start in range(0, len(battery_ids), shard_size)
+    ]
+
+
+class Checkpoint:
+    """Shard plan and finished shards of one run, persisted as JSON."""
+
+    def __init__(self, path, task, options):
+        self.path = path
+        self.task = task
+        self.options = options
+        self.shards = []
+        self.done = {}
+
+    @staticmethod
+    def key(shard):
+        return f'{shard[0]}-{shard[1]}'
+
+    def load(self):
+        """Resume from the file if it belongs to the same task and options; returns True if so."""
+        try:
+            with open(self.path) as handle:
+                state = json.load(handle)
+        except FileNotFoundError:
+            return False
+        if state.get('task') != self.task or state.get('options') != self.options:
+            return False
+        self.shards = state['shards']
+        self.done = state['done']
+        return True
+
+    def pending(self):
+        return [shard for shard in self.shards if self.key(shard) not in self.done]
+
+    def mark_done(self, shard, count):
+        self.done[self.key(shard)] = count
+        self.save()
+
+    def save(self):
+        # Write then rename, so a crash mid-write never leaves a truncated checkpoint.
+        temporary = f'{self.path}.tmp'
+        with open(temporary, 'w') as handle:
+            json.dump({'task': self.task, 'options': self.options, 'shards': self.shards, 'done': self.done}, handle)
+        os.replace(temporary, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def init_worker():
+    """ProcessPoolExecutor initializer; spawned workers start without Django set up."""
+    import django
+    django.setup()
+
+
+def run_shard(task, shard, options):
+    """Run task over the batteries of one shard, chunk by chunk. Returns (shard, batteries, results)."""
+    from django.utils.module_loading import import_string
+    from .models import Battery
+
+    func = import_string(TASKS[task])
+    first_id, last_id = shard
+    battery_ids = list(
+        Battery.objects.filter(id__gte=first_id, id__lte=last_id).order_by('id').values_list('id', flat=True)
+    )
+    chunk_size = options['chunk_size']
+    results = 0
+    try:
+        for start in range(0, len(battery_ids), chunk_size):
+            batteries = list(Battery.objects.filter(id__in=battery_ids[start:start + chunk_size]).order_by('id'))
+            results += func(batteries, options)
+    finally:
+        connections.close_all()
+    return shard, len(battery_ids), results
+
+
+def recompute_health(batteries, options):
+    """Re-estimate health and RUL and write health_percentage and cycle_count back."""
+    from .health import refresh_health
+
+    estimates = refresh_health(batteries, apply=True, window_days=options.get('window_days'))
+    return len(estimates)
+
+
+def recompute_rules(batteries, options):
+    """
+    Re-evaluate the active alert rules against each battery's latest logged reading.
+
+    Older readings describe conditions that are over, so replaying them
+    would reopen or escalate live alerts. An alert whose last_seen is at
+    or after that reading has already counted it (the live pipeline, or an
+    earlier or interrupted run), so it is skipped, and re-running a shard
+    changes nothing.
+    """
+    from django.db.models import Max, OuterRef, Subquery
+    from .alerts import record_alerts
+    from .broadcast import broadcast_buffer
+    from .filters import parse_timestamp
+    from .models import Battery, BatteryAlert, BatteryLog
+    from .rules import evaluate_readings
+    from .snapshot import mark_dashboard_dirty
+
+    by_id = {battery.id: battery for battery in batteries}
+    latest = BatteryLog.objects.filter(battery_id=OuterRef('pk')).order_by('-logged_at', '-id').values('id')[:1]
+    latest_ids = Battery.objects.filter(id__in=list(by_id)).annotate(latest_log=Subquery(latest))
+    logs = BatteryLog.objects.filter(id__in=latest_ids.values('latest_log'))
+    if options.get('since'):
+        logs = logs.filter(logged_at__gte=parse_timestamp(options['since']))
+    logs = list(logs.values_list(
+        'battery_id', 'logged_at', 'charge_percentage', 'voltage', 'temperature', 'current', 'status'
+    ))
+    if not logs:
+        return 0
+
+    logged_at = {row[0]: row[1] for row in logs}
+    seen = {
+        (row['battery_id'], row['alert_type']): row['last_seen']
+        for row in BatteryAlert.objects.filter(battery_id__in=list(logged_at))
+        .values('battery_id', 'alert_type').annotate(last_seen=Max('last_seen'))
+    }
+
+    def unseen(alert):
+        last_seen = seen.get((alert['battery_id'], alert['alert_type']))
+        return last_seen is None or last_seen < logged_at[alert['battery_id']]
+
+    readings = [_reading_from_log(by_id[row[0]], *row[2:]) for row in logs]
+    alerts = [alert for alert in evaluate_readings(readings) if unseen(alert)]
+    created, changed = record_alerts(alerts)
+    if alerts:
+        # Do what AlertPipeline.process() does for live readings.
+        mark_dashboard_dirty()
+        broadcast_buffer.add(alert_ids=[alert.pk for alert in created + changed if alert.pk is not None])
+        # This may be a worker process that exits before a delayed flush would run.
+        broadcast_buffer.flush()
+    return len(alerts)
+
+
+def _reading_from_log(battery, charge, voltage, temperature, current, status):
+    from .rules import Reading
+
+    return Reading(
+        battery_id=battery.id,
+        battery_type=battery.battery_type,
+        current_charge=charge,
+        current_voltage=voltage,
+        current_temperature=temperature,
+        current=current,
+        current_status=status,
+        voltage_nominal=battery.voltage_nominal,
+        health_percentage=battery.health_percentage,
+        max_charge_current=battery.max_charge_current,
+        max_discharge_current=battery.max_discharge_current,
+        enqueued_at=time.time(),
+    )
+
+
+def recompute_rollups(batteries, options):
+    """
+    Rebuild every rollup resolution from raw logs, one UTC day at a time.
+
+    Days before the first complete raw day keep their rollups and only
+    get missing buckets filled in.
+    """
+    from datetime import timedelta
+    from django.db.models import Max, Min
+    from .filters import parse_timestamp
+    from .models import BatteryLog
+    from .retention import first_complete_raw_day
+    from .rollups import ROLLUP_RESOLUTIONS, bucket_start, rebuild_rollups
+
+    logs = BatteryLog.objects.filter(battery_id__in=[battery.id for battery in batteries])
+    if options.get('since'):
+        # Whole days, so every bucket is rebuilt from all of its logs.
+        logs = logs.filter(logged_at__gte=bucket_start(parse_timestamp(options['since']), 'day'))
+    bounds = logs.aggregate(oldest=Min('logged_at'), newest=Max('logged_at'))
+    if bounds['oldest'] is None:
+        return 0
+
+    total = 0
+    complete_from = first_complete_raw_day()
+    day = bucket_start(bounds['oldest'], 'day')
+    while day <= bounds['newest']:
+        next_day = day + timedelta(days=1)
+        replace = complete_from is None or day >= complete_from
+        for resolution in ROLLUP_RESOLUTIONS:
+            total += rebuild_rollups(
+                logs.filter(logged_at__gte=day, logged_at__lt=next_day), resolution, replace=replace
+            )
+        day = next_day
+    return total
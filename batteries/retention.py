@@ -0,0 +1,115 @@
+"""
+Retention for BatteryLog and its rollups.
+
+Rows older than the configured age are deleted in bounded batches, each in
+its own short transaction, so pruning never holds long locks on the
+fastest-growing tables. Cutoffs are floored to a UTC day, so a rollup
+bucket is either older than the cutoff or still has all of its raw logs;
+only the rollups of days before first_complete_raw_day() are unsafe to
+rebuild from raw logs. Once raw logs age out, history is still available
+from the coarser rollups.
+"""
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from .models import BatteryLog, BatteryLogRollup
+from .rollups import bucket_start
+
+
+# Days to keep each tier; None keeps it forever.
+DEFAULT_RETENTION = {
+    'raw': 7,
+    'minute': 30,
+    'hour': 365,
+    'day': None,
+}
+
+RETENTION = {**DEFAULT_RETENTION, **getattr(settings, 'BATTERY_LOG_RETENTION', {})}
+RETENTION_BATCH_SIZE = getattr(settings, 'BATTERY_RETENTION_BATCH_SIZE', 5000)
+
+# Rough on-disk size per row (data plus index entries) used when the database
+# cannot report table sizes.
+FALLBACK_ROW_BYTES = {
+    BatteryLog: 120,
+    BatteryLogRollup: 180,
+}
+
+
+def tier_querysets(now=None):
+    """Yield (tier, queryset of expired rows) for every tier with a retention limit."""
+    now = now or timezone.now()
+    for tier, days in RETENTION.items():
+        if days is None:
+            continue
+        cutoff = bucket_start(now - timedelta(days=days), 'day')
+        if tier == 'raw':
+            yield tier, BatteryLog.objects.filter(logged_at__lt=cutoff)
+        else:
+            yield tier, BatteryLogRollup.objects.filter(resolution=tier, bucket__lt=cutoff)
+
+
+def first_complete_raw_day(now=None):
+    """
+    Start of the oldest UTC day whose raw logs are known to be complete, or
+    None while raw logs are kept forever.
+
+    The day at the cutoff itself is skipped too: pruning that ran before
+    cutoffs were day-aligned may have cut it in half.
+    """
+    days = RETENTION['raw']
+    if days is None:
+        return None
+    now = now or timezone.now()
+    return bucket_start(now - timedelta(days=days), 'day') + timedelta(days=1)
+
+
+def estimate_row_bytes(model):
+    """Average bytes per row including indexes, from the database when it can tell us."""
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT pg_total_relation_size(%s), GREATEST(reltuples, 1) FROM pg_class WHERE oid = %s::regclass',
+                [model._meta.db_table, model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        if row and row[0]:
+            return int(row[0] / row[1])
+    return FALLBACK_ROW_BYTES[model]
+
+
+def delete_in_batches(queryset, batch_size=RETENTION_BATCH_SIZE, pause=0, progress=None):
+    """
+    Delete every row in queryset, batch_size rows per transaction.
+
+    Returns the number of rows deleted. `pause` seconds are slept between
+    batches to give other writers room; `progress` is called with the
+    running total after each batch.
+    """
+    model = queryset.model
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            ids = list(queryset.order_by().values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            count, _ = model.objects.filter(id__in=ids).delete()
+        deleted += count
+        if progress:
+            progress(deleted)
+        if len(ids) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+    return deleted
+
+
+def vacuum():
+    """Return freed pages to the OS (SQLite) or mark them reusable and refresh stats (PostgreSQL)."""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            for model in (BatteryLog, BatteryLogRollup):
+                cursor.execute(f'VACUUM ANALYZE {connection.ops.quote_name(model._meta.db_table)}')
+        elif connection.vendor == 'sqlite':
+            cursor.execute('VACUUM')
@@ -0,0 +1,223 @@
+"""
+Incremental rollups of BatteryLog.
+
+Every reading is folded into per-battery minute, hour and day buckets as it
+is logged, so questions over long spans read a few hundred rollup rows
+instead of scanning raw logs. `manage.py backfill_rollups` rebuilds them
+from raw history.
+"""
+from datetime import timezone as dt_timezone
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Max, Min, Sum
+from django.db.models.functions import Trunc
+from .locking import serialized_writes
+from .models import BatteryLogRollup
+
+
+ROLLUP_RESOLUTIONS = [choice for choice, _ in BatteryLogRollup.RESOLUTION_CHOICES]
+
+# Log field feeding each rollup metric
+ROLLUP_METRICS = {
+    'charge': 'charge_percentage',
+    'voltage': 'voltage',
+    'temperature': 'temperature',
+    'current': 'current',
+}
+
+# Coarsest rollup that still divides each Trunc unit; None means raw logs are needed.
+ROLLUP_FOR_UNIT = {
+    'second': None,
+    'minute': 'minute',
+    'hour': 'hour',
+    'day': 'day',
+    'week': 'day',
+    'month': 'day',
+}
+
+MAX_RETRIES = 3
+
+
+def bucket_start(value, resolution):
+    """Floor an aware datetime to the start of its UTC bucket."""
+    value = value.astimezone(dt_timezone.utc).replace(second=0, microsecond=0)
+    if resolution in ('hour', 'day'):
+        value = value.replace(minute=0)
+    if resolution == 'day':
+        value = value.replace(hour=0)
+    return value
+
+
+def _empty_delta():
+    delta = {'count': 0}
+    for metric in ROLLUP_METRICS:
+        delta[f'{metric}_min'] = None
+        delta[f'{metric}_max'] = None
+        delta[f'{metric}_sum'] = 0.0
+    return delta
+
+
+def _merge(delta, values):
+    """Fold one reading (or another delta) into delta."""
+    delta['count'] += values['count']
+    for metric in ROLLUP_METRICS:
+        low, high = values[f'{metric}_min'], values[f'{metric}_max']
+        if delta[f'{metric}_min'] is None or low < delta[f'{metric}_min']:
+            delta[f'{metric}_min'] = low
+        if delta[f'{metric}_max'] is None or high > delta[f'{metric}_max']:
+            delta[f'{metric}_max'] = high
+        delta[f'{metric}_sum'] += values[f'{metric}_sum']
+
+
+def compute_deltas(logs):
+    """Group logs into {(battery_id, resolution, bucket): delta}."""
+    deltas = {}
+    for log in logs:
+        reading = {'count': 1}
+        for metric, field in ROLLUP_METRICS.items():
+            value = float(getattr(log, field))
+            reading[f'{metric}_min'] = reading[f'{metric}_max'] = reading[f'{metric}_sum'] = value
+        for resolution in ROLLUP_RESOLUTIONS:
+            key = (log.battery_id, resolution, bucket_start(log.logged_at, resolution))
+            if key not in deltas:
+                deltas[key] = _empty_delta()
+            _merge(deltas[key], reading)
+    return deltas
+
+
+def _apply_deltas(deltas):
+    battery_ids = {key[0] for key in deltas}
+    buckets = {key[2] for key in deltas}
+    existing = {
+        (row.battery_id, row.resolution, row.bucket): row
+        for row in BatteryLogRollup.objects.select_for_update().filter(
+            battery_id__in=battery_ids, bucket__in=buckets
+        )
+    }
+
+    to_update = []
+    to_create = []
+    for key, delta in deltas.items():
+        row = existing.get(key)
+        if row is None:
+            battery_id, resolution, bucket = key
+            to_create.append(BatteryLogRollup(battery_id=battery_id, resolution=resolution, bucket=bucket, **delta))
+            continue
+        current = {field: getattr(row, field) for field in delta}
+        _merge(current, delta)
+        for field, value in current.items():
+            setattr(row, field, value)
+        to_update.append(row)
+
+    if to_update:
+        BatteryLogRollup.objects.bulk_update(to_update, list(_empty_delta()), batch_size=500)
+    BatteryLogRollup.objects.bulk_create(to_create, batch_size=500)
+
+
+def record_logs(logs):
+    """Fold newly created logs into their minute, hour and day rollups."""
+    deltas = compute_deltas(logs)
+    if not deltas:
+        return
+    for attempt in range(MAX_RETRIES):
+        try:
+            with serialized_writes(), transaction.atomic():
+                _apply_deltas(deltas)
+            return
+        except IntegrityError:
+            # A concurrent writer created one of our buckets first; retry as an update.
+            if attempt == MAX_RETRIES - 1:
+                raise
+
+
+def rebuild_rollups(logs, resolution, replace=True):
+    """
+    Recompute rollups of one resolution from a BatteryLog queryset.
+
+    Existing rows for the same batteries and buckets are replaced, so the
+    queryset should cover whole buckets. With replace=False existing rows
+    are kept and only missing buckets are created, which is what days whose
+    raw logs were partly pruned need.
+    """
+    aggregates = {'count': Count('id')}
+    for metric, field in ROLLUP_METRICS.items():
+        aggregates[f'{metric}_min'] = Min(field)
+        aggregates[f'{metric}_max'] = Max(field)
+        aggregates[f'{metric}_sum'] = Sum(field)
+
+    rows = (
+        logs.annotate(rollup_bucket=Trunc('logged_at', resolution, tzinfo=dt_timezone.utc))
+        .values('battery_id', 'rollup_bucket')
+        .annotate(**aggregates)
+        .order_by()
+    )
+    rollups = [
+        BatteryLogRollup(
+            battery_id=row.pop('battery_id'), resolution=resolution, bucket=row.pop('rollup_bucket'), **row
+        )
+        for row in rows
+    ]
+
+    if not replace:
+        BatteryLogRollup.objects.bulk_create(rollups, batch_size=1000, ignore_conflicts=True)
+        return len(rollups)
+
+    with transaction.atomic():
+        BatteryLogRollup.objects.filter(
+            resolution=resolution,
+            battery_id__in={rollup.battery_id for rollup in rollups},
+            bucket__in={rollup.bucket for rollup in rollups},
+        ).delete()
+        BatteryLogRollup.objects.bulk_create(rollups, batch_size=1000)
+    return len(rollups)
+
+
+def bucket_rollups(since, until, unit, battery_id=None):
+    """
+    Min/avg/max per Trunc(unit) bucket, read from the coarsest rollup that serves it.
+
+    Returns rows shaped like trends.bucket_logs().
+    """
+    resolution = ROLLUP_FOR_UNIT[unit]
+    rollups = BatteryLogRollup.objects.filter(
+        resolution=resolution,
+        bucket__gte=bucket_start(since, resolution),
+        bucket__lte=until,
+    )
+    if battery_id is not None:
+        rollups = rollups.filter(battery_id=battery_id)
+
+    aggregates = {'count': Sum('count')}
+    for metric in ROLLUP_METRICS:
+        aggregates[f'{metric}_min'] = Min(f'{metric}_min')
+        aggregates[f'{metric}_max'] = Max(f'{metric}_max')
+        aggregates[f'{metric}_sum'] = Sum(f'{metric}_sum')
+
+    rows = list(
+        rollups.annotate(trend_bucket=Trunc('bucket', unit))
+        .values('trend_bucket')
+        .annotate(**aggregates)
+        .order_by('trend_bucket')
+    )
+    for row in rows:
+        row['bucket'] = row.pop('trend_bucket')
+        for metric in ROLLUP_METRICS:
+            row[f'{metric}_avg'] = row.pop(f'{metric}_sum') / row['count']
+    return rows
+
+
+def rollup_history(battery_id, since, resolution='day'):
+    """Per-bucket summary rows for one battery, oldest first."""
+    rows = BatteryLogRollup.objects.filter(
+        battery_id=battery_id, resolution=resolution, bucket__gte=bucket_start(since, resolution)
+    ).order_by('bucket')
+
+    history = []
+    for row in rows:
+        entry = {'bucket': row.bucket.isoformat(), 'count': row.count}
+        for metric in ROLLUP_METRICS:
+            entry[f'{metric}_min'] = getattr(row, f'{metric}_min')
+            entry[f'{metric}_avg'] = getattr(row, f'{metric}_sum') / row.count
+            entry[f'{metric}_max'] = getattr(row, f'{metric}_max')
+        entry['current_sum'] = row.current_sum
+        history.append(entry)
+    return history
@@ -0,0 +1,210 @@
+"""
+Data-driven alert rules, compiled into a vectorized evaluator.
+
+Active AlertRule rows are compiled once into NumPy arrays (metric column,
+operator, threshold and scope per rule). A batch of readings becomes an
+(n readings x metrics) matrix, and every rule is checked against every
+reading with a handful of array comparisons, so evaluating a 10k-reading
+ingest batch costs milliseconds instead of a Python loop per battery.
+
+When several rules of the same alert type apply to a battery, only the
+most specific scope counts: device rules override battery type rules,
+which override global rules. The compiled engine is cached per process
+and rebuilt when a rule changes, or after BATTERY_ALERT_RULES_TTL seconds
+so edits made by other processes are picked up.
+"""
+import operator
+import threading
+import time
+from collections import namedtuple
+import numpy as np
+from django.conf import settings
+from .models import AlertRule, BatteryAlert
+from .topics import device_map
+
+
+ALERT_RULES_TTL = getattr(settings, 'BATTERY_ALERT_RULES_TTL', 60)
+
+# The battery fields alert rules look at, captured when the reading is taken.
+Reading = namedtuple('Reading', [
+    'battery_id', 'battery_type', 'current_charge', 'current_voltage', 'current_temperature',
+    'current', 'current_status', 'voltage_nominal', 'health_percentage',
+    'max_charge_current', 'max_discharge_current', 'enqueued_at',
+])
+
+# Column order of the metric matrix; must cover AlertRule.METRIC_CHOICES.
+METRICS = [metric for metric, _ in AlertRule.METRIC_CHOICES]
+
+OPERATORS = {
+    'lt': operator.lt,
+    'lte': operator.le,
+    'gt': operator.gt,
+    'gte': operator.ge,
+}
+
+# Rules are ordered by level so the most severe alert of a type comes last and wins.
+LEVEL_ORDER = {level: index for index, (level, _) in enumerate(BatteryAlert.ALERT_LEVEL_CHOICES)}
+
+
+def reading_from_battery(battery, current=0.0):
+    return Reading(
+        battery_id=battery.id,
+        battery_type=battery.battery_type,
+        current_charge=float(battery.current_charge),
+        current_voltage=float(battery.current_voltage),
+        current_temperature=float(battery.current_temperature),
+        current=float(current or 0),
+        current_status=battery.current_status,
+        voltage_nominal=float(battery.voltage_nominal),
+        health_percentage=float(battery.health_percentage),
+        max_charge_current=float(battery.max_charge_current),
+        max_discharge_current=float(battery.max_discharge_current),
+        enqueued_at=time.time(),
+    )
+
+
+def _ratio(numerator, denominator):
+    # Batteries without a rating get NaN, which never crosses a threshold.
+    out = np.full_like(numerator, np.nan)
+    np.divide(numerator, denominator, out=out, where=denominator > 0)
+    return out
+
+
+def metric_matrix(readings):
+    """(len(readings) x len(METRICS)) float array of rule inputs."""
+    raw = np.array([
+        (r.current_charge, r.current_voltage, r.current_temperature, r.current,
+         r.voltage_nominal, r.health_percentage, r.max_charge_current, r.max_discharge_current)
+        for r in readings
+    ], dtype=float).reshape(-1, 8)
+    charge, voltage, temperature, current, nominal, health, max_charge, max_discharge = raw.T
+    columns = {
+        'charge': charge,
+        'voltage': voltage,
+        'voltage_ratio': _ratio(voltage, nominal),
+        'temperature': temperature,
+        'current': current,
+        'charge_current_ratio': _ratio(np.maximum(current, 0), max_charge),
+        'discharge_current_ratio': _ratio(np.maximum(-current, 0), max_discharge),
+        'health': health,
+    }
+    return np.column_stack([columns[metric] for metric in METRICS])
+
+
+class RuleEngine:
+    """A set of AlertRule rows compiled to arrays for batch evaluation."""
+
+    def __init__(self, rules):
+        self.rules = sorted(rules, key=lambda rule: (LEVEL_ORDER.get(rule.alert_level, 0), rule.pk or 0))
+        self.metric = np.array([METRICS.index(rule.metric) for rule in self.rules], dtype=int)
+        self.threshold = np.array([rule.threshold for rule in self.rules], dtype=float)
+        self.operator_columns = {
+            op: np.array([rule.operator == op for rule in self.rules], dtype=bool) for op in OPERATORS
+        }
+        self.type_columns = self._columns(lambda rule: rule.battery_type or None)
+        self.device_columns = self._columns(lambda rule: rule.device_id)
+        self.alert_type_columns = self._columns(lambda rule: rule.alert_type)
+        self.specificity = np.array(
+            [(2 if rule.device_id else 0) + (1 if rule.battery_type else 0) for rule in self.rules], dtype=int
+        )
+        self.compiled_at = time.monotonic()
+
+    def _columns(self, key):
+        columns = {}
+        for index, rule in enumerate(self.rules):
+            value = key(rule)
+            if value is not None:
+                columns.setdefault(value, []).append(index)
+        return {value: np.array(indexes, dtype=int) for value, indexes in columns.items()}
+
+    def scope(self, readings):
+        """(readings x rules) mask of which rules apply to which reading."""
+        applies = np.ones((len(readings), len(self.rules)), dtype=bool)
+        if self.type_columns:
+            battery_types = np.array([r.battery_type for r in readings], dtype=object)
+            for battery_type, columns in self.type_columns.items():
+                applies[:, columns] &= (battery_types == battery_type)[:, None]
+        if self.device_columns:
+            battery_ids = np.array([r.battery_id for r in readings], dtype=np.int64)
+            members = {}
+            for battery_id, device_ids in device_map(set(battery_ids.tolist())).items():
+                for device_id in device_ids:
+                    members.setdefault(device_id, []).append(battery_id)
+            for device_id, columns in self.device_columns.items():
+                applies[:, columns] &= np.isin(battery_ids, members.get(device_id, []))[:, None]
+
+        # Keep only the most specific applicable rules of each alert type.
+        specificity = np.where(applies, self.specificity, -1)
+        for columns in self.alert_type_columns.values():
+            best = specificity[:, columns].max(axis=1, keepdims=True)
+            applies[:, columns] &= specificity[:, columns] == best
+        return applies
+
+    def evaluate(self, readings):
+        """
+        Alerts raised by a batch of readings, as dicts with battery_id,
+        alert_type, alert_level and message, in reading order.
+        """
+        if not readings or not self.rules:
+            return []
+        metrics = metric_matrix(readings)
+        values = metrics[:, self.metric]
+
+        crossed = np.zeros(values.shape, dtype=bool)
+        with np.errstate(invalid='ignore'):
+            for op, columns in self.operator_columns.items():
+                if columns.any():
+                    crossed[:, columns] = OPERATORS[op](values[:, columns], self.threshold[columns])
+        crossed &= self.scope(readings)
+
+        alerts = []
+        for row, column in zip(*np.nonzero(crossed)):
+            reading, rule = readings[row], self.rules[column]
+            alerts.append({
+                'battery_id': reading.battery_id,
+                'alert_type': rule.alert_type,
+                'alert_level': rule.alert_level,
+                'message': _format_message(rule, reading, values[row, column]),
+            })
+        return alerts
+
+
+def _format_message(rule, reading, value):
+    try:
+        return rule.message.format(
+            value=round(float(value), 2),
+            threshold=rule.threshold,
+            charge=reading.current_charge,
+            voltage=reading.current_voltage,
+            temperature=reading.current_temperature,
+            current=reading.current,
+            health=reading.health_percentage,
+        )
+    except (KeyError, IndexError, ValueError, AttributeError, TypeError):
+        # Rules saved without validation (e.g. through the admin) must not break evaluation.
+        return rule.message
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_rule_engine():
+    """The compiled engine for the active rules, rebuilt when stale."""
+    global _engine
+    engine = _engine
+    if engine is None or time.monotonic() - engine.compiled_at > ALERT_RULES_TTL:
+        with _engine_lock:
+            if _engine is engine:
+                _engine = RuleEngine(AlertRule.objects.filter(is_active=True))
+            engine = _engine
+    return engine
+
+
+def invalidate_rules():
+    global _engine
+    _engine = None
+
+
+def evaluate_readings(readings):
+    return get_rule_engine().evaluate(readings)
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Battery, BatteryAlert, BatteryLog, BatteryDevice
+from .models import AlertRule, Battery, BatteryAlert, BatteryHealthEstimate, BatteryLog, BatteryDevice
 
 
 class BatterySerializer(serializers.ModelSerializer):
@@ -25,9 +25,25 @@ class BatteryAlertSerializer(serializers.ModelSerializer):
         model = BatteryAlert
         fields = [
             'id', 'battery', 'battery_serial', 'alert_type', 'alert_level',
-            'message', 'is_resolved', 'created_at', 'resolved_at'
+            'message', 'is_resolved', 'occurrence_count', 'created_at', 'last_seen', 'resolved_at'
         ]
-        read_only_fields = ['id', 'created_at', 'resolved_at']
+        read_only_fields = ['id', 'occurrence_count', 'created_at', 'last_seen', 'resolved_at']
+    
+    def validate(self, attrs):
+        # A battery has at most one open alert per type (see BatteryAlert.Meta.constraints).
+        battery = attrs.get('battery', getattr(self.instance, 'battery', None))
+        alert_type = attrs.get('alert_type', getattr(self.instance, 'alert_type', None))
+        is_resolved = attrs.get('is_resolved', getattr(self.instance, 'is_resolved', False))
+        if battery is not None and not is_resolved:
+            open_alerts = BatteryAlert.objects.filter(battery=battery, alert_type=alert_type, is_resolved=False)
+            if self.instance is not None:
+                open_alerts = open_alerts.exclude(pk=self.instance.pk)
+            existing = open_alerts.values_list('id', flat=True).first()
+            if existing is not None:
+                raise serializers.ValidationError(
+                    f'Battery {battery.pk} already has an open {alert_type} alert (id {existing}).'
+                )
+        return attrs
 
 
 class BatteryLogSerializer(serializers.ModelSerializer):
@@ -44,6 +60,19 @@ class BatteryLogSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'logged_at']
 
 
+class BatteryHealthEstimateSerializer(serializers.ModelSerializer):
+    """Serializer for BatteryHealthEstimate model."""
+    
+    class Meta:
+        model = BatteryHealthEstimate
+        fields = [
+            'battery', 'estimated_at', 'window_start', 'window_end', 'samples',
+            'equivalent_cycles', 'counted_until', 'throughput_ah', 'capacity_ah', 'health_percentage',
+            'fade_per_cycle', 'internal_resistance', 'remaining_cycles', 'remaining_days'
+        ]
+        read_only_fields = fields
+
+
 class BatteryDeviceSerializer(serializers.ModelSerializer):
     """Serializer for BatteryDevice model."""
     
@@ -56,3 +85,22 @@ class BatteryDeviceSerializer(serializers.ModelSerializer):
             'batteries', 'batteries_detail', 'is_active', 'created_at', 'last_checked'
         ]
         read_only_fields = ['id', 'created_at']
+
+
+class AlertRuleSerializer(serializers.ModelSerializer):
+    """Serializer for AlertRule model."""
+    
+    class Meta:
+        model = AlertRule
+        fields = [
+            'id', 'name', 'alert_type', 'alert_level', 'metric', 'operator', 'threshold',
+            'message', 'battery_type', 'device', 'is_active', 'created_at', 'updated_at'
+        ]
+        read_only_fields = ['id', 'created_at', 'updated_at']
+    
+    def validate_message(self, value):
+        try:
+            value.format(value=0, threshold=0, charge=0, voltage=0, temperature=0, current=0, health=0)
+        except (KeyError, IndexError, ValueError, AttributeError, TypeError) as exc:
+            raise serializers.ValidationError(f'Invalid message template: {exc}')
+        return value
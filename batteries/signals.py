@@ -1,28 +1,69 @@
-from django.db.models.signals import post_save
+from django.core.signals import request_started
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
-from .models import Battery, BatteryAlert
-from .serializers import BatterySerializer, BatteryAlertSerializer
-
-
-def broadcast_to_dashboard(payload: dict):
-    layer = get_channel_layer()
-    async_to_sync(layer.group_send)('dashboard', {
-        'type': 'dashboard.update',
-        'data': payload,
-    })
+from .anomaly import anomaly_detector
+from .broadcast import broadcast_buffer
+from .fleet_state import battery_entry, fleet_state
+from .models import AlertRule, Battery, BatteryAlert, BatteryDevice
+from .rules import invalidate_rules
+from .snapshot import mark_dashboard_dirty
+from .watchdog import watchdog
 
 
 @receiver(post_save, sender=Battery)
 def battery_saved(sender, instance: Battery, created, **kwargs):
-    data = BatterySerializer(instance).data
-    payload = {'type': 'battery_update', 'battery': data, 'created': created}
-    broadcast_to_dashboard(payload)
+    mark_dashboard_dirty()
+    entry = battery_entry(instance)
+    transaction.on_commit(lambda: fleet_state.update_battery_entries([(instance.pk, entry)]))
+    transaction.on_commit(lambda: broadcast_buffer.add(battery_ids=[instance.pk]))
+    transaction.on_commit(lambda: watchdog.seen([instance.pk]))
 
 
 @receiver(post_save, sender=BatteryAlert)
 def alert_saved(sender, instance: BatteryAlert, created, **kwargs):
-    data = BatteryAlertSerializer(instance).data
-    payload = {'type': 'alert_update', 'alert': data, 'created': created}
-    broadcast_to_dashboard(payload)
+    mark_dashboard_dirty()
+    transaction.on_commit(lambda: fleet_state.update_alerts([instance], created=created))
+    transaction.on_commit(lambda: broadcast_buffer.add(alert_ids=[instance.pk]))
+
+
+@receiver(post_delete, sender=Battery)
+def battery_deleted(sender, instance: Battery, **kwargs):
+    mark_dashboard_dirty()
+    watchdog.forget([instance.pk])
+    anomaly_detector.forget([instance.pk])
+    # The instance loses its pk once the delete finishes, so capture it now.
+    battery_id = instance.pk
+    transaction.on_commit(lambda: fleet_state.remove_batteries([battery_id]))
+
+
+@receiver(post_delete, sender=BatteryAlert)
+def alert_deleted(sender, instance: BatteryAlert, **kwargs):
+    mark_dashboard_dirty()
+    alert_id = instance.pk
+    transaction.on_commit(lambda: fleet_state.remove_alerts([alert_id]))
+
+
+@receiver(post_save, sender=BatteryDevice)
+def device_saved(sender, instance: BatteryDevice, **kwargs):
+    mark_dashboard_dirty()
+    transaction.on_commit(lambda: fleet_state.update_devices([instance]))
+
+
+@receiver(post_delete, sender=BatteryDevice)
+def device_deleted(sender, instance: BatteryDevice, **kwargs):
+    mark_dashboard_dirty()
+    device_id = instance.pk
+    transaction.on_commit(lambda: fleet_state.remove_devices([device_id]))
+
+
+@receiver(post_save, sender=AlertRule)
+@receiver(post_delete, sender=AlertRule)
+def alert_rules_changed(sender, **kwargs):
+    invalidate_rules()
+
+
+@receiver(request_started)
+def start_watchdog(sender, **kwargs):
+    # Start watching on first use, even if no battery has reported since the restart.
+    watchdog.start()
@@ -0,0 +1,151 @@
+"""
+Cached dashboard snapshot.
+
+The dashboard polls stats, chart data, battery details and the alert
+summary on a timer from every open tab. Each of the four sections lives
+under its own key in a Django cache backend and is shared by every
+request, so the small endpoints never unpickle the per-battery list.
+Saves mark the snapshot dirty; a section is rebuilt on its next read, at
+most once per BATTERY_SNAPSHOT_MIN_AGE seconds, and never served older
+than BATTERY_SNAPSHOT_MAX_STALENESS seconds (which also catches writes
+that bypass signals, such as queryset updates).
+"""
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Count, Q
+from .aggregates import battery_aggregates, battery_type_counts, alert_aggregates, device_aggregates
+from .models import Battery, BatteryAlert
+
+
+SNAPSHOT_CACHE = getattr(settings, 'BATTERY_SNAPSHOT_CACHE', 'default')
+SNAPSHOT_MIN_AGE = getattr(settings, 'BATTERY_SNAPSHOT_MIN_AGE', 2)
+SNAPSHOT_MAX_STALENESS = getattr(settings, 'BATTERY_SNAPSHOT_MAX_STALENESS', 30)
+
+SECTION_KEY = 'batteries:dashboard:section:{}'
+CHANGED_KEY = 'batteries:dashboard:changed_at'
+REBUILD_LOCK_KEY = 'batteries:dashboard:rebuild:{}'
+
+BATTERY_DETAIL_FIELDS = [
+    'id', 'serial_number', 'battery_type', 'current_charge',
+    'current_voltage', 'current_temperature', 'current_status',
+    'health_percentage', 'cycle_count'
+]
+
+
+def build_stats(battery_stats, alert_stats, device_stats):
+    return {
+        'batteries': {
+            'total': battery_stats['total'],
+            'active': battery_stats['active'],
+            'faulty': battery_stats['faulty'],
+        },
+        'health': {
+            'average': round(battery_stats['avg_health'], 2),
+            'low_count': battery_stats['low_health'],
+        },
+        'charge': {
+            'average': round(battery_stats['avg_charge'], 2),
+        },
+        'temperature': {
+            'average': round(battery_stats['avg_temperature'], 2),
+        },
+        'alerts': {
+            'total': alert_stats['total'],
+            'unresolved': alert_stats['unresolved'],
+            'critical': alert_stats['critical'],
+        },
+        'devices': {
+            'total': device_stats['total'],
+            'active': device_stats['active'],
+        }
+    }
+
+
+def build_chart_data(battery_stats, type_counts):
+    return {
+        'status': battery_stats['status'],
+        'health_ranges': battery_stats['health'],
+        'charge_ranges': battery_stats['charge'],
+        'types': type_counts,
+        'cycle_ranges': battery_stats['cycles'],
+    }
+
+
+def build_battery_details():
+    return {
+        'batteries': list(Battery.objects.all().values(*BATTERY_DETAIL_FIELDS))
+    }
+
+
+def build_alert_summary():
+    # Alert types breakdown
+    alert_types = BatteryAlert.objects.values('alert_type').annotate(count=Count('id'))
+
+    # Alert levels breakdown
+    alert_levels = BatteryAlert.objects.values('alert_level').annotate(
+        count=Count('id'),
+        unresolved=Count('id', filter=Q(is_resolved=False))
+    )
+
+    # Recent unresolved alerts
+    recent_alerts = BatteryAlert.objects.filter(is_resolved=False).select_related('battery').values(
+        'id', 'battery__serial_number', 'alert_type', 'alert_level', 'message', 'occurrence_count',
+        'created_at', 'last_seen'
+    ).order_by('-last_seen')[:10]
+
+    return {
+        'alert_types': list(alert_types),
+        'alert_levels': list(alert_levels),
+        'recent_unresolved': list(recent_alerts),
+    }
+
+
+SECTION_BUILDERS = {
+    'stats': lambda: build_stats(battery_aggregates(), alert_aggregates(), device_aggregates()),
+    'charts': lambda: build_chart_data(battery_aggregates(), battery_type_counts()),
+    'batteries': build_battery_details,
+    'alerts': build_alert_summary,
+}
+
+
+def mark_dashboard_dirty():
+    """Record that dashboard data changed; the next read rebuilds the snapshot."""
+    caches[SNAPSHOT_CACHE].set(CHANGED_KEY, time.time(), None)
+
+
+def _needs_rebuild(entry, changed_at, now):
+    age = now - entry['built_at']
+    if age >= SNAPSHOT_MAX_STALENESS:
+        return True
+    return changed_at is not None and changed_at > entry['built_at'] and age >= SNAPSHOT_MIN_AGE
+
+
+def get_dashboard_section(name):
+    """Return one cached section (stats, charts, batteries or alerts), rebuilding it if dirty or too old."""
+    cache = caches[SNAPSHOT_CACHE]
+    key = SECTION_KEY.format(name)
+    now = time.time()
+    entry = cache.get(key)
+
+    if entry is not None and not _needs_rebuild(entry, cache.get(CHANGED_KEY), now):
+        return entry['data']
+
+    # Only one request rebuilds a section; the rest keep serving the previous one.
+    lock_key = REBUILD_LOCK_KEY.format(name)
+    locked = cache.add(lock_key, True, SNAPSHOT_MAX_STALENESS)
+    if entry is not None and not locked:
+        return entry['data']
+
+    try:
+        entry = {'built_at': now, 'data': SECTION_BUILDERS[name]()}
+        cache.set(key, entry, None)
+    finally:
+        if locked:
+            cache.delete(lock_key)
+    return entry['data']
+
+
+def get_dashboard_snapshot(sections=None):
+    """Return the given sections (default: all four) as one dict, each from its own cache entry."""
+    return {name: get_dashboard_section(name) for name in sections or SECTION_BUILDERS}
@@ -0,0 +1,93 @@
+"""
+Helpers for streaming large JSON and NDJSON responses.
+
+Each encoder comes in a sync and an async flavour. Under ASGI, Django
+buffers a synchronous iterator into memory before sending it, and under
+WSGI it has to drive an asynchronous one from a thread, so views pick
+the flavour that matches the request with is_async_request().
+"""
+import json
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+STREAM_CHUNK_SIZE = getattr(settings, 'BATTERY_STREAM_CHUNK_SIZE', 2000)
+
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+
+
+def dumps(value):
+    return json.dumps(value, cls=DjangoJSONEncoder)
+
+
+def is_async_request(request):
+    """True when the request is served by the ASGI handler."""
+    return isinstance(request, ASGIRequest)
+
+
+def _batched(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_json_array(rows, chunk_size=STREAM_CHUNK_SIZE):
+    """Encode rows as a JSON array, yielding one string per chunk of rows."""
+    yield '['
+    first = True
+    for batch in _batched(rows, chunk_size):
+        text = ','.join(dumps(row) for row in batch)
+        yield text if first else ',' + text
+        first = False
+    yield ']'
+
+
+def iter_ndjson(rows, chunk_size=STREAM_CHUNK_SIZE):
+    """Encode rows as newline-delimited JSON, one string per chunk of rows."""
+    for batch in _batched(rows, chunk_size):
+        yield ''.join(dumps(row) + '\n' for row in batch)
+
+
+async def _abatched(rows, size):
+    batch = []
+    async for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def aiter_json_array(rows, chunk_size=STREAM_CHUNK_SIZE):
+    """Async version of iter_json_array for an async iterable of rows."""
+    yield '['
+    first = True
+    async for batch in _abatched(rows, chunk_size):
+        text = ','.join(dumps(row) for row in batch)
+        yield text if first else ',' + text
+        first = False
+    yield ']'
+
+
+async def aiter_ndjson(rows, chunk_size=STREAM_CHUNK_SIZE):
+    """Async version of iter_ndjson for an async iterable of rows."""
+    async for batch in _abatched(rows, chunk_size):
+        yield ''.join(dumps(row) + '\n' for row in batch)
+
+
+async def achain(*parts):
+    """Async itertools.chain over a mix of sync and async iterables."""
+    for part in parts:
+        if hasattr(part, '__aiter__'):
+            async for item in part:
+                yield item
+        else:
+            for item in part:
+                yield item
@@ -0,0 +1,520 @@
+import json
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
+from django.core.cache import caches
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+from .alert_pipeline import alert_pipeline
+from .anomaly import AnomalyDetector
+from .consumers import topic_values
+from .fleet_state import FleetState, fleet_state
+from .models import AlertRule, Battery, BatteryAlert, BatteryDevice, BatteryHealthEstimate, BatteryLog
+from .recompute import recompute_rules
+from .rules import Reading, evaluate_readings, reading_from_battery
+from .snapshot import SECTION_BUILDERS, SECTION_KEY, SNAPSHOT_CACHE
+from .trends import choose_unit, lttb
+from .watchdog import CommunicationWatchdog, watchdog
+
+
+def create_battery(serial_number, **fields):
+    values = {
+        'battery_type': 'Li-ion',
+        'capacity': 3000,
+        'voltage_nominal': 3.7,
+        'current_charge': 80,
+        'current_voltage': 3.8,
+        'current_temperature': 25,
+        'max_discharge_current': 5,
+        'max_charge_current': 2,
+    }
+    values.update(fields)
+    return Battery.objects.create(serial_number=serial_number, **values)
+
+
+class ConcurrentIngestTests(TransactionTestCase):
+    """Readings written from several request threads while alerts are evaluated."""
+
+    THREADS = 4
+    REQUESTS = 10
+
+    def setUp(self):
+        # Replace the default rules, so each hot reading crosses exactly one.
+        AlertRule.objects.all().delete()
+        AlertRule.objects.create(
+            name='Hot', alert_type='OVER_TEMPERATURE', alert_level='CRITICAL',
+            metric='temperature', operator='gt', threshold=60, message='Temperature {value}C',
+        )
+        self.batteries = [create_battery(f'BAT-{index:03d}') for index in range(10)]
+
+    def _post_readings(self, worker, responses):
+        client = APIClient()
+        try:
+            for request in range(self.REQUESTS):
+                readings = [
+                    {'battery': battery.id, 'current_temperature': 70 + request, 'current': -1}
+                    for battery in self.batteries
+                ]
+                responses.append(client.post('/api/batteries/ingest/', {'readings': readings}, format='json'))
+                battery = self.batteries[(worker + request) % len(self.batteries)]
+                responses.append(client.post(
+                    f'/api/batteries/{battery.id}/update_status/', {'current_temperature': 75}, format='json'
+                ))
+        finally:
+            connection.close()
+
+    def _ingest_concurrently(self):
+        responses = []
+        threads = [
+            threading.Thread(target=self._post_readings, args=(worker, responses))
+            for worker in range(self.THREADS)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return responses
+
+    def _wait_for_pipeline(self, timeout=10):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            metrics = alert_pipeline.metrics()
+            if metrics['evaluated'] + metrics['errors'] >= metrics['submitted'] and not metrics['queue_depth']:
+                return
+            time.sleep(0.05)
+        self.fail('Alert pipeline did not drain')
+
+    def _assert_all_recorded(self, responses):
+        self.assertEqual([response.status_code for response in responses], [200] * len(responses))
+        per_thread = self.REQUESTS * (len(self.batteries) + 1)
+        self.assertEqual(BatteryLog.objects.count(), self.THREADS * per_thread)
+        # Every battery ran hot, and repeats were folded into one open alert each.
+        open_alerts = BatteryAlert.objects.filter(alert_type='OVER_TEMPERATURE', is_resolved=False)
+        self.assertEqual(open_alerts.count(), len(self.batteries))
+        self.assertEqual(sum(open_alerts.values_list('occurrence_count', flat=True)), self.THREADS * per_thread)
+
+    def test_ingest_while_alerts_are_evaluated_inline(self):
+        with mock.patch.object(alert_pipeline, 'workers', 0):
+            self._assert_all_recorded(self._ingest_concurrently())
+
+    def test_ingest_while_alert_workers_run(self):
+        responses = self._ingest_concurrently()
+        self._wait_for_pipeline()
+        self.assertEqual(alert_pipeline.metrics()['errors'], 0)
+        self._assert_all_recorded(responses)
+
+
+class AlertApiTests(TestCase):
+
+    def setUp(self):
+        self.battery = create_battery('BAT-001')
+        self.client = APIClient()
+
+    def test_second_open_alert_of_a_type_is_rejected(self):
+        alert = {'battery': self.battery.id, 'alert_type': 'LOW_CHARGE', 'alert_level': 'WARNING', 'message': 'Low'}
+        self.assertEqual(self.client.post('/api/alerts/', alert, format='json').status_code, 201)
+        response = self.client.post('/api/alerts/', alert, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(BatteryAlert.objects.filter(battery=self.battery).count(), 1)
+
+        resolved = self.client.post('/api/alerts/', {**alert, 'is_resolved': True}, format='json')
+        self.assertEqual(resolved.status_code, 201)
+
+
+class AlertRuleApiTests(TestCase):
+
+    def test_message_with_attribute_access_is_rejected(self):
+        rule = {
+            'name': 'Bad', 'alert_type': 'FAULT', 'alert_level': 'ERROR', 'metric': 'charge',
+            'operator': 'lt', 'threshold': 5, 'message': 'bad {value.foo}',
+        }
+        response = APIClient().post('/api/alert-rules/', rule, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('message', response.data)
+
+    def test_invalid_saved_message_falls_back_to_the_template(self):
+        AlertRule.objects.all().delete()
+        AlertRule.objects.create(
+            name='Bad', alert_type='LOW_CHARGE', alert_level='WARNING', metric='charge',
+            operator='lt', threshold=50, message='bad {value.foo}',
+        )
+        battery = create_battery('BAT-001', current_charge=10)
+        alerts = evaluate_readings([reading_from_battery(battery)])
+        self.assertEqual([alert['message'] for alert in alerts], ['bad {value.foo}'])
+
+
+class QueryCountTests(TestCase):
+    """List endpoints issue a fixed number of queries however many rows they return."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.batteries = [create_battery(f'BAT-{index:03d}') for index in range(10)]
+        for battery in cls.batteries:
+            BatteryAlert.objects.create(battery=battery, alert_type='LOW_CHARGE', alert_level='WARNING', message='Low')
+            BatteryLog.objects.create(
+                battery=battery, charge_percentage=80, voltage=3.8, temperature=25, current=-1, status='IDLE'
+            )
+        cls.device = BatteryDevice.objects.create(device_name='Rack', device_type='OTHER', serial_number='DEV-001')
+        cls.device.batteries.set(cls.batteries)
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_battery_list(self):
+        # Page count plus the page itself.
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/batteries/')
+        self.assertEqual(response.data['count'], len(self.batteries))
+
+    def test_alert_list(self):
+        # One query, with the batteries joined in for battery_serial.
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/alerts/')
+        self.assertEqual(len(response.data['results']), len(self.batteries))
+
+    def test_log_list(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/logs/')
+        self.assertEqual(len(response.data['results']), len(self.batteries))
+
+    def test_device_battery_status(self):
+        # The device, then its batteries once, shared by both halves of the response.
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/devices/{self.device.id}/battery_status/')
+        self.assertEqual(len(response.data['batteries']), len(self.batteries))
+        self.assertEqual(len(response.data['device']['batteries_detail']), len(self.batteries))
+
+
+class HealthEstimateTests(TestCase):
+
+    def setUp(self):
+        self.battery = create_battery('BAT-001', health_percentage=95)
+        # 40 points of charge lost in 40 seconds at 1 A: a gauge jump, not a 0.01 Ah battery.
+        start = timezone.now() - timedelta(minutes=5)
+        for second in range(41):
+            log = BatteryLog.objects.create(
+                battery=self.battery, charge_percentage=80 - second, voltage=3.7,
+                temperature=25, current=-1, status='DISCHARGING',
+            )
+            BatteryLog.objects.filter(pk=log.pk).update(logged_at=start + timedelta(seconds=second))
+
+    def test_get_does_not_store_the_estimate(self):
+        response = APIClient().get(f'/api/batteries/{self.battery.id}/health_estimate/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['samples'], 41)
+        self.assertFalse(BatteryHealthEstimate.objects.filter(battery=self.battery).exists())
+
+    def test_window_days_must_be_finite_and_not_negative(self):
+        for window_days in ('nan', 'inf', '-1', 'abc'):
+            response = APIClient().get(
+                f'/api/batteries/{self.battery.id}/health_estimate/', {'window_days': window_days}
+            )
+            self.assertEqual(response.status_code, 400, window_days)
+
+    def test_implausible_capacity_is_not_applied(self):
+        response = APIClient().post(
+            f'/api/batteries/{self.battery.id}/health_estimate/', {'apply': True}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.data['health_percentage'])
+        self.assertTrue(BatteryHealthEstimate.objects.filter(battery=self.battery).exists())
+        self.battery.refresh_from_db()
+        self.assertEqual(self.battery.health_percentage, 95)
+
+
+class RecomputeRulesTests(TestCase):
+
+    def setUp(self):
+        AlertRule.objects.all().delete()
+        AlertRule.objects.create(
+            name='Hot', alert_type='OVER_TEMPERATURE', alert_level='CRITICAL',
+            metric='temperature', operator='gt', threshold=60, message='Temperature {value}C',
+        )
+        self.battery = create_battery('BAT-001')
+
+    def _log(self, temperature):
+        BatteryLog.objects.create(
+            battery=self.battery, charge_percentage=80, voltage=3.8, temperature=temperature, current=0, status='IDLE'
+        )
+
+    def test_only_the_latest_reading_counts(self):
+        self._log(90)
+        self._log(25)
+        self.assertEqual(recompute_rules([self.battery], {}), 0)
+        self.assertFalse(BatteryAlert.objects.exists())
+
+    def test_rerun_does_not_count_a_reading_twice(self):
+        self._log(90)
+        self.assertEqual(recompute_rules([self.battery], {}), 1)
+        self.assertEqual(recompute_rules([self.battery], {}), 0)
+        alert = BatteryAlert.objects.get()
+        self.assertEqual(alert.occurrence_count, 1)
+
+
+class IngestValidationTests(TestCase):
+
+    def setUp(self):
+        self.battery = create_battery('BAT-001')
+        self.client = APIClient()
+
+    def _ingest(self, readings):
+        return self.client.post('/api/batteries/ingest/', {'readings': readings}, format='json')
+
+    def test_invalid_readings_are_rejected_one_by_one(self):
+        response = self._ingest([
+            {'battery': self.battery.id, 'current_voltage': 'nan'},
+            {'battery': self.battery.id, 'current_temperature': 'inf'},
+            {'battery': self.battery.id, 'current': 'abc'},
+            {'battery': self.battery.id, 'current_charge': 150},
+            {'battery': self.battery.id, 'current_status': 'ON_FIRE'},
+            {'current_charge': 50},
+            {'battery': 999999, 'current_charge': 50},
+            {'serial_number': 'BAT-001', 'current_charge': 42, 'current_voltage': 3.9},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['accepted'], response.data['rejected']), (1, 7))
+        errors = [result.get('errors') for result in response.data['results']]
+        self.assertIn('current_voltage', errors[0])
+        self.assertIn('current_temperature', errors[1])
+        self.assertIn('current', errors[2])
+        self.assertIn('current_charge', errors[3])
+        self.assertIn('current_status', errors[4])
+        self.assertIn('battery', errors[5])
+        self.assertIn('battery', errors[6])
+        self.assertIsNone(errors[7])
+
+        self.battery.refresh_from_db()
+        self.assertEqual((self.battery.current_charge, self.battery.current_voltage), (42, 3.9))
+        self.assertEqual(BatteryLog.objects.filter(battery=self.battery).count(), 1)
+
+    def test_body_must_be_a_list(self):
+        response = self.client.post('/api/batteries/ingest/', {'readings': 'nope'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class WatchdogTests(TestCase):
+
+    def setUp(self):
+        self.battery = create_battery('BAT-001')
+        self.silent_since = timezone.now() - timedelta(minutes=10)
+        Battery.objects.filter(pk=self.battery.pk).update(last_updated=self.silent_since)
+        self.watchdog = CommunicationWatchdog(timeout=300, interval=5)
+        self.watchdog.seed()
+
+    def test_new_silence_is_not_folded_into_a_resolved_alert(self):
+        # Resolved a minute ago: inside the suppression window.
+        BatteryAlert.objects.create(
+            battery=self.battery, alert_type='COMMUNICATION_ERROR', alert_level='ERROR', message='Silent',
+            is_resolved=True, resolved_at=timezone.now() - timedelta(minutes=1),
+        )
+        self.watchdog.check()
+        self.assertTrue(BatteryAlert.objects.filter(
+            battery=self.battery, alert_type='COMMUNICATION_ERROR', is_resolved=False
+        ).exists())
+        self.assertEqual(self.watchdog.metrics()['silent'], 1)
+
+    def test_deadlines_survive_a_failed_check(self):
+        with mock.patch('batteries.watchdog.record_alerts', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.watchdog.check()
+        self.assertEqual(self.watchdog.metrics()['tracked'], 1)
+        self.assertFalse(BatteryAlert.objects.exists())
+
+        # Retried on a later pass.
+        self.watchdog.check(now=time.time() + self.watchdog.interval)
+        self.assertEqual(BatteryAlert.objects.filter(alert_type='COMMUNICATION_ERROR').count(), 1)
+
+    def test_first_request_starts_the_watchdog(self):
+        with mock.patch.object(watchdog, '_ensure_thread') as ensure_thread:
+            APIClient().get('/api/batteries/')
+        ensure_thread.assert_called()
+
+
+class DashboardSnapshotTests(TestCase):
+
+    def setUp(self):
+        caches[SNAPSHOT_CACHE].clear()
+        create_battery('BAT-001')
+
+    def test_sections_are_cached_separately(self):
+        builders = {name: mock.Mock(wraps=builder) for name, builder in SECTION_BUILDERS.items()}
+        with mock.patch.dict(SECTION_BUILDERS, builders):
+            self.client.get('/api/dashboard/alerts/')
+            self.client.get('/api/dashboard/alerts/')
+        self.assertEqual(builders['alerts'].call_count, 1)
+        self.assertFalse(builders['batteries'].called)
+        self.assertIsNone(caches[SNAPSHOT_CACHE].get(SECTION_KEY.format('batteries')))
+
+
+class StreamingTests(TestCase):
+
+    def setUp(self):
+        for index in range(5):
+            create_battery(f'BAT-{index:03d}')
+
+    @staticmethod
+    async def _aread(response):
+        return b''.join([chunk async for chunk in response.streaming_content])
+
+    def test_wsgi_streams_from_a_sync_iterator(self):
+        response = self.client.get('/api/dashboard/battery-details/?stream=json')
+        self.assertFalse(response.is_async)
+        self.assertEqual(len(json.loads(b''.join(response.streaming_content))['batteries']), 5)
+
+    async def test_asgi_streams_from_an_async_iterator(self):
+        response = await self.async_client.get('/api/dashboard/battery-details/?stream=json')
+        self.assertTrue(response.is_async)
+        self.assertEqual(len(json.loads(await self._aread(response))['batteries']), 5)
+
+        response = await self.async_client.get('/api/dashboard/battery-details/?stream=ndjson')
+        self.assertTrue(response.is_async)
+        self.assertEqual(len((await self._aread(response)).splitlines()), 5)
+
+    def test_export_summary_skips_the_cached_battery_list(self):
+        caches[SNAPSHOT_CACHE].clear()
+        builders = {name: mock.Mock(wraps=builder) for name, builder in SECTION_BUILDERS.items()}
+        with mock.patch.dict(SECTION_BUILDERS, builders):
+            response = self.client.get('/api/dashboard/export/')
+            export = json.loads(b''.join(response.streaming_content))
+        self.assertFalse(builders['batteries'].called)
+        self.assertEqual(len(export['batteries']['batteries']), 5)
+        self.assertIn('stats', export)
+
+    async def test_asgi_export_streams_from_an_async_iterator(self):
+        response = await self.async_client.get('/api/dashboard/export/?format=ndjson')
+        self.assertTrue(response.is_async)
+        lines = (await self._aread(response)).splitlines()
+        self.assertEqual(len(lines), 6)
+        self.assertIn('stats', json.loads(lines[0]))
+
+
+class FleetStateTests(TransactionTestCase):
+
+    def setUp(self):
+        self.battery = create_battery('BAT-001')
+        self.fleet = FleetState(interval=60)
+
+    def test_stale_reads_do_not_reload_inline(self):
+        with mock.patch.object(self.fleet, '_ensure_thread'):
+            self.assertEqual(self.fleet.stats()['batteries']['total'], 1)
+        self.fleet._loaded_at -= 3600
+        with mock.patch.object(self.fleet, '_reload') as reload, mock.patch.object(self.fleet, '_ensure_thread'):
+            self.assertEqual(self.fleet.stats()['batteries']['total'], 1)
+        reload.assert_not_called()
+
+    def test_background_thread_reconciles(self):
+        self.assertEqual(self.fleet.stats()['batteries']['faulty'], 0)
+        # A queryset update skips the signals, so only a reconcile can see it.
+        Battery.objects.filter(pk=self.battery.pk).update(current_status='FAULT')
+        self.fleet.mark_stale()
+        deadline = time.monotonic() + 5
+        while self.fleet.stats()['batteries']['faulty'] != 1:
+            if time.monotonic() > deadline:
+                self.fail('Fleet state was not reconciled')
+            time.sleep(0.05)
+
+
+class FleetScanViewTests(TestCase):
+
+    def test_low_health_batteries_are_most_recently_updated_first(self):
+        now = timezone.now()
+        batteries = [create_battery(f'BAT-{index:03d}', health_percentage=50) for index in range(3)]
+        for minutes, battery in zip([30, 10, 20], batteries):
+            Battery.objects.filter(pk=battery.pk).update(last_updated=now - timedelta(minutes=minutes))
+        ids = [battery.id for battery in batteries]
+        with mock.patch.object(fleet_state, 'battery_ids_where', return_value=ids), \
+                mock.patch('batteries.views._batteries_by_id.__defaults__', (2,)):
+            response = APIClient().get('/api/batteries/low_health_batteries/')
+        self.assertEqual([row['serial_number'] for row in response.data], ['BAT-001', 'BAT-002', 'BAT-000'])
+
+
+class AnomalyDetectorTests(TestCase):
+
+    def setUp(self):
+        self.detector = AnomalyDetector(alpha=0.05, threshold=4.0, warmup=10)
+        self.start = time.time()
+
+    def _reading(self, index, temperature):
+        # No current, so only temperature is scored.
+        return Reading(
+            battery_id=1, battery_type='Li-ion', current_charge=80, current_voltage=3.8,
+            current_temperature=temperature, current=0, current_status='IDLE', voltage_nominal=3.7,
+            health_percentage=100, max_charge_current=2, max_discharge_current=5,
+            enqueued_at=self.start + 10 * index,
+        )
+
+    def test_steady_readings_are_not_flagged(self):
+        readings = [self._reading(index, 25 + 0.2 * (index % 3)) for index in range(50)]
+        self.assertEqual(self.detector.observe(readings), [])
+
+    def test_spike_is_flagged(self):
+        self.detector.observe([self._reading(index, 25 + 0.2 * (index % 3)) for index in range(50)])
+        alerts = self.detector.observe([self._reading(50, 45)])
+        self.assertEqual([(alert['battery_id'], alert['alert_type']) for alert in alerts], [(1, 'FAULT')])
+        self.assertIn('Temperature', alerts[0]['message'])
+
+
+class TopicValuesTests(TestCase):
+
+    def test_lists_and_strings_are_normalized(self):
+        self.assertEqual(topic_values([1, '2']), ['1', '2'])
+        self.assertEqual(topic_values('12'), ['12'])
+        self.assertEqual(topic_values('1,,2'), ['1', '2'])
+        self.assertEqual(topic_values(None), [])
+
+    def test_anything_else_is_rejected(self):
+        for value in (5, True, {'id': 1}, [[1]], [None], [True]):
+            self.assertIsNone(topic_values(value), value)
+
+
+class TrendTests(TestCase):
+
+    def test_lttb_returns_the_requested_points_with_both_endpoints(self):
+        xs = list(range(1000))
+        ys = [50 + (40 if x == 500 else 0) for x in xs]
+        for threshold in (1, 2, 3, 10, 100):
+            selected = lttb(xs, ys, threshold)
+            self.assertEqual(len(selected), threshold)
+            self.assertEqual(selected, sorted(set(selected)))
+            self.assertEqual(selected[-1], len(xs) - 1)
+            if threshold > 1:
+                self.assertEqual(selected[0], 0)
+        # The spike is the largest triangle in its bucket.
+        self.assertIn(500, lttb(xs, ys, 10))
+        self.assertEqual(lttb(xs[:5], ys[:5], 10), list(range(5)))
+
+    def test_resolution_is_the_smallest_unit_that_fits(self):
+        until = timezone.now()
+        self.assertEqual(choose_unit(until - timedelta(minutes=10), until, 1000), 'second')
+        self.assertEqual(choose_unit(until - timedelta(hours=1), until, 100), 'minute')
+        self.assertEqual(choose_unit(until - timedelta(days=1), until, 100), 'hour')
+        self.assertEqual(choose_unit(until - timedelta(days=30), until, 100), 'day')
+        self.assertEqual(choose_unit(until - timedelta(days=3650), until, 10), 'month')
+
+    def test_lttb_trend_has_the_requested_points(self):
+        battery = create_battery('BAT-001')
+        start = timezone.now() - timedelta(hours=2)
+        for minute in range(100):
+            log = BatteryLog.objects.create(
+                battery=battery, charge_percentage=minute % 50, voltage=3.7, temperature=25, current=-1, status='IDLE'
+            )
+            BatteryLog.objects.filter(pk=log.pk).update(logged_at=start + timedelta(minutes=minute))
+        response = self.client.get('/api/dashboard/trend/', {
+            'battery_id': battery.id, 'since': start.isoformat(), 'points': 40, 'downsample': 'lttb', 'status': 'IDLE',
+        })
+        self.assertEqual(response.status_code, 200)
+        # Bucketed by minute (4x oversampled), then LTTB picks the 40 points.
+        self.assertEqual(response.json()['resolution'], 'minute')
+        self.assertEqual(len(response.json()['timestamps']), 40)
+
+    def test_inverted_window_is_rejected(self):
+        now = timezone.now()
+        response = self.client.get('/api/dashboard/trend/', {
+            'since': now.isoformat(), 'until': (now - timedelta(days=1)).isoformat(),
+        })
+        self.assertEqual(response.status_code, 400)
+        future = self.client.get('/api/dashboard/trend/', {'since': (now + timedelta(days=1)).isoformat()})
+        self.assertEqual(future.status_code, 400)
@@ -0,0 +1,57 @@
+"""
+Channel-layer group names for WebSocket topic subscriptions.
+
+Clients that do not subscribe to anything stay in the FIREHOSE_GROUP and
+receive every update. Subscribing to batteries, devices, battery types or
+alert levels moves the client onto the matching per-topic groups instead.
+"""
+import re
+from .models import Battery
+
+
+FIREHOSE_GROUP = 'dashboard'
+
+# Subscription key -> group prefix
+TOPIC_KINDS = {
+    'batteries': 'battery',
+    'devices': 'device',
+    'battery_types': 'type',
+    'alert_levels': 'level',
+}
+
+_UNSAFE = re.compile(r'[^A-Za-z0-9_.-]')
+
+
+def group_name(prefix, value):
+    # Channels only accepts ASCII alphanumerics, hyphens, underscores and periods.
+    return f'{prefix}.{_UNSAFE.sub("_", str(value))}'[:99]
+
+
+def subscription_groups(topics):
+    """Group names for a {kind: [values]} subscription; unknown kinds are ignored."""
+    groups = set()
+    for kind, prefix in TOPIC_KINDS.items():
+        for value in topics.get(kind) or []:
+            groups.add(group_name(prefix, value))
+    return groups
+
+
+def device_map(battery_ids):
+    """{battery_id: [device_id, ...]} for the given batteries, in one query."""
+    devices = {}
+    rows = Battery.devices.through.objects.filter(battery_id__in=battery_ids).values_list(
+        'battery_id', 'batterydevice_id'
+    )
+    for battery_id, device_id in rows:
+        devices.setdefault(battery_id, []).append(device_id)
+    return devices
+
+
+def battery_groups(battery_id, battery_type, device_ids):
+    groups = {FIREHOSE_GROUP, group_name('battery', battery_id), group_name('type', battery_type)}
+    groups.update(group_name('device', device_id) for device_id in device_ids)
+    return groups
+
+
+def alert_groups(battery_id, battery_type, device_ids, alert_level):
+    return battery_groups(battery_id, battery_type, device_ids) | {group_name('level', alert_level)}
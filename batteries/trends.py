@@ -0,0 +1,146 @@
+"""
+Time-bucketed trend series over BatteryLog.
+
+Readings in the requested window are grouped in the database with Trunc
+at the smallest calendar unit that yields no more than the requested
+number of points, so the payload size depends on the resolution asked
+for, not on how many readings fall in the window.
+"""
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Avg, Count, Max, Min
+from django.db.models.functions import Trunc
+from django.utils import timezone
+from .rollups import ROLLUP_FOR_UNIT, bucket_rollups
+
+
+TREND_FIELDS = {
+    'charge': 'charge_percentage',
+    'voltage': 'voltage',
+    'temperature': 'temperature',
+}
+
+TRUNC_UNITS = [
+    ('second', 1),
+    ('minute', 60),
+    ('hour', 3600),
+    ('day', 86400),
+    ('week', 7 * 86400),
+    ('month', 31 * 86400),
+]
+
+TREND_DEFAULT_POINTS = getattr(settings, 'BATTERY_TREND_DEFAULT_POINTS', 100)
+TREND_MAX_POINTS = getattr(settings, 'BATTERY_TREND_MAX_POINTS', 2000)
+TREND_DEFAULT_WINDOW = timedelta(seconds=getattr(settings, 'BATTERY_TREND_DEFAULT_WINDOW', 86400))
+TREND_USE_ROLLUPS = getattr(settings, 'BATTERY_TREND_USE_ROLLUPS', True)
+# With LTTB, bucket this many times finer than the target and let LTTB pick the points.
+LTTB_OVERSAMPLE = 4
+
+
+def choose_unit(since, until, points):
+    """Smallest Trunc unit that splits the window into at most `points` buckets."""
+    window = max((until - since).total_seconds(), 1)
+    for unit, seconds in TRUNC_UNITS:
+        if window / seconds <= points:
+            return unit
+    return TRUNC_UNITS[-1][0]
+
+
+def bucket_logs(queryset, since, until, unit):
+    """Min/avg/max per bucket for every trend field, computed in the database."""
+    aggregates = {'count': Count('id')}
+    for name, field in TREND_FIELDS.items():
+        aggregates[f'{name}_min'] = Min(field)
+        aggregates[f'{name}_avg'] = Avg(field)
+        aggregates[f'{name}_max'] = Max(field)
+
+    return list(
+        queryset.filter(logged_at__gte=since, logged_at__lte=until)
+        .annotate(bucket=Trunc('logged_at', unit))
+        .values('bucket')
+        .annotate(**aggregates)
+        .order_by('bucket')
+    )
+
+
+def lttb(xs, ys, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+
+    Returns the indices of the `threshold` points that best preserve the
+    visual shape of the (xs, ys) line, always including the first and last.
+    """
+    n = len(xs)
+    if threshold >= n:
+        return list(range(n))
+    if threshold < 3:
+        # Too few points for a triangle: keep both endpoints, or just the latest point.
+        return [0, n - 1][-threshold:]
+
+    selected = [0]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third triangle vertex.
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        span = next_end - next_start
+        avg_x = sum(xs[next_start:next_end]) / span
+        avg_y = sum(ys[next_start:next_end]) / span
+
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((xs[a] - avg_x) * (ys[j] - ys[a]) - (xs[a] - xs[j]) * (avg_y - ys[a]))
+            if area > best_area:
+                best, best_area = j, area
+        selected.append(best)
+        a = best
+
+    selected.append(n - 1)
+    return selected
+
+
+def build_trend(queryset, since=None, until=None, points=TREND_DEFAULT_POINTS, downsample=None, series='charge',
+                battery_id=None, use_rollups=False):
+    """
+    Return column arrays (timestamps, count, and min/avg/max per field) for the window.
+
+    With use_rollups, buckets of a minute or coarser are read from the
+    coarsest BatteryLogRollup resolution that serves them instead of from
+    `queryset`; the caller must only set it when no filter other than the
+    battery applies.
+    """
+    until = until or timezone.now()
+    since = since or until - TREND_DEFAULT_WINDOW
+    points = max(1, min(points, TREND_MAX_POINTS))
+
+    use_lttb = downsample == 'lttb'
+    unit = choose_unit(since, until, points * LTTB_OVERSAMPLE if use_lttb else points)
+    if use_rollups and ROLLUP_FOR_UNIT[unit] is not None:
+        rows = bucket_rollups(since, until, unit, battery_id=battery_id)
+        source = f'rollup:{ROLLUP_FOR_UNIT[unit]}'
+    else:
+        rows = bucket_logs(queryset, since, until, unit)
+        source = 'logs'
+
+    if use_lttb and len(rows) > points:
+        xs = [row['bucket'].timestamp() for row in rows]
+        ys = [row[f'{series}_avg'] for row in rows]
+        rows = [rows[i] for i in lttb(xs, ys, points)]
+
+    data = {
+        'since': since.isoformat(),
+        'until': until.isoformat(),
+        'resolution': unit,
+        'source': source,
+        'timestamps': [row['bucket'].isoformat() for row in rows],
+        'count': [row['count'] for row in rows],
+    }
+    for name in TREND_FIELDS:
+        data[name] = [row[f'{name}_avg'] for row in rows]
+        data[f'{name}_min'] = [row[f'{name}_min'] for row in rows]
+        data[f'{name}_max'] = [row[f'{name}_max'] for row in rows]
+    return data
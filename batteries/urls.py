@@ -1,9 +1,9 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import BatteryViewSet, BatteryAlertViewSet, BatteryLogViewSet, BatteryDeviceViewSet
+from .views import AlertRuleViewSet, BatteryViewSet, BatteryAlertViewSet, BatteryLogViewSet, BatteryDeviceViewSet
 from .dashboard_views import (
     dashboard, dashboard_stats, battery_chart_data, battery_details, 
-    alert_summary, battery_trend, dashboard_export
+    alert_summary, battery_trend, dashboard_export, fleet_analytics, pipeline_metrics
 )
 
 router = DefaultRouter()
@@ -11,6 +11,7 @@ router.register(r'batteries', BatteryViewSet, basename='battery')
 router.register(r'alerts', BatteryAlertViewSet, basename='battery-alert')
 router.register(r'logs', BatteryLogViewSet, basename='battery-log')
 router.register(r'devices', BatteryDeviceViewSet, basename='battery-device')
+router.register(r'alert-rules', AlertRuleViewSet, basename='alert-rule')
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -22,4 +23,6 @@ urlpatterns = [
     path('dashboard/alerts/', alert_summary, name='alert-summary'),
     path('dashboard/trend/', battery_trend, name='battery-trend'),
     path('dashboard/export/', dashboard_export, name='dashboard-export'),
+    path('dashboard/metrics/', pipeline_metrics, name='pipeline-metrics'),
+    path('dashboard/analytics/', fleet_analytics, name='fleet-analytics'),
 ]
@@ -3,8 +3,27 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.filters import SearchFilter, OrderingFilter
 from django.utils import timezone
-from .models import Battery, BatteryAlert, BatteryLog, BatteryDevice
-from .serializers import BatterySerializer, BatteryAlertSerializer, BatteryLogSerializer, BatteryDeviceSerializer
+from datetime import timedelta
+import operator
+from .models import AlertRule, Battery, BatteryAlert, BatteryHealthEstimate, BatteryLog, BatteryDevice
+from .serializers import (
+    AlertRuleSerializer, BatterySerializer, BatteryAlertSerializer, BatteryHealthEstimateSerializer,
+    BatteryLogSerializer, BatteryDeviceSerializer
+)
+from .alert_pipeline import alert_pipeline
+from .fleet_state import fleet_state
+from .health import HEALTH_WINDOW_DAYS, estimate_batteries, refresh_health, unsaved_estimate
+from .alerts import resolve_alerts
+from .rules import reading_from_battery
+from .ingest import ingest_readings, INGEST_MAX_READINGS
+from .locking import serialized_writes
+from .pagination import AlertCursorPagination, LogCursorPagination
+from .filters import BatteryLogFilter, filter_alerts
+from .rollups import record_logs, rollup_history
+
+
+# Longest ?days accepted by health_report's daily history.
+HEALTH_REPORT_MAX_DAYS = 3650
 
 
 class BatteryViewSet(viewsets.ModelViewSet):
@@ -32,26 +51,61 @@ class BatteryViewSet(viewsets.ModelViewSet):
         if 'current_status' in request.data:
             battery.current_status = request.data['current_status']
         
-        battery.save()
-        
-        # Create log entry
-        BatteryLog.objects.create(
-            battery=battery,
-            charge_percentage=battery.current_charge,
-            voltage=battery.current_voltage,
-            temperature=battery.current_temperature,
-            current=request.data.get('current', 0),
-            status=battery.current_status
-        )
+        with serialized_writes():
+            battery.save()
+            
+            # Create log entry
+            log = BatteryLog.objects.create(
+                battery=battery,
+                charge_percentage=battery.current_charge,
+                voltage=battery.current_voltage,
+                temperature=battery.current_temperature,
+                current=request.data.get('current', 0),
+                status=battery.current_status
+            )
+            record_logs([log])
         
         # Check for alerts
-        self._check_battery_alerts(battery)
+        self._check_battery_alerts(battery, log.current)
         
         return Response(BatterySerializer(battery).data)
     
+    @action(detail=False, methods=['post'])
+    def ingest(self, request):
+        """Apply a batch of readings for many batteries in one request."""
+        readings = request.data.get('readings') if isinstance(request.data, dict) else request.data
+        
+        if not isinstance(readings, list):
+            return Response(
+                {'error': 'Expected a list of readings.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(readings) > INGEST_MAX_READINGS:
+            return Response(
+                {'error': f'At most {INGEST_MAX_READINGS} readings are accepted per request.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        results = ingest_readings(readings)
+        accepted = sum(1 for result in results if result['status'] == 'ok')
+        
+        return Response({
+            'accepted': accepted,
+            'rejected': len(results) - accepted,
+            'results': results,
+        })
+    
     @action(detail=True, methods=['get'])
     def health_report(self, request, pk=None):
         """Get detailed health report for a battery."""
+        try:
+            days = int(request.query_params.get('days', 30))
+        except ValueError:
+            return Response({'error': 'days must be an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+        if days < 1:
+            return Response({'error': 'days must be positive.'}, status=status.HTTP_400_BAD_REQUEST)
+        days = min(days, HEALTH_REPORT_MAX_DAYS)
+        
         battery = self.get_object()
         recent_logs = battery.logs.all()[:100]
         recent_alerts = battery.alerts.filter(is_resolved=False)
@@ -61,75 +115,101 @@ class BatteryViewSet(viewsets.ModelViewSet):
             'recent_alerts': BatteryAlertSerializer(recent_alerts, many=True).data,
             'recent_readings': BatteryLogSerializer(recent_logs, many=True).data,
             'average_temperature': sum(log.temperature for log in recent_logs) / len(recent_logs) if recent_logs else 0,
+            'daily_history': rollup_history(battery.id, timezone.now() - timedelta(days=days)),
+            'health_estimate': _stored_estimate(battery),
         }
         
         return Response(report)
     
+    @action(detail=True, methods=['get', 'post'])
+    def health_estimate(self, request, pk=None):
+        """
+        Estimate health, cycles and remaining useful life from the battery's logs.
+        
+        ?window_days=N (0 for all logs, at most HEALTH_REPORT_MAX_DAYS)
+        overrides the log window. A GET only computes the estimate; a POST
+        also stores it, and with {"apply": true} writes the estimated health
+        and cycle count onto the battery.
+        """
+        battery = self.get_object()
+        try:
+            window_days = float(request.query_params.get('window_days', HEALTH_WINDOW_DAYS or 0))
+        except ValueError:
+            return Response({'error': 'window_days must be a number.'}, status=status.HTTP_400_BAD_REQUEST)
+        # Also rejects nan, which fails every comparison, and inf.
+        if not 0 <= window_days <= HEALTH_REPORT_MAX_DAYS:
+            return Response(
+                {'error': f'window_days must be between 0 and {HEALTH_REPORT_MAX_DAYS}.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if request.method == 'GET':
+            estimate, = estimate_batteries([battery], window_days=window_days or None)
+            return Response(BatteryHealthEstimateSerializer(unsaved_estimate(estimate)).data)
+        
+        refresh_health([battery], apply=bool(request.data.get('apply')), window_days=window_days or None)
+        estimate = BatteryHealthEstimate.objects.get(battery=battery)
+        return Response(BatteryHealthEstimateSerializer(estimate).data)
+    
     @action(detail=False, methods=['get'])
     def low_health_batteries(self, request):
-        """Get all batteries with low health."""
-        health_threshold = request.query_params.get('threshold', 80)
-        batteries = Battery.objects.filter(health_percentage__lt=float(health_threshold))
-        serializer = self.get_serializer(batteries, many=True)
+        """
+        Get all batteries with low health, most recently updated first.
+        
+        The selection comes from the in-memory fleet state, so a change made
+        outside the save paths can take up to BATTERY_FLEET_RECONCILE_INTERVAL
+        seconds to show up here.
+        """
+        try:
+            health_threshold = float(request.query_params.get('threshold', 80))
+        except ValueError:
+            return Response({'error': 'threshold must be a number.'}, status=status.HTTP_400_BAD_REQUEST)
+        battery_ids = fleet_state.battery_ids_where('health', operator.lt, health_threshold)
+        serializer = self.get_serializer(_batteries_by_id(battery_ids), many=True)
         return Response(serializer.data)
     
     @action(detail=False, methods=['get'])
     def critical_status_batteries(self, request):
-        """Get all batteries with critical status."""
-        batteries = Battery.objects.filter(current_status='FAULT')
-        serializer = self.get_serializer(batteries, many=True)
+        """
+        Get all batteries with critical status, most recently updated first.
+        
+        Selected from the in-memory fleet state, with the same lag as
+        low_health_batteries.
+        """
+        battery_ids = fleet_state.battery_ids_with_status('FAULT')
+        serializer = self.get_serializer(_batteries_by_id(battery_ids), many=True)
         return Response(serializer.data)
     
-    def _check_battery_alerts(self, battery):
-        """Check battery parameters and create alerts if needed."""
-        alerts_to_create = []
-        
-        # Check charge level
-        if battery.current_charge < 10:
-            alerts_to_create.append({
-                'alert_type': 'LOW_CHARGE',
-                'alert_level': 'WARNING',
-                'message': f'Battery charge is critically low: {battery.current_charge}%'
-            })
-        
-        # Check temperature
-        if battery.current_temperature > 50:
-            alerts_to_create.append({
-                'alert_type': 'OVER_TEMPERATURE',
-                'alert_level': 'CRITICAL',
-                'message': f'Battery temperature is too high: {battery.current_temperature}°C'
-            })
-        
-        # Check voltage
-        if battery.current_voltage < battery.voltage_nominal * 0.8:
-            alerts_to_create.append({
-                'alert_type': 'UNDER_VOLTAGE',
-                'alert_level': 'ERROR',
-                'message': f'Battery voltage is too low: {battery.current_voltage}V'
-            })
-        
-        # Check health
-        if battery.health_percentage < 20:
-            alerts_to_create.append({
-                'alert_type': 'HEALTH_DEGRADATION',
-                'alert_level': 'WARNING',
-                'message': f'Battery health has degraded: {battery.health_percentage}%'
-            })
-        
-        # Create alerts
-        for alert_data in alerts_to_create:
-            BatteryAlert.objects.create(battery=battery, **alert_data)
+    def _check_battery_alerts(self, battery, current=0):
+        """Queue the battery's readings for asynchronous alert evaluation."""
+        alert_pipeline.submit_readings([reading_from_battery(battery, current)])
+
+
+def _stored_estimate(battery):
+    estimate = BatteryHealthEstimate.objects.filter(battery=battery).first()
+    return BatteryHealthEstimateSerializer(estimate).data if estimate else None
+
+
+def _batteries_by_id(battery_ids, chunk_size=1000):
+    """Load the batteries a fleet scan selected, a chunk of ids per query, most recently updated first."""
+    batteries = []
+    for start in range(0, len(battery_ids), chunk_size):
+        batteries.extend(Battery.objects.filter(id__in=battery_ids[start:start + chunk_size]))
+    # The chunks are merged here, so apply the model's -last_updated ordering across all of them.
+    batteries.sort(key=operator.attrgetter('last_updated'), reverse=True)
+    return batteries
 
 
 class BatteryAlertViewSet(viewsets.ModelViewSet):
     """ViewSet for BatteryAlert model."""
     
-    queryset = BatteryAlert.objects.all()
+    queryset = BatteryAlert.objects.select_related('battery')
     serializer_class = BatteryAlertSerializer
+    pagination_class = AlertCursorPagination
     filter_backends = [SearchFilter, OrderingFilter]
     search_fields = ['alert_type', 'battery__serial_number']
     ordering_fields = ['created_at', 'alert_level']
-    ordering = ['-created_at']
+    ordering = ['-created_at', '-id']
     
     @action(detail=True, methods=['post'])
     def resolve(self, request, pk=None):
@@ -140,10 +220,26 @@ class BatteryAlertViewSet(viewsets.ModelViewSet):
         alert.save()
         return Response(BatteryAlertSerializer(alert).data)
     
+    @action(detail=False, methods=['post'])
+    def bulk_resolve(self, request):
+        """Resolve every unresolved alert matching the given criteria in one update."""
+        if not isinstance(request.data, dict):
+            return Response({'error': 'Expected an object.'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        alerts, applied = filter_alerts(BatteryAlert.objects.all(), request.data)
+        if not applied and request.data.get('all') is not True:
+            return Response(
+                {'error': 'Give ids, battery, device, alert_type, alert_level, since or until, '
+                          'or "all": true to resolve every alert.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        return Response({'resolved': resolve_alerts(alerts)})
+    
     @action(detail=False, methods=['get'])
     def unresolved(self, request):
         """Get all unresolved alerts."""
-        alerts = BatteryAlert.objects.filter(is_resolved=False)
+        alerts = self.get_queryset().filter(is_resolved=False)
         serializer = self.get_serializer(alerts, many=True)
         return Response(serializer.data)
 
@@ -151,18 +247,19 @@ class BatteryAlertViewSet(viewsets.ModelViewSet):
 class BatteryLogViewSet(viewsets.ReadOnlyModelViewSet):
     """ViewSet for BatteryLog model (read-only)."""
     
-    queryset = BatteryLog.objects.all()
+    queryset = BatteryLog.objects.select_related('battery')
     serializer_class = BatteryLogSerializer
-    filter_backends = [SearchFilter, OrderingFilter]
+    pagination_class = LogCursorPagination
+    filter_backends = [BatteryLogFilter, SearchFilter, OrderingFilter]
     search_fields = ['battery__serial_number']
     ordering_fields = ['logged_at']
-    ordering = ['-logged_at']
+    ordering = ['-logged_at', '-id']
 
 
 class BatteryDeviceViewSet(viewsets.ModelViewSet):
     """ViewSet for BatteryDevice model."""
     
-    queryset = BatteryDevice.objects.all()
+    queryset = BatteryDevice.objects.prefetch_related('batteries')
     serializer_class = BatteryDeviceSerializer
     filter_backends = [SearchFilter, OrderingFilter]
     search_fields = ['device_name', 'serial_number']
@@ -179,3 +276,14 @@ class BatteryDeviceViewSet(viewsets.ModelViewSet):
             'device': BatteryDeviceSerializer(device).data,
             'batteries': serializer.data
         })
+
+
+class AlertRuleViewSet(viewsets.ModelViewSet):
+    """ViewSet for AlertRule model."""
+    
+    queryset = AlertRule.objects.all()
+    serializer_class = AlertRuleSerializer
+    filter_backends = [SearchFilter, OrderingFilter]
+    search_fields = ['name', 'alert_type', 'battery_type']
+    ordering_fields = ['alert_type', 'name', 'created_at']
+    ordering = ['alert_type', 'name']
@@ -0,0 +1,236 @@
+"""
+Communication-loss detection.
+
+Every reading pushes the battery's next expected report time (now +
+BATTERY_COMM_TIMEOUT) onto an in-memory min-heap, which costs O(log n).
+A background thread sleeps until the earliest deadline, pops the batteries
+whose deadline passed and raises a COMMUNICATION_ERROR alert for them;
+the next reading from a silent battery resolves it. Superseded heap
+entries are skipped when popped and the heap is compacted when they pile
+up, so no periodic full-table scan of Battery.last_updated is needed.
+
+Before raising, expired batteries are re-checked against last_updated in
+one query limited to those ids, so readings handled by another process
+do not cause false alarms, and silent batteries are re-checked the same
+way so they recover even when their next reading lands elsewhere. The
+index is seeded from the database once, when the watchdog starts: on the
+first request the process serves, or the first reading, whichever comes
+first, so a fleet that stays silent after a restart is still caught.
+
+Communication alerts bypass the alert suppression window. The timeout
+and the window are both five minutes by default, so a battery that goes
+quiet again right after recovering would otherwise have its new alert
+folded into the one just resolved and stay silent with nothing open.
+"""
+import heapq
+import logging
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+from django.db import close_old_connections
+from .alerts import record_alerts, resolve_alerts
+from .broadcast import broadcast_buffer
+from .models import Battery, BatteryAlert
+from .snapshot import mark_dashboard_dirty
+
+
+logger = logging.getLogger(__name__)
+
+COMM_WATCHDOG = getattr(settings, 'BATTERY_COMM_WATCHDOG', True)
+COMM_TIMEOUT = getattr(settings, 'BATTERY_COMM_TIMEOUT', 300)
+# Longest the thread sleeps; expirations within this window are handled as one batch.
+COMM_CHECK_INTERVAL = getattr(settings, 'BATTERY_COMM_CHECK_INTERVAL', 5)
+COMM_ALERT_LEVEL = 'ERROR'
+
+
+class CommunicationWatchdog:
+    """Min-heap of next expected report times, drained by a background thread."""
+
+    def __init__(self, timeout=COMM_TIMEOUT, interval=COMM_CHECK_INTERVAL):
+        self.timeout = timeout
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._heap = []
+        self._deadlines = {}
+        self._silent = {}
+        self._recovered = set()
+        self._thread = None
+
+    def seen(self, battery_ids, at=None):
+        """Record readings from battery_ids at the given epoch time (default now)."""
+        deadline = (at or time.time()) + self.timeout
+        with self._lock:
+            for battery_id in battery_ids:
+                self._deadlines[battery_id] = deadline
+                heapq.heappush(self._heap, (deadline, battery_id))
+                if battery_id in self._silent:
+                    self._recovered.add(battery_id)
+            if len(self._heap) > 2 * len(self._deadlines) + 1000:
+                self._compact()
+            recovered = bool(self._recovered)
+        self.start()
+        if recovered:
+            self._wake.set()
+
+    def start(self):
+        """Start the background thread, which seeds itself from the database, if it is not running."""
+        if COMM_WATCHDOG:
+            self._ensure_thread()
+
+    def forget(self, battery_ids):
+        with self._lock:
+            for battery_id in battery_ids:
+                self._deadlines.pop(battery_id, None)
+                self._silent.pop(battery_id, None)
+                self._recovered.discard(battery_id)
+
+    def _compact(self):
+        # Drop superseded entries; the caller holds the lock.
+        self._heap = [(deadline, battery_id) for battery_id, deadline in self._deadlines.items()]
+        heapq.heapify(self._heap)
+
+    def _pop_expired(self, now):
+        expired = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                deadline, battery_id = heapq.heappop(self._heap)
+                if self._deadlines.get(battery_id) == deadline:
+                    del self._deadlines[battery_id]
+                    expired.append(battery_id)
+        return expired
+
+    def _requeue(self, battery_ids, deadline):
+        # Put back deadlines that were popped but never handled; fresher ones win.
+        with self._lock:
+            for battery_id in battery_ids:
+                if battery_id not in self._deadlines:
+                    self._deadlines[battery_id] = deadline
+                    heapq.heappush(self._heap, (deadline, battery_id))
+
+    def next_deadline(self):
+        with self._lock:
+            return self._heap[0][0] if self._heap else None
+
+    def check(self, now=None):
+        """Raise alerts for batteries past their deadline and resolve recovered ones."""
+        now = now or time.time()
+        expired = self._pop_expired(now)
+        if expired:
+            try:
+                self._raise(expired, now)
+            except Exception:
+                # Retry on a later pass rather than in a tight loop against a failing database.
+                self._requeue(expired, now + self.interval)
+                raise
+
+        with self._lock:
+            recovered, self._recovered = self._recovered, set()
+            silent = dict(self._silent)
+        reported = {}
+        if silent:
+            # Readings handled by other processes only show up in the database.
+            since = datetime.fromtimestamp(min(silent.values()), tz=dt_timezone.utc)
+            rows = Battery.objects.filter(id__in=list(silent), last_updated__gt=since).values_list('id', 'last_updated')
+            reported = {
+                battery_id: last_updated.timestamp() for battery_id, last_updated in rows
+                if last_updated.timestamp() > silent[battery_id]
+            }
+            recovered.update(reported)
+        if recovered:
+            self._resolve(recovered)
+            for battery_id, reported_at in reported.items():
+                self.seen([battery_id], at=reported_at)
+
+    def _raise(self, battery_ids, now):
+        silent = []
+        for battery_id, last_updated in Battery.objects.filter(id__in=battery_ids).values_list('id', 'last_updated'):
+            reported_at = last_updated.timestamp()
+            if reported_at + self.timeout > now:
+                # Another process took a reading in the meantime.
+                self.seen([battery_id], at=reported_at)
+            else:
+                silent.append((battery_id, reported_at))
+        if not silent:
+            return
+
+        candidates = [{
+            'battery_id': battery_id,
+            'alert_type': 'COMMUNICATION_ERROR',
+            'alert_level': COMM_ALERT_LEVEL,
+            'message': f'No reading received for {int((now - reported_at) // 60)} minutes',
+        } for battery_id, reported_at in silent]
+        # Never fold into an alert that was just resolved: this battery needs an open one.
+        created, changed = record_alerts(candidates, suppress=False)
+        with self._lock:
+            for battery_id, _ in silent:
+                self._silent[battery_id] = now
+        mark_dashboard_dirty()
+        if created or changed:
+            broadcast_buffer.add(alert_ids=[alert.pk for alert in created + changed if alert.pk is not None])
+
+    def _resolve(self, battery_ids):
+        with self._lock:
+            for battery_id in battery_ids:
+                self._silent.pop(battery_id, None)
+        resolve_alerts(BatteryAlert.objects.filter(battery_id__in=list(battery_ids), alert_type='COMMUNICATION_ERROR'))
+
+    def seed(self):
+        """Load last report times and open communication alerts from the database."""
+        rows = list(Battery.objects.values_list('id', 'last_updated'))
+        open_alerts = dict(
+            BatteryAlert.objects.filter(alert_type='COMMUNICATION_ERROR', is_resolved=False)
+            .values_list('battery_id', 'last_seen')
+        )
+        with self._lock:
+            # Batteries that reported since startup already have a fresh deadline.
+            reported = set(self._deadlines)
+            for battery_id, last_updated in rows:
+                if battery_id not in reported and battery_id not in open_alerts:
+                    deadline = last_updated.timestamp() + self.timeout
+                    self._deadlines[battery_id] = deadline
+                    self._heap.append((deadline, battery_id))
+            heapq.heapify(self._heap)
+            for battery_id, last_seen in open_alerts.items():
+                self._silent[battery_id] = last_seen.timestamp()
+                if battery_id in reported:
+                    self._recovered.add(battery_id)
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name='battery-watchdog', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        try:
+            self.seed()
+        except Exception:
+            logger.exception('Communication watchdog could not load last report times')
+        finally:
+            close_old_connections()
+        while True:
+            deadline = self.next_deadline()
+            delay = self.interval if deadline is None else min(max(deadline - time.time(), 0), self.interval)
+            self._wake.wait(delay)
+            self._wake.clear()
+            try:
+                self.check()
+            except Exception:
+                logger.exception('Communication watchdog check failed')
+            finally:
+                close_old_connections()
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'tracked': len(self._deadlines),
+                'silent': len(self._silent),
+                'heap_size': len(self._heap),
+                'timeout': self.timeout,
+            }
+
+
+watchdog = CommunicationWatchdog()
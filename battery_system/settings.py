@@ -71,6 +71,9 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # A file rather than the in-memory default, so tests that write from several
+        # threads see the same locking as the server.
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
@@ -132,9 +135,123 @@ CORS_ALLOWED_ORIGINS = [
     "http://127.0.0.1:8000",
 ]
 
-# Channels configuration (development-safe InMemory layer). For production, use Redis.
+# Channels configuration. The InMemory layer only reaches consumers in the same
+# process, so it suits a single development server. Any deployment with more than
+# one process (several ASGI workers, or gunicorn plus daphne) needs channels_redis:
+#   pip install channels-redis
+#   'BACKEND': 'channels_redis.core.RedisChannelLayer',
+#   'CONFIG': {'hosts': [('127.0.0.1', 6379)]},
 CHANNEL_LAYERS = {
     'default': {
         'BACKEND': 'channels.layers.InMemoryChannelLayer',
     },
 }
+
+# Caches. The dashboard snapshot lives in its own alias; locmem is per process,
+# so point it at a shared backend (e.g. Redis) when running several workers.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'dashboard': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'battery-dashboard',
+    },
+}
+
+# Dashboard snapshot: rebuilt at most once per MIN_AGE seconds after a change,
+# and never served older than MAX_STALENESS seconds.
+BATTERY_SNAPSHOT_CACHE = 'dashboard'
+BATTERY_SNAPSHOT_MIN_AGE = 2
+BATTERY_SNAPSHOT_MAX_STALENESS = 30
+
+# Rows per chunk when streaming large JSON/NDJSON responses (exports, battery details)
+BATTERY_STREAM_CHUNK_SIZE = 2000
+
+# Keyset pages for /api/dashboard/battery-details/?limit=N&after=<id>
+BATTERY_DETAILS_PAGE_SIZE = 500
+BATTERY_DETAILS_MAX_PAGE_SIZE = 5000
+
+# Largest ?page_size accepted by the cursor-paginated /api/logs/ and /api/alerts/
+BATTERY_CURSOR_MAX_PAGE_SIZE = 5000
+
+# /api/dashboard/trend/: default window (seconds) and target number of points
+BATTERY_TREND_DEFAULT_WINDOW = 86400
+BATTERY_TREND_DEFAULT_POINTS = 100
+BATTERY_TREND_MAX_POINTS = 2000
+# Serve minute-or-coarser trend buckets from BatteryLogRollup (see manage.py backfill_rollups)
+BATTERY_TREND_USE_ROLLUPS = True
+
+# WebSocket broadcasts: changes are coalesced per battery/alert id and sent as one
+# batch_update frame per window (seconds). 0 sends on commit without batching.
+BATTERY_BROADCAST_WINDOW = 0.25
+
+# Alert evaluation runs on background worker threads fed by a bounded queue.
+# 0 workers evaluates on commit in the request thread.
+BATTERY_ALERT_WORKERS = 2
+BATTERY_ALERT_BATCH_SIZE = 500
+BATTERY_ALERT_QUEUE_SIZE = 100000
+BATTERY_ALERT_QUEUE_PUT_TIMEOUT = 1.0
+BATTERY_ALERT_QUEUE_BACKEND = 'batteries.alert_pipeline.LocalQueueBackend'
+# Seconds after an alert is resolved during which repeat crossings are folded
+# into it instead of raising a new alert.
+BATTERY_ALERT_SUPPRESSION_WINDOW = 300
+# Seconds a compiled set of alert rules is reused before being reloaded
+# (changes made in this process take effect immediately).
+BATTERY_ALERT_RULES_TTL = 60
+# Bulk resolutions above this many alerts broadcast a summary frame instead.
+BATTERY_BULK_BROADCAST_MAX_ALERTS = 5000
+
+# Dashboard stats and chart data come from in-memory counters updated on every
+# save; they are rebuilt from the database this often to correct drift.
+BATTERY_FLEET_RECONCILE_INTERVAL = 60
+
+# Online anomaly detection on streamed readings: a FAULT alert is raised when a
+# feature is more than THRESHOLD standard deviations from its running mean, once
+# it has seen WARMUP samples. ALPHA weights the newest sample; readings more than
+# MAX_GAP seconds apart are not compared.
+BATTERY_ANOMALY_DETECTION = True
+BATTERY_ANOMALY_ALPHA = 0.05
+BATTERY_ANOMALY_THRESHOLD = 4.0
+BATTERY_ANOMALY_WARMUP = 30
+BATTERY_ANOMALY_MAX_GAP = 300
+
+# Health and remaining-useful-life estimation from logs (see batteries/health.py).
+# WINDOW_DAYS of logs per estimate (None for all); samples further apart than
+# MAX_GAP seconds are not integrated; capacity estimates outside PLAUSIBLE_RANGE
+# percent of rated are discarded.
+BATTERY_HEALTH_WINDOW_DAYS = 7
+BATTERY_HEALTH_BATCH_SIZE = 200
+BATTERY_HEALTH_MAX_GAP = 900
+BATTERY_HEALTH_MIN_CHARGE_SWING = 20
+BATTERY_HEALTH_MIN_TREND_CYCLES = 2
+BATTERY_HEALTH_END_OF_LIFE = 80
+BATTERY_HEALTH_PLAUSIBLE_RANGE = (20, 120)
+
+# Raise COMMUNICATION_ERROR for batteries that have not reported for
+# BATTERY_COMM_TIMEOUT seconds; checked at most every BATTERY_COMM_CHECK_INTERVAL.
+BATTERY_COMM_WATCHDOG = True
+BATTERY_COMM_TIMEOUT = 300
+BATTERY_COMM_CHECK_INTERVAL = 5
+
+# Bulk telemetry ingestion (POST /api/batteries/ingest/)
+BATTERY_INGEST_MAX_READINGS = 10000
+BATTERY_INGEST_BATCH_SIZE = 1000
+
+# WebSocket ingestion (ws/ingest/): readings are written once this many are buffered
+# or after FLUSH_INTERVAL seconds. Set BATTERY_INGEST_TOKEN to require ?token=<value>.
+BATTERY_WS_INGEST_BATCH_SIZE = 500
+BATTERY_WS_INGEST_FLUSH_INTERVAL = 0.1
+# Readings a connection may have waiting; messages beyond this are refused with an error frame.
+BATTERY_WS_INGEST_MAX_BUFFER = 10000
+BATTERY_INGEST_TOKEN = os.environ.get('BATTERY_INGEST_TOKEN')
+
+# Log retention (manage.py prune_logs): days to keep raw logs and each rollup tier.
+# None keeps a tier forever.
+BATTERY_LOG_RETENTION = {
+    'raw': 7,
+    'minute': 30,
+    'hour': 365,
+    'day': None,
+}
+BATTERY_RETENTION_BATCH_SIZE = 5000